@@ -0,0 +1,52 @@
+"""add time index to scheduled_notifications
+
+Bucket dispatch selects a minute's notifications by time every minute, and
+create_all never adds an index to an existing table. Built concurrently on
+PostgreSQL so a live table is not locked against writes while it builds.
+
+Revision ID: 16bdd4cf2076
+Revises: e1f27c72f0d1
+Create Date: 2026-10-18 04:31:12.408215
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '16bdd4cf2076'
+down_revision: Union[str, Sequence[str], None] = 'e1f27c72f0d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLE = "scheduled_notifications"
+INDEX = "ix_scheduled_notifications_time"
+
+
+def _indexes() -> set[str] | None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(TABLE):
+        return None  # create_all will create it with the index
+    return {index["name"] for index in inspector.get_indexes(TABLE)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    indexes = _indexes()
+    if indexes is None or INDEX in indexes:
+        return
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(INDEX, TABLE, ["time"], postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    indexes = _indexes()
+    if indexes is None or INDEX not in indexes:
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(INDEX, table_name=TABLE, postgresql_concurrently=True)
@@ -0,0 +1,52 @@
+"""add next_fire_at to scheduled_notifications
+
+Tables are created by Base.metadata.create_all, which never alters an existing
+table. This adds the column (and its index) to databases created before it;
+fresh databases already have both and are left alone.
+
+Revision ID: a955dbc6827a
+Revises: 
+Create Date: 2026-10-18 04:16:03.781738
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a955dbc6827a'
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLE = "scheduled_notifications"
+INDEX = "ix_scheduled_notifications_next_fire_at"
+
+
+def _columns() -> set[str] | None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(TABLE):
+        return None  # create_all will create it with the column
+    return {column["name"] for column in inspector.get_columns(TABLE)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    columns = _columns()
+    if columns is None or "next_fire_at" in columns:
+        return
+    op.add_column(TABLE, sa.Column("next_fire_at", sa.DateTime(timezone=True), nullable=True))
+    op.create_index(INDEX, TABLE, ["next_fire_at"])
+    # Existing rows get their next_fire_at from the dispatch worker's backfill (dispatch_worker.py)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    columns = _columns()
+    if columns is None or "next_fire_at" not in columns:
+        return
+    op.drop_index(INDEX, table_name=TABLE)
+    op.drop_column(TABLE, "next_fire_at")
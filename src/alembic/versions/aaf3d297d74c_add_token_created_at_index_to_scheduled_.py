@@ -0,0 +1,54 @@
+"""add token/created_at index to scheduled_notifications
+
+Keyset pagination of /get-notifications walks a token's rows newest first on
+this index. Same as 16bdd4cf2076: create_all never adds it to an existing
+table, and it is built concurrently on PostgreSQL.
+
+Revision ID: aaf3d297d74c
+Revises: 16bdd4cf2076
+Create Date: 2026-10-18 04:33:40.517902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'aaf3d297d74c'
+down_revision: Union[str, Sequence[str], None] = '16bdd4cf2076'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLE = "scheduled_notifications"
+INDEX = "ix_scheduled_notifications_token_created_at_id"
+
+
+def _indexes() -> set[str] | None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(TABLE):
+        return None  # create_all will create it with the index
+    return {index["name"] for index in inspector.get_indexes(TABLE)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    indexes = _indexes()
+    if indexes is None or INDEX in indexes:
+        return
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index(
+            INDEX, TABLE, ["token", sa.text("created_at DESC"), "id"], postgresql_concurrently=True
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    indexes = _indexes()
+    if indexes is None or INDEX not in indexes:
+        return
+    with op.get_context().autocommit_block():
+        op.drop_index(INDEX, table_name=TABLE, postgresql_concurrently=True)
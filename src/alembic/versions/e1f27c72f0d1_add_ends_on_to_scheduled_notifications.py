@@ -0,0 +1,48 @@
+"""add ends_on to scheduled_notifications
+
+Same as a955dbc6827a: adds the column to databases created before it and
+leaves tables created by create_all alone.
+
+Revision ID: e1f27c72f0d1
+Revises: a955dbc6827a
+Create Date: 2026-10-18 04:16:24.062426
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e1f27c72f0d1'
+down_revision: Union[str, Sequence[str], None] = 'a955dbc6827a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+TABLE = "scheduled_notifications"
+
+
+def _columns() -> set[str] | None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table(TABLE):
+        return None  # create_all will create it with the column
+    return {column["name"] for column in inspector.get_columns(TABLE)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    columns = _columns()
+    if columns is None or "ends_on" in columns:
+        return
+    op.add_column(TABLE, sa.Column("ends_on", sa.Date(), nullable=True))
+    # Existing rows get ends_on from end_date in backfill_fire_times()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    columns = _columns()
+    if columns is None or "ends_on" not in columns:
+        return
+    op.drop_column(TABLE, "ends_on")
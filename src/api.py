@@ -1,29 +1,94 @@
 import os
-from datetime import datetime, time
+import threading
+import base64
+import json
+from datetime import datetime, timedelta
 import uuid
-import random
+from time import perf_counter
 
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException, Depends
+from fastapi import FastAPI, HTTPException, Depends, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from pyfcm import FCMNotification
-from sqlalchemy import create_engine
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from sqlalchemy import select, insert, delete, func, text, and_, or_
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from contextlib import asynccontextmanager
-from schema.models import NotificationRequest, SchedulingRequest, FrequencyType, TokenRegistrationRequest
-from utils.scheduler import initialize_scheduler
-from db import ScheduledNotification, Tones, TonePrompts, ToneEnum, TokenTonePreferences, Base
+from schema.models import NotificationRequest, SchedulingRequest, BatchSchedulingRequest, FrequencyType, TokenRegistrationRequest
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.triggers.date import DateTrigger
+from config import get_async_engine, get_engine
+from utils.scheduler import initialize_scheduler, jobstores, DEFAULT_JOBSTORE
+from utils.compact_jobstore import CompactJobStore, make_job
+from utils.job_listing import count_jobs, iter_job_pages, job_to_dict
+from utils.dispatcher import BucketDispatcher, BUCKETED_FREQUENCIES, backfill_fire_times, once_run_time, run_once
+from utils.fire_times import next_fire_at, parse_end_date
+from utils.prompt_catalog import PromptCatalog
+from utils.tone_cache import TokenToneCache
+from utils.response_cache import CachedResponse, ResponseCache
+from utils.mood_images import ImmutableStaticFiles, MoodImages
+from utils.token_registry import TokenRegistry
+from utils.token_pruner import TokenPruner
+from utils.send_pipeline import SendPipeline
+from utils.leader import LeaderElection
+from utils.reconciler import JobReconciler
+from utils.startup import Startup
+from utils.fcm import SendStatus
+from utils.metrics import (
+    GaugeFunc, http_request_duration, instrument_engine, instrument_scheduler, render_metrics
+)
+from db import ScheduledNotification, Tones, TonePrompts, TokenTonePreferences, Base
 
 # Load environment variables
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Components are module globals defined further down; they exist by the time the app starts
+    # Startup code: slow dependencies come up in the background, /readyz reports when they are done
+    startup.start()
+    yield
+    # Shutdown code
+    startup.wait(timeout=10)
+    try:
+        token_registry.close()
+    except Exception as e:
+        print(f"Error flushing token registrations on shutdown: {e}")
+    send_pipeline.close_retry_queue()
+    try:
+        token_pruner.close()
+    except Exception as e:
+        print(f"Error pruning dead tokens on shutdown: {e}")
+    if leader_election:
+        leader_election.stop()
+    if scheduler.running:
+        scheduler.shutdown()
+        print("APScheduler shut down.")
+    send_pipeline.close()
+    await async_engine.dispose()
+
 # Initialize FastAPI App
 app = FastAPI(
     title="Nudger",
-    description="Welcome to Nudger! This API allows you to register device tokens and send push notifications."
+    description="Welcome to Nudger! This API allows you to register device tokens and send push notifications.",
+    lifespan=lifespan
+)
+
+# Density-specific WebP variants of the mood images, built at startup under content-hashed names
+mood_images = MoodImages(
+    output_dir=os.getenv("MOOD_VARIANTS_DIR", "moods/variants"),
+    size_dp=int(os.getenv("MOOD_IMAGE_SIZE_DP", "80")),
+    quality=int(os.getenv("MOOD_IMAGE_QUALITY", "80"))
+)
+# Mounted ahead of /moods, which would otherwise match these paths first
+app.mount(
+    mood_images.url_prefix,
+    ImmutableStaticFiles(directory=mood_images.output_dir, check_dir=False),
+    name="mood_variants"
 )
 
 # Mount static files for mood images
@@ -44,17 +109,47 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Database configuration
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD")
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Record latency per route template (not per raw path, to keep label cardinality bounded)."""
+    started = perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        http_request_duration.observe(
+            perf_counter() - started,
+            request.method,
+            getattr(route, "path", "unmatched"),
+            status
+        )
 
-DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(DATABASE_URL, echo=False)
+# One sync engine per process: its pool serves every session and the persistent job store
+engine = get_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for endpoints that only touch the database, so queries don't block the event loop
+async_engine = get_async_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
+# Process-wide prompt cache shared by the scheduler jobs and the API endpoints
+prompt_catalog = PromptCatalog(SessionLocal, ttl_seconds=float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "300")))
+# Serialized /tones and /tone-prompts bodies with their ETags, dropped by POST /tone-prompts/refresh
+tone_responses = ResponseCache(ttl_seconds=float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "300")))
+# How long clients may reuse a tone listing before revalidating it with If-None-Match
+TONES_MAX_AGE_SECONDS = int(os.getenv("TONES_MAX_AGE_SECONDS", "60"))
+# Token -> tone lookups for the send path and /user-tone, written through by POST /user-tone
+tone_cache = TokenToneCache(
+    SessionLocal,
+    max_size=int(os.getenv("TONE_CACHE_MAX_SIZE", "100000")),
+    ttl_seconds=float(os.getenv("TONE_CACHE_TTL_SECONDS", "600"))
+)
+
 def get_db():
     """Dependency to get database session."""
     db = SessionLocal()
@@ -63,36 +158,52 @@ def get_db():
     finally:
         db.close()
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Startup code
-    if not scheduler.running:
-        scheduler.start()
-        print("APScheduler started on app startup.")
-    yield
-    # Shutdown code
-    if scheduler.running:
-        scheduler.shutdown()
-        print("APScheduler shut down.")
-
-fcm_service_account_file = os.getenv("FCM_SERVICE_ACCOUNT_FILE")
-fcm_project_id = os.getenv("FCM_PROJECT_ID")
-
-# Temporary solution:
-# In-memory storage for registered tokens
-registered_tokens = set()
+async def get_async_db():
+    """Dependency to get an async database session."""
+    async with AsyncSessionLocal() as db:
+        yield db
 
-# We'll store token-tone preferences directly in a simple table or use a workaround
-# For now, we'll create a simple token-based storage approach
+# Registered device tokens live in the device_tokens table; registrations are buffered and upserted in batches
+token_registry = TokenRegistry(
+    SessionLocal,
+    flush_size=int(os.getenv("TOKEN_REGISTRY_FLUSH_SIZE", "500")),
+    flush_interval=float(os.getenv("TOKEN_REGISTRY_FLUSH_INTERVAL_SECONDS", "2"))
+)
 
 # Initialize scheduler
 scheduler = initialize_scheduler()
+instrument_scheduler(scheduler)
+for alias, store in jobstores.items():
+    if hasattr(store, "engine") and store.engine is not engine:
+        instrument_engine(store.engine, f"jobstore_{alias}")
+
+GaugeFunc(
+    "nudger_scheduler_jobs", "Jobs per job store.",
+    lambda: {(alias,): count_jobs(store) for alias, store in jobstores.items()},
+    labelnames=("jobstore",)
+)
+
+# Tokens FCM reports as dead are removed from schedules, preferences, registrations and the job store
+token_pruner = TokenPruner(
+    scheduler,
+    SessionLocal,
+    jobstore=DEFAULT_JOBSTORE,
+    tone_cache=tone_cache,
+    batch_size=int(os.getenv("TOKEN_PRUNE_BATCH_SIZE", "500")),
+    flush_interval=float(os.getenv("TOKEN_PRUNE_INTERVAL_SECONDS", "5"))
+)
+
+# Largest number of notifications accepted by /schedule-notifications/batch
+schedule_batch_max_size = int(os.getenv("SCHEDULE_BATCH_MAX_SIZE", "10000"))
+
+# FCM transport, senders, rate limiter and retry queue, shared with dispatch_worker.py;
+# nothing is sent before send_pipeline.init_fcm() runs at startup, endpoints answer 503 until then
+send_pipeline = SendPipeline.from_env(SessionLocal, prompt_catalog, token_pruner)
 
-try:
-    fcm = FCMNotification(service_account_file=fcm_service_account_file, project_id=fcm_project_id)
-except Exception as e:
-    print(f"Error initializing FCM. Ensure '{fcm_service_account_file}' is correct and project_id is set if needed: {e}")
-    fcm = None
+GaugeFunc(
+    "nudger_retry_queue_depth", "Notifications waiting in the retry queue.",
+    lambda: {(): send_pipeline.retry_queue.depth()} if send_pipeline.retry_queue else {}
+)
 
 
 def send_scheduled_notification(token: str, title: str, body: str = "Scheduled notification"):
@@ -101,77 +212,256 @@ def send_scheduled_notification(token: str, title: str, body: str = "Scheduled n
     This function will be called by APScheduler at the scheduled time.
     Now uses tone-based prompts from the database based on user's tone preference.
     """
-    if not fcm:
+    if not send_pipeline.fcm:
         print(f"FCM not initialized, cannot send scheduled notification to {token}")
         return
     
     try:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Sending scheduled notification to {token}")
-          # Get a tone-based prompt based on user's preference
-        with SessionLocal() as db:
-            try:
-                # Get user's tone preference from database, default to neutral (tone_id=2)
-                token_pref = db.query(TokenTonePreferences).filter(TokenTonePreferences.token == token).first()
-                tone_id = token_pref.tone_id if token_pref else 2  # Default to neutral
-                
-                prompts = db.query(TonePrompts).filter(TonePrompts.tone_id == tone_id).all()
-                
-                if prompts:
-                    random_prompt = random.choice(prompts)
-                    notification_body = random_prompt.prompt
-                else:
-                    # Fallback to neutral tone if no prompts found for user's tone
-                    neutral_prompts = db.query(TonePrompts).filter(TonePrompts.tone_id == 2).all()
-                    if neutral_prompts:
-                        random_prompt = random.choice(neutral_prompts)
-                        notification_body = random_prompt.prompt
-                    else:
-                        notification_body = f"Scheduled reminder: {title}"  # Final fallback
-                    
-            except Exception as db_error:
-                print(f"Error fetching tone prompt: {db_error}")
-                notification_body = f"Scheduled reminder: {title}"  # Fallback
+        # Get a tone-based prompt based on user's preference
+        try:
+            # Get user's tone preference (cached), default to neutral (tone_id=2)
+            token_tone = tone_cache.get(token)
+            tone_id = token_tone.tone_id if token_tone else 2  # Default to neutral
+
+            # Prompts come from the in-memory catalog, which already falls back to neutral
+            notification_body = prompt_catalog.random_prompt(tone_id) or f"Scheduled reminder: {title}"  # Final fallback
+        except Exception as db_error:
+            print(f"Error fetching tone prompt: {db_error}")
+            notification_body = f"Scheduled reminder: {title}"  # Fallback
         
         print(f"Title: {title}, Body: {notification_body}")
         
-        result = fcm.notify(
-            fcm_token=token,
-            notification_title=title,
-            notification_body=notification_body
-        )
+        result = send_pipeline.sender.send(token, title, notification_body)
         
-        print(f"Scheduled notification result: {result}")
+        print(f"Scheduled notification result: {result.status.value} {result.message_id or result.error}")
+        token_pruner.report([result])
+        if send_pipeline.retry_queue:
+            send_pipeline.retry_queue.enqueue([(token, title, notification_body)], [result])
         
     except Exception as e:
         print(f"Error sending scheduled notification: {e}")
 
 
+# One scheduler job per fire minute instead of one job per scheduled notification
+dispatcher = BucketDispatcher(
+    scheduler,
+    SessionLocal,
+    send_pipeline.send_batch,
+    jobstore=DEFAULT_JOBSTORE,
+    batch_size=int(os.getenv("DISPATCH_BATCH_SIZE", "1000"))
+)
+
+# How scheduled notifications are fired:
+#   scheduler - minute bucket jobs and ONCE date jobs in APScheduler
+#   worker    - standalone dispatch_worker.py processes claim due rows by next_fire_at;
+#               the API only saves rows and existing bucket jobs do nothing when they fire
+dispatch_mode = os.getenv("DISPATCH_MODE", "scheduler")
+if dispatch_mode == "scheduler":
+    dispatcher.activate()
+
+
+def clear_once_fire_time(event):
+    """Keep next_fire_at current for ONCE notifications, whose date jobs fire outside the dispatcher."""
+    if event.job_id.startswith("bucket_"):
+        return
+    try:
+        dispatcher.finish_once(event.job_id)
+    except Exception as e:
+        print(f"Error clearing next fire time of {event.job_id}: {e}")
+
+
+scheduler.add_listener(clear_once_fire_time, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR | EVENT_JOB_MISSED)
+
+# Repairs drift between scheduled_notifications and the job store; in worker mode no jobs should exist
+reconciler = JobReconciler(
+    scheduler,
+    SessionLocal,
+    dispatcher,
+    jobstore=DEFAULT_JOBSTORE,
+    expect_jobs=dispatch_mode == "scheduler",
+    batch_size=int(os.getenv("RECONCILE_BATCH_SIZE", "1000"))
+)
+
+# Which process runs due jobs:
+#   leader - every worker writes jobs to the shared store, only the holder of a Postgres advisory lock runs them
+#   always - this process always runs them (single worker, or no persistent job store)
+#   off    - never run jobs here, e.g. API-only workers next to a separate dispatch process
+scheduler_mode = os.getenv("SCHEDULER_MODE", "leader" if DEFAULT_JOBSTORE == 'persistent' else "always")
+
+
+def reconcile_scheduled_jobs():
+    """Fill in fire times of older rows, then make the job store match the table."""
+    try:
+        backfill_fire_times(SessionLocal, datetime.now(), dispatcher.batch_size)
+        reconciler.run()
+    except Exception as e:
+        print(f"Error reconciling scheduled jobs: {e}")
+
+
+def become_scheduler_leader():
+    scheduler.resume()
+    print("APScheduler resumed, this process now runs scheduled jobs.")
+    reconcile_scheduled_jobs()
+
+
+def step_down_as_scheduler_leader():
+    scheduler.pause()
+    print("APScheduler paused, another process runs scheduled jobs.")
+
+
+leader_election = LeaderElection(
+    engine,
+    lock_id=int(os.getenv("SCHEDULER_LOCK_ID", "72631")),
+    on_elected=become_scheduler_leader,
+    on_demoted=step_down_as_scheduler_leader,
+    # Jobs added by other workers are only seen when the scheduler wakes up
+    on_tick=scheduler.wakeup,
+    poll_interval=float(os.getenv("SCHEDULER_LEADER_POLL_SECONDS", "5"))
+) if scheduler_mode == "leader" else None
+
+
+_scheduling_lock = threading.Lock()
+
+
+def start_scheduling():
+    """
+    Start the scheduler according to SCHEDULER_MODE. It always starts paused:
+    add_job() on a stopped scheduler would keep jobs in memory instead of writing
+    them to the shared job store. Safe to call more than once.
+    """
+    with _scheduling_lock:
+        if scheduler.running:
+            return
+        scheduler.start(paused=True)
+        print(f"APScheduler started paused (SCHEDULER_MODE={scheduler_mode}).")
+        if scheduler_mode == "always" or leader_election:
+            threading.Thread(target=run_jobs_when_fcm_ready, name="scheduling", daemon=True).start()
+
+
+def run_jobs_when_fcm_ready():
+    """
+    Resume the scheduler (or join the leader election) once FCM is initialized.
+    Misfired jobs run as soon as the scheduler resumes, and a job that runs while
+    FCM is still down is marked done without sending anything.
+    """
+    if not send_pipeline.ready.is_set():
+        print("Scheduled jobs wait for FCM to be initialized.")
+    send_pipeline.ready.wait()
+    if scheduler_mode == "always":
+        scheduler.resume()
+        print("APScheduler resumed.")
+        # Jobs already run meanwhile; readiness does not wait for a full reconciliation
+        reconcile_scheduled_jobs()
+    else:
+        leader_election.start()
+
+
+def check_database():
+    """Open the first pooled connection, so the first request does not pay for it."""
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+
+
+def build_mood_images():
+    mood_images.build()
+    tone_responses.invalidate()  # Cached /tones bodies still point at the PNGs
+
+
+# Initialized in parallel by lifespan; FCM and the prompt cache are optional for readiness,
+# but scheduled jobs only start running once FCM is up
+startup = Startup()
+startup.add("database", check_database)
+startup.add("scheduler", start_scheduling)
+startup.add("fcm", send_pipeline.init_fcm, required=False)
+startup.add("prompt_catalog", prompt_catalog.refresh, required=False)
+startup.add("mood_images", build_mood_images, required=False)
+
+
 @app.get("/")
 async def main():
     return {"message": "Welcome to Nudger API"}
 
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the process is up and serving requests. Touches no dependency."""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: every required startup component is initialized, with per-component timings."""
+    status = startup.status()
+    if not status["ready"]:
+        return JSONResponse(status_code=503, content=status)
+    return status
+
 # =========== Token Registration and Management ===========
 
 @app.post("/register-token")
 async def register_token(request: TokenRegistrationRequest):
     """
     Endpoint to register a device token for notifications.
-    Tokens are stored in an in-memory set.
+    Tokens are buffered in memory and upserted into the database in batches,
+    refreshing last_seen_at for tokens that are already known.
     """
     if not request.token:
         raise HTTPException(status_code=400, detail="Token is required")
     
-    registered_tokens.add(request.token)
-    print(f"Registered token: {request.token}. Total tokens: {len(registered_tokens)}")
+    token_registry.register(request.token)
+    print(f"Registered token: {request.token}. Pending flush: {token_registry.pending()}")
     return {"message": "Token registered successfully"}
 
+async def stream_registered_tokens(request: Request, cursor: str | None, page_size: int):
+    """Stream every registered token after `cursor` as NDJSON, stopping if the client goes away."""
+    try:
+        while True:
+            tokens = await run_in_threadpool(token_registry.list_tokens, cursor, page_size)
+            for device_token in tokens:
+                yield json.dumps({
+                    "token": device_token.token,
+                    "last_seen_at": device_token.last_seen_at.isoformat()
+                }) + "\n"
+            if len(tokens) < page_size or await request.is_disconnected():
+                return
+            cursor = tokens[-1].token
+    except Exception as e:
+        print(f"Error streaming registered tokens: {e}")
+        yield json.dumps({"error": f"Failed to retrieve registered tokens: {str(e)}"}) + "\n"
+
 @app.get("/registered-tokens")
-async def get_registered_tokens():
+def get_registered_tokens(
+    request: Request,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=1000),
+    format: str = Query("json", pattern="^(json|ndjson)$")
+):
     """
-    Endpoint to retrieve all registered device tokens.
+    Endpoint to retrieve registered device tokens, one page at a time.
+    Pass the returned next_cursor as cursor to get the following page.
+    With format=ndjson every token after the cursor is streamed, one per line,
+    reading `limit` tokens per query.
     Mainly for debugging and verification.
     """
-    return {"tokens": list(registered_tokens)}
+    if format == "ndjson":
+        return StreamingResponse(stream_registered_tokens(request, cursor, limit), media_type="application/x-ndjson")
+    
+    try:
+        tokens = token_registry.list_tokens(after=cursor, limit=limit)
+        return {
+            "tokens": [
+                {
+                    "token": device_token.token,
+                    "last_seen_at": device_token.last_seen_at.isoformat()
+                }
+                for device_token in tokens
+            ],
+            "next_cursor": tokens[-1].token if len(tokens) == limit else None
+        }
+    except Exception as e:
+        print(f"Error retrieving registered tokens: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve registered tokens: {str(e)}")
 
 # =========== Notification Sending ===========
 
@@ -180,7 +470,7 @@ async def send_notification(notification: NotificationRequest):
     """
     Endpoint to send a push notification.
     """
-    if not fcm:
+    if not send_pipeline.fcm:
         raise HTTPException(status_code=503, detail="FCM service is not initialized. Check server logs.")
     if not notification.token:
         raise HTTPException(status_code=400, detail="Token is required")
@@ -193,39 +483,24 @@ async def send_notification(notification: NotificationRequest):
         print(f"Attempting to send notification to token: {notification.token}")
         print(f"Title: {notification.title}, Body: {notification.body}, Image: {notification.image_url}")
         
-        result = fcm.notify(
-            fcm_token=notification.token,
-            notification_title=notification.title,
-            notification_body=notification.body,
-            notification_image=notification.image_url  # Optional: can be None or empty
+        # Runs on a dedicated thread pool so the event loop keeps serving other requests
+        result = await send_pipeline.api_sender.send_async(
+            notification.token,
+            notification.title,
+            notification.body,
+            notification.image_url  # Optional: can be None or empty
         )
         
-        print(f"FCM Raw Result: {result}")
-
-        # Check for success indicators
-        if result.get("message_id") or result.get("name"):
-            return {"message": "Notification sent successfully", "details": result}
-        if result.get("success") is True or (isinstance(result.get("success"), int) and result.get("success") > 0):
-            return {"message": "Notification sent successfully", "details": result}
-
-        # Check for failure indicators
-        error_message = "Failed to send notification"
-        if result.get("failure") is True or (isinstance(result.get("failure"), int) and result.get("failure") > 0):
-            if result.get("results") and isinstance(result["results"], list) and result["results"]:
-                error_detail = result["results"][0].get("error", "Unknown FCM error from results array")
-            else:
-                error_detail = result.get("error", "Unknown FCM error (failure flag/count was positive)")
-            error_message = f"{error_message}: {error_detail}"
-            print(f"FCM Failure: {error_detail}")
-            raise HTTPException(status_code=500, detail=error_message)
-        
-        if result.get("error"):
-            error_detail = result.get("error")
-            error_message = f"{error_message}: {error_detail}"
-            print(f"FCM Error: {error_detail}")
-            raise HTTPException(status_code=500, detail=error_message)        # Fallback for unexpected result structure if no clear success/failure
-        print(f"FCM Result (unexpected structure): {result}")
-        raise HTTPException(status_code=500, detail=f"{error_message} due to an unexpected FCM response structure. Full response: {result}")
+        print(f"FCM Result: {result.status.value} {result.message_id or result.error}")
+
+        if result.status == SendStatus.SUCCESS:
+            return {"message": "Notification sent successfully", "details": {"name": result.message_id}}
+
+        # The payload here comes from the caller, so INVALID may be its fault rather than the token's
+        token_pruner.report([result], statuses=(SendStatus.UNREGISTERED,))
+        error_message = f"Failed to send notification: {result.status.value}: {result.error}"
+        print(f"FCM Failure: {error_message}")
+        raise HTTPException(status_code=500, detail=error_message)
 
     except HTTPException: # Re-raise HTTPExceptions directly
         raise
@@ -234,13 +509,80 @@ async def send_notification(notification: NotificationRequest):
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 
+def validate_scheduling_request(request: SchedulingRequest) -> str | None:
+    """Return why a scheduling request cannot be scheduled, or None if it is valid."""
+    if request.frequency == FrequencyType.WEEKLY and not request.day_of_week:
+        return "day_of_week is required for weekly frequency"
+    if request.frequency == FrequencyType.MONTHLY and not request.day_of_month:
+        return "day_of_month is required for monthly frequency"
+    if request.frequency != FrequencyType.ONCE and request.frequency not in BUCKETED_FREQUENCIES:
+        return f"Unsupported frequency type: {request.frequency}"
+    return None
+
+
+def new_job_id(token: str) -> str:
+    """Generate a unique job ID for a scheduled notification."""
+    return f"scheduled_{token[:8]}_{uuid.uuid4().hex[:8]}"
+
+
+def add_once_job(request: SchedulingRequest, job_id: str, notification_id: int | None):
+    """
+    Schedule a one-off notification for today at its time, or tomorrow if that has passed.
+    The job only references its saved row; without one it carries the message itself.
+    """
+    hour, minute = map(int, request.time.split(':'))
+    target_time = once_run_time(hour, minute, datetime.now())
+    
+    if notification_id is not None:
+        func, args = run_once, [notification_id]
+    else:
+        func, args = send_scheduled_notification, [request.token, request.title, f"Scheduled reminder: {request.title}"]
+    scheduler.add_job(
+        func=func,
+        args=args,
+        id=job_id,
+        jobstore=DEFAULT_JOBSTORE,
+        replace_existing=False,
+        trigger='date',
+        run_date=target_time,
+        # APScheduler's default grace is 1s; allow for a leader failover or restart
+        misfire_grace_time=dispatcher.misfire_grace_time
+    )
+
+
+def scheduled_notification_values(request: SchedulingRequest, job_id: str) -> dict:
+    """Column values of the scheduled_notifications row for a request."""
+    ends_on = parse_end_date(request.end_date)
+    return {
+        "token": request.token,
+        "title": request.title,
+        "time": request.time,
+        "frequency": request.frequency,
+        "days_of_week": str(request.day_of_week) if request.day_of_week else None,
+        "day_of_month": request.day_of_month,
+        "end_date": request.end_date,
+        "ends_on": ends_on,
+        "job_id": job_id,
+        "next_fire_at": next_fire_at(
+            request.frequency,
+            request.time,
+            str(request.day_of_week) if request.day_of_week else None,
+            request.day_of_month,
+            ends_on,
+            datetime.now().astimezone()
+        )
+    }
+
+
 @app.post("/schedule-notification")
-async def schedule_notification(request: SchedulingRequest, db: Session = Depends(get_db)):
+def schedule_notification(request: SchedulingRequest, db: Session = Depends(get_db)):
     """
     Endpoint to schedule a notification based on the given parameters.
-    Saves to both APScheduler (for execution) and database (for persistence).
+    Recurring notifications are stored in the database and fired by the minute bucket
+    for their time; one-off notifications get their own APScheduler date job.
+    Declared sync so FastAPI runs it in the threadpool: the job store calls are blocking.
     """
-    if not fcm:
+    if not send_pipeline.fcm:
         raise HTTPException(status_code=503, detail="FCM service is not initialized. Check server logs.")
     
     try:
@@ -248,118 +590,43 @@ async def schedule_notification(request: SchedulingRequest, db: Session = Depend
         hour, minute = map(int, request.time.split(':'))
         
         # Generate a unique job ID
-        job_id = f"scheduled_{request.token[:8]}_{uuid.uuid4().hex[:8]}"
+        job_id = new_job_id(request.token)
         
-        # Determine the job parameters based on frequency
-        job_kwargs = {
-            'func': send_scheduled_notification,
-            'args': [request.token, request.title, f"Scheduled reminder: {request.title}"],
-            'id': job_id,
-            'jobstore': 'persistent',  # Use persistent storage
-            'replace_existing': False
-        }
+        # Validate frequency-specific parameters
+        error = validate_scheduling_request(request)
+        if error:
+            raise HTTPException(status_code=400, detail=error)
         
         # Parse end_date if provided
-        end_date = None
         if request.end_date:
-            end_date = datetime.strptime(request.end_date, '%d-%m-%Y').date()
-            job_kwargs['end_date'] = end_date
+            datetime.strptime(request.end_date, '%d-%m-%Y')
         
-        # Schedule based on frequency type
-        if request.frequency == FrequencyType.ONCE:
-            # Schedule for today at the specified time, or tomorrow if time has passed
-            now = datetime.now()
-            target_time = datetime.combine(now.date(), time(hour, minute))
-            
-            if target_time <= now:
-                # If the time has already passed today, schedule for tomorrow
-                target_time = target_time.replace(day=target_time.day + 1)
-            
-            scheduler.add_job(
-                trigger='date',
-                run_date=target_time,
-                **job_kwargs
-            )
-            
-        elif request.frequency == FrequencyType.DAILY:
-            scheduler.add_job(
-                trigger='cron',
-                hour=hour,
-                minute=minute,
-                **job_kwargs
-            )
-            
-        elif request.frequency == FrequencyType.WEEKLY:
-            if not request.day_of_week:
-                raise HTTPException(status_code=400, detail="day_of_week is required for weekly frequency")
-            
-            # Convert 1-7 to 0-6 (Monday=0, Sunday=6)
-            day_of_week = (request.day_of_week - 1) % 7
-            
-            scheduler.add_job(
-                trigger='cron',
-                day_of_week=day_of_week,
-                hour=hour,
-                minute=minute,
-                **job_kwargs
-            )
-            
-        elif request.frequency == FrequencyType.MONTHLY:
-            if not request.day_of_month:
-                raise HTTPException(status_code=400, detail="day_of_month is required for monthly frequency")
-            
-            scheduler.add_job(
-                trigger='cron',
-                day=request.day_of_month,
-                hour=hour,
-                minute=minute,
-                **job_kwargs
-            )
-            
-        elif request.frequency == FrequencyType.WEEKDAYS:
-            scheduler.add_job(
-                trigger='cron',
-                day_of_week='mon-fri',
-                hour=hour,
-                minute=minute,
-                **job_kwargs
-            )
-            
-        elif request.frequency == FrequencyType.WEEKENDS:
-            scheduler.add_job(
-                trigger='cron',
-                day_of_week='sat,sun',
-                hour=hour,
-                minute=minute,
-                **job_kwargs
-            )
-        else:
-            raise HTTPException(status_code=400, detail=f"Unsupported frequency type: {request.frequency}")
-        
-        # Start the scheduler if it's not already running
-        if not scheduler.running:
-            scheduler.start()
-        
-        # Save to database for persistence
+        # Save to database first: for recurring notifications the row is the schedule
+        notification_id = None
         try:
-            scheduled_notif = ScheduledNotification(
-                token=request.token,
-                title=request.title,
-                time=request.time,
-                frequency=request.frequency,
-                days_of_week=str(request.day_of_week) if request.day_of_week else None,
-                day_of_month=request.day_of_month,
-                end_date=request.end_date,
-                job_id=job_id
-            )
+            scheduled_notif = ScheduledNotification(**scheduled_notification_values(request, job_id))
             db.add(scheduled_notif)
             db.commit()
             db.refresh(scheduled_notif)
-            print(f"Saved notification to database with ID: {scheduled_notif.id}")
+            notification_id = scheduled_notif.id
+            print(f"Saved notification to database with ID: {notification_id}")
         except Exception as db_error:
             print(f"Error saving to database: {db_error}")
             db.rollback()
-            # Continue execution - APScheduler job is still scheduled
+            if request.frequency != FrequencyType.ONCE or dispatch_mode != "scheduler":
+                raise HTTPException(status_code=500, detail="Failed to save scheduled notification")
+            # Continue execution - the APScheduler date job below still fires
+        
+        # In worker dispatch mode the saved row is all there is: workers claim it by next_fire_at
+        if dispatch_mode == "scheduler":
+            if request.frequency == FrequencyType.ONCE:
+                add_once_job(request, job_id, notification_id)
+            else:
+                # All recurring notifications at this minute share one bucket job
+                dispatcher.ensure_bucket(hour, minute)
+        
+        # Start the scheduler if the request beat startup to it (honours SCHEDULER_MODE)
+        start_scheduling()
         
         print(f"Scheduled notification job '{job_id}' for token {request.token[:8]}... at {request.time}")
         print(f"Frequency: {request.frequency}, End date: {request.end_date}")
@@ -372,6 +639,8 @@ async def schedule_notification(request: SchedulingRequest, db: Session = Depend
             "day_of_month": request.day_of_month,
             "end_date": request.end_date
         }
+    except HTTPException:
+        raise
     except ValueError as e:
         if "time" in str(e).lower():
             raise HTTPException(status_code=400, detail="Invalid time format. Use HH:MM format.")
@@ -380,79 +649,347 @@ async def schedule_notification(request: SchedulingRequest, db: Session = Depend
         print(f"Error scheduling notification: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to schedule notification: {str(e)}")
 
+
+@app.post("/schedule-notifications/batch")
+def schedule_notifications_batch(request: BatchSchedulingRequest, db: Session = Depends(get_db)):
+    """
+    Endpoint to schedule many notifications in one call.
+    Every item is validated first, the valid ones are saved with one multi-row INSERT
+    in a single transaction, each distinct fire minute gets its bucket job once, and
+    the date jobs of ONCE items are written to the job store with one more INSERT.
+    Returns one result per item, in request order.
+    """
+    if not send_pipeline.fcm:
+        raise HTTPException(status_code=503, detail="FCM service is not initialized. Check server logs.")
+    if len(request.notifications) > schedule_batch_max_size:
+        raise HTTPException(status_code=400, detail=f"At most {schedule_batch_max_size} notifications per batch")
+    
+    results = []
+    valid = []  # (index, request, job_id)
+    for index, item in enumerate(request.notifications):
+        error = validate_scheduling_request(item)
+        if error:
+            results.append({"index": index, "status": "error", "detail": error})
+        else:
+            job_id = new_job_id(item.token)
+            valid.append((index, item, job_id))
+            results.append({"index": index, "status": "scheduled", "job_id": job_id})
+    
+    if not valid:
+        return {"message": "No notifications scheduled", "scheduled": 0, "failed": len(results), "results": results}
+    
+    try:
+        # One transaction; SQLAlchemy sends executemany INSERTs as multi-row VALUES batches
+        inserted = db.execute(
+            insert(ScheduledNotification).returning(ScheduledNotification.id, ScheduledNotification.job_id),
+            [scheduled_notification_values(item, job_id) for _, item, job_id in valid]
+        ).all()
+        db.commit()
+    except Exception as e:
+        print(f"Error saving notification batch: {e}")
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Failed to save notification batch: {str(e)}")
+    
+    ids_by_job_id = {job_id: notification_id for notification_id, job_id in inserted}
+    for index, _, job_id in valid:
+        results[index]["id"] = ids_by_job_id.get(job_id)
+    
+    # Register scheduler jobs in bulk: one bucket per distinct minute, date jobs only for ONCE
+    buckets = set()
+    once_jobs = []
+    if dispatch_mode == "scheduler":  # Otherwise dispatch workers pick the rows up by their next_fire_at
+        # Jobs added to a stopped scheduler stay in memory; it starts paused, see start_scheduling()
+        start_scheduling()
+        now = datetime.now()
+        for index, item, job_id in valid:
+            if item.frequency == FrequencyType.ONCE:
+                hour, minute = map(int, item.time.split(':'))
+                trigger = DateTrigger(once_run_time(hour, minute, now), timezone=scheduler.timezone)
+                once_jobs.append(make_job(
+                    scheduler, job_id, run_once, (ids_by_job_id[job_id],), trigger,
+                    dispatcher.misfire_grace_time, trigger.run_date
+                ))
+            else:
+                buckets.add(tuple(map(int, item.time.split(':'))))
+    
+    if once_jobs:
+        try:
+            store = scheduler._lookup_jobstore(DEFAULT_JOBSTORE)
+            if isinstance(store, CompactJobStore):
+                store.add_jobs(once_jobs)  # One multi-row INSERT
+            else:
+                for job in once_jobs:
+                    store.add_job(job)
+            scheduler.wakeup()  # Jobs written straight to the store are not seen until then
+        except Exception as e:
+            print(f"Error scheduling {len(once_jobs)} one-off notifications: {e}")
+            failed_job_ids = [job.id for job in once_jobs]
+            db.execute(delete(ScheduledNotification).where(ScheduledNotification.job_id.in_(failed_job_ids)))
+            db.commit()
+            for index, _, job_id in valid:
+                if job_id in failed_job_ids:
+                    results[index] = {"index": index, "status": "error", "detail": f"Failed to schedule job: {str(e)}"}
+    
+    try:
+        for hour, minute in buckets:
+            dispatcher.ensure_bucket(hour, minute)
+    except Exception as e:
+        print(f"Error creating dispatch buckets: {e}")
+        raise HTTPException(status_code=500, detail=f"Notifications saved but bucket jobs could not be created: {str(e)}")
+    
+    start_scheduling()
+    
+    scheduled = sum(1 for result in results if result["status"] == "scheduled")
+    print(f"Scheduled batch of {scheduled} notifications across {len(buckets)} buckets, {len(results) - scheduled} failed")
+    return {
+        "message": "Batch processed",
+        "scheduled": scheduled,
+        "failed": len(results) - scheduled,
+        "results": results
+    }
+
 # =========== Job Retrieval and Management ===========
 
+# Output fields of /get-notifications and the column each one is read from
+NOTIFICATION_FIELDS = {
+    "id": ScheduledNotification.id,
+    "title": ScheduledNotification.title,
+    "time": ScheduledNotification.time,
+    "frequency": ScheduledNotification.frequency,
+    "day_of_week": ScheduledNotification.days_of_week,
+    "day_of_month": ScheduledNotification.day_of_month,
+    "end_date": ScheduledNotification.end_date,
+    "job_id": ScheduledNotification.job_id,
+    "next_fire_at": ScheduledNotification.next_fire_at,
+    "created_at": ScheduledNotification.created_at,
+}
+
+
+def encode_notifications_cursor(created_at: datetime, notification_id: int) -> str:
+    """Opaque keyset cursor for the row a page ended on."""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{notification_id}".encode()).decode()
+
+
+def decode_notifications_cursor(cursor: str) -> tuple[datetime, int]:
+    created_at, notification_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at), int(notification_id)
+
+
 @app.get("/get-notifications/{token}")
-async def get_notifications(token: str, db: Session = Depends(get_db)):
+async def get_notifications(
+    token: str,
+    cursor: str | None = None,
+    limit: int = Query(100, ge=1, le=500),
+    fields: str | None = Query(None, description="Comma-separated subset of fields to return"),
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    Endpoint to retrieve all scheduled notifications for a specific token.
+    Endpoint to retrieve the scheduled notifications for a specific token, newest first.
+    Pages are keyset-paginated on (created_at DESC, id) and served from the
+    (token, created_at DESC, id) index; pass next_cursor back as cursor for the next page.
     """
+    requested = [field.strip() for field in fields.split(",") if field.strip()] if fields else list(NOTIFICATION_FIELDS)
+    unknown = [field for field in requested if field not in NOTIFICATION_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    
     try:
-        notifications = db.query(ScheduledNotification).filter(
-            ScheduledNotification.token == token
-        ).order_by(ScheduledNotification.created_at.desc()).all()
+        # Only the requested columns, plus the keyset columns needed for the cursor
+        columns = [NOTIFICATION_FIELDS[field].label(field) for field in requested]
+        columns += [ScheduledNotification.created_at.label("_created_at"), ScheduledNotification.id.label("_id")]
+        query = (
+            select(*columns)
+            .where(ScheduledNotification.token == token)
+            .order_by(ScheduledNotification.created_at.desc(), ScheduledNotification.id)
+            .limit(limit)
+        )
+        if cursor:
+            try:
+                cursor_created_at, cursor_id = decode_notifications_cursor(cursor)
+            except Exception:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+            query = query.where(or_(
+                ScheduledNotification.created_at < cursor_created_at,
+                and_(ScheduledNotification.created_at == cursor_created_at, ScheduledNotification.id > cursor_id)
+            ))
+        
+        rows = (await db.execute(query)).all()
         
         result = []
-        for notif in notifications:
-            result.append({
-                "id": notif.id,
-                "title": notif.title,
-                "time": notif.time,
-                "frequency": notif.frequency.value,
-                "day_of_week": int(notif.days_of_week) if notif.days_of_week and notif.days_of_week.isdigit() else None,
-                "day_of_month": notif.day_of_month,
-                "end_date": notif.end_date,
-                "job_id": notif.job_id,
-                "created_at": notif.created_at.isoformat() if notif.created_at else None
-            })
+        for row in rows:
+            notif = {}
+            for field in requested:
+                value = getattr(row, field)
+                if field == "frequency":
+                    value = value.value
+                elif field == "day_of_week":
+                    value = int(value) if value and value.isdigit() else None
+                elif field in ("created_at", "next_fire_at"):
+                    value = value.isoformat() if value else None
+                notif[field] = value
+            result.append(notif)
+        
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = encode_notifications_cursor(rows[-1]._created_at, rows[-1]._id)
         
         return {
             "notifications": result,
-            "count": len(result)
+            "count": len(result),
+            "next_cursor": next_cursor
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error retrieving notifications: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve notifications: {str(e)}")
 
 
+@app.get("/upcoming-notifications")
+async def get_upcoming_notifications(
+    within_minutes: int = Query(5, ge=1, le=1440),
+    at: str | None = Query(None, description="HH:MM; count the next fires at that minute instead"),
+    limit: int = Query(100, ge=0, le=1000),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Endpoint to list the notifications that fire next, soonest first: those due in the
+    next `within_minutes` minutes, or at the next occurrence of the minute `at`.
+    Both the count and the page are range scans of the next_fire_at index.
+    """
+    now = datetime.now().astimezone()
+    if at:
+        try:
+            hour, minute = map(int, at.split(':'))
+            start = once_run_time(hour, minute, now.replace(tzinfo=None)).astimezone()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid time format. Use HH:MM format.")
+        end = start + timedelta(minutes=1)
+    else:
+        start, end = now, now + timedelta(minutes=within_minutes)
+    
+    try:
+        window = and_(ScheduledNotification.next_fire_at >= start, ScheduledNotification.next_fire_at < end)
+        count = (await db.execute(select(func.count()).where(window))).scalar_one()
+        rows = (await db.execute(
+            select(
+                ScheduledNotification.id,
+                ScheduledNotification.token,
+                ScheduledNotification.title,
+                ScheduledNotification.frequency,
+                ScheduledNotification.next_fire_at
+            )
+            .where(window)
+            .order_by(ScheduledNotification.next_fire_at)
+            .limit(limit)
+        )).all() if limit else []
+        
+        return {
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "count": count,
+            "notifications": [
+                {
+                    "id": row.id,
+                    "token": row.token,
+                    "title": row.title,
+                    "frequency": row.frequency.value,
+                    "next_fire_at": row.next_fire_at.isoformat()
+                }
+                for row in rows
+            ]
+        }
+    except Exception as e:
+        print(f"Error retrieving upcoming notifications: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to retrieve upcoming notifications: {str(e)}")
+
+
 @app.get("/scheduled-jobs")
-async def get_scheduled_jobs():
+async def get_scheduled_jobs(
+    request: Request,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    token_prefix: str | None = None,
+    trigger: str | None = Query(None, pattern="^(date|cron|interval)$"),
+    next_run_after: datetime | None = None,
+    next_run_before: datetime | None = None,
+    page_size: int = Query(500, ge=1, le=5000)
+):
     """
-    Endpoint to retrieve all scheduled jobs.
+    Endpoint to retrieve scheduled jobs, optionally filtered by token prefix,
+    trigger type and next_run_time window.
+    The job store is read page by page and streamed, either as one JSON document
+    (format=json, same shape as before) or one job per line (format=ndjson).
+    Streaming stops as soon as the client disconnects.
     Mainly for debugging and verification.
     """
+    pages = iter_job_pages(
+        jobstores,
+        page_size=page_size,
+        token_prefix=token_prefix,
+        trigger=trigger,
+        next_run_after=next_run_after,
+        next_run_before=next_run_before
+    )
+    
     try:
-        jobs = scheduler.get_jobs()
-        job_list = []
-        
-        for job in jobs:
-            job_info = {
-                "id": job.id,
-                "name": job.name,
-                "trigger": str(job.trigger),
-                "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None,
-                "jobstore": job._jobstore_alias if hasattr(job, '_jobstore_alias') else 'unknown'
-            }
-            job_list.append(job_info)
-        
-        return {"jobs": job_list, "total_jobs": len(job_list)}
-        
+        # Read the first page before the response starts, so a failing job store is still a 500
+        first_page = await run_in_threadpool(next, pages, None)
     except Exception as e:
         print(f"Error retrieving scheduled jobs: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to retrieve scheduled jobs: {str(e)}")
+    
+    async def stream():
+        total = 0
+        page = first_page
+        if format == "json":
+            yield '{"jobs": ['
+        try:
+            while page is not None:
+                for job in page:
+                    if format == "ndjson":
+                        yield json.dumps(job_to_dict(job)) + "\n"
+                    else:
+                        yield ("," if total else "") + json.dumps(job_to_dict(job))
+                    total += 1
+                if await request.is_disconnected():
+                    print(f"Client disconnected after {total} scheduled jobs")
+                    return
+                # Each page is a blocking job store query, keep it off the event loop
+                page = await run_in_threadpool(next, pages, None)
+        except Exception as e:
+            print(f"Error retrieving scheduled jobs: {e}")
+            error = f"Failed to retrieve scheduled jobs: {str(e)}"
+            if format == "ndjson":
+                yield json.dumps({"error": error}) + "\n"
+            else:
+                # The status is already sent; close the document so the error is still parseable
+                yield f'], "error": {json.dumps(error)}, "total_jobs": {total}}}'
+            return
+        if format == "json":
+            yield f'], "total_jobs": {total}}}'
+    
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(stream(), media_type=media_type)
 
 
 @app.delete("/scheduled-jobs/{job_id}")
-async def cancel_scheduled_job(job_id: str, db: Session = Depends(get_db)):
+def cancel_scheduled_job(job_id: str, db: Session = Depends(get_db)):
     """
     Endpoint to cancel a scheduled job by its ID.
     Removes from both APScheduler and database.
+    Recurring notifications have no job of their own, removing the row stops them.
+    Declared sync so FastAPI runs it in the threadpool: the job store calls are blocking.
     """
     try:
         # Remove from APScheduler
-        scheduler.remove_job(job_id)
-        print(f"Cancelled scheduled job from APScheduler: {job_id}")
+        job_removed = False
+        try:
+            scheduler.remove_job(job_id)
+            job_removed = True
+            print(f"Cancelled scheduled job from APScheduler: {job_id}")
+        except JobLookupError:
+            pass
         
         # Remove from database
         db_notification = db.query(ScheduledNotification).filter(
@@ -465,6 +1002,8 @@ async def cancel_scheduled_job(job_id: str, db: Session = Depends(get_db)):
             print(f"Removed notification from database: ID {db_notification.id}")
         else:
             print(f"No database record found for job_id: {job_id}")
+            if not job_removed:
+                raise JobLookupError(job_id)
         
         return {"message": f"Job '{job_id}' cancelled successfully"}
         
@@ -473,69 +1012,88 @@ async def cancel_scheduled_job(job_id: str, db: Session = Depends(get_db)):
         db.rollback()
         raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found or could not be cancelled")
 
+
+@app.post("/scheduled-jobs/reconcile")
+def reconcile_jobs():
+    """
+    Endpoint to reconcile the job store with scheduled_notifications on demand:
+    removes orphaned jobs and recreates missing ones. Also runs at startup.
+    Declared sync so FastAPI runs it in the threadpool: the job store calls are blocking.
+    """
+    if not scheduler.running:
+        raise HTTPException(status_code=503, detail="Scheduler is not running")
+    try:
+        return reconciler.run()
+    except Exception as e:
+        print(f"Error reconciling scheduled jobs: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to reconcile scheduled jobs: {str(e)}")
+
 # =========== Tone Management ===========
 
+def cached_json_response(request: Request, cached: CachedResponse) -> Response:
+    """Serve a cached body, or a bodiless 304 if the client already has it."""
+    headers = {"ETag": cached.etag, "Cache-Control": f"public, max-age={TONES_MAX_AGE_SECONDS}"}
+    if ResponseCache.not_modified(cached, request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    return Response(cached.body, media_type="application/json", headers=headers)
+
 @app.get("/tones")
-async def get_tones(db: Session = Depends(get_db)):
+async def get_tones(request: Request, density: float | None = Query(None, gt=0, le=10)):
     """
     Endpoint to retrieve all available tones.
+    With `density` (the screen's density, e.g. 2.75) image_url points at the matching WebP variant,
+    without it at the original PNG.
+    Served from the response cache with an ETag; the database is only read on a miss.
     """
     try:
-        tones = db.query(Tones).all()
-        return {
-            "tones": [
-                {
-                    "tone_id": tone.tone_id,
-                    "tone_name": tone.tone_name.value,
-                    "display_name": tone.tone_name.value.capitalize(),
-                    "image_url": f"/moods/{tone.tone_name.value}.png"
-                } 
-                for tone in tones
-            ]
-        }
+        variant = mood_images.pick_density(density)
+        key = f"tones@{variant}x" if variant else "tones"
+        cached = tone_responses.get(key)
+        if cached is None:
+            generation = tone_responses.generation()
+            async with AsyncSessionLocal() as db:
+                tones = (await db.execute(select(Tones).order_by(Tones.tone_id))).scalars().all()
+            cached = tone_responses.put(key, {
+                "tones": [
+                    {
+                        "tone_id": tone.tone_id,
+                        "tone_name": tone.tone_name.value,
+                        "display_name": tone.tone_name.value.capitalize(),
+                        "image_url": mood_images.url(tone.tone_name.value, variant)
+                    } 
+                    for tone in tones
+                ]
+            }, generation)
+        return cached_json_response(request, cached)
     except Exception as e:
         print(f"Error retrieving tones: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve tones")
 
 @app.get("/user-tone/{token}")
-async def get_user_tone(token: str, db: Session = Depends(get_db)):
+async def get_user_tone(token: str, db: AsyncSession = Depends(get_async_db)):
     """
     Endpoint to retrieve the tone preference for a specific FCM token.
     Since we don't have users yet, we'll store tone preferences per token.
     Default to neutral tone (tone_id=2) if no preference is set.
     """
     try:
-        # Check if this token has a stored preference in database
-        token_pref = db.query(TokenTonePreferences).filter(TokenTonePreferences.token == token).first()
-        
-        if token_pref:
-            # Get the tone from database by ID
-            tone = db.query(Tones).filter(Tones.tone_id == token_pref.tone_id).first()
-            if tone:
-                return {
-                    "token": token,
-                    "tone": tone.tone_name.value,
-                    "tone_id": tone.tone_id,
-                    "is_default": False
-                }
-        
-        # Default to neutral tone if no preference is set
-        neutral_tone = db.query(Tones).filter(Tones.tone_name == ToneEnum.neutral).first()
-        if not neutral_tone:
+        # Cached; a miss costs one joined query for the preference and the neutral default
+        token_tone = await tone_cache.get_async(token, db)
+        if not token_tone:
             raise HTTPException(status_code=500, detail="Default neutral tone not found in database")
         
         return {
             "token": token,
-            "tone": neutral_tone.tone_name.value,
-            "tone_id": neutral_tone.tone_id,
-            "is_default": True
+            "tone": token_tone.tone_name,
+            "tone_id": token_tone.tone_id,
+            "is_default": token_tone.is_default
         }
     except Exception as e:
         print(f"Error retrieving user tone: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve user tone")
 
 @app.post("/user-tone")
-async def set_user_tone(request: dict, db: Session = Depends(get_db)):
+async def set_user_tone(request: dict, db: AsyncSession = Depends(get_async_db)):
     """
     Endpoint to set the tone preference for a specific FCM token.
     Expected request body: {"token": "fcm_token", "tone_id": 1}
@@ -548,14 +1106,19 @@ async def set_user_tone(request: dict, db: Session = Depends(get_db)):
             raise HTTPException(status_code=400, detail="Token is required")
         if not tone_id:
             raise HTTPException(status_code=400, detail="tone_id is required")
-        
+        # Clients may send the id as a string; asyncpg only binds an int to the integer key
+        try:
+            tone_id = int(tone_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="tone_id must be an integer")
+
         # Validate that the tone exists
-        tone = db.query(Tones).filter(Tones.tone_id == tone_id).first()
+        tone = await db.get(Tones, tone_id)
         if not tone:
             raise HTTPException(status_code=404, detail="Tone not found")
         
         # Check if preference already exists for this token
-        existing_pref = db.query(TokenTonePreferences).filter(TokenTonePreferences.token == token).first()
+        existing_pref = await db.get(TokenTonePreferences, token)
         if existing_pref:
             # Update existing preference
             existing_pref.tone_id = tone_id
@@ -565,7 +1128,8 @@ async def set_user_tone(request: dict, db: Session = Depends(get_db)):
             new_pref = TokenTonePreferences(token=token, tone_id=tone_id)
             db.add(new_pref)
         
-        db.commit()
+        await db.commit()
+        tone_cache.put(token, tone.tone_id, tone.tone_name.value)
         
         return {
             "message": "Tone preference updated successfully",
@@ -577,65 +1141,96 @@ async def set_user_tone(request: dict, db: Session = Depends(get_db)):
         raise
     except Exception as e:
         print(f"Error setting user tone: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail="Failed to set user tone")
 
 @app.get("/tone-prompts/{tone_id}")
-async def get_tone_prompts(tone_id: int, db: Session = Depends(get_db)):
+async def get_tone_prompts(tone_id: int, request: Request):
     """
     Endpoint to retrieve all prompts for a specific tone.
+    Served from the response cache with an ETag, like /tones.
     """
     try:
-        prompts = db.query(TonePrompts).filter(TonePrompts.tone_id == tone_id).all()
-        if not prompts:
-            raise HTTPException(status_code=404, detail="No prompts found for this tone")
-        
-        return {
-            "tone_id": tone_id,
-            "prompts": [
-                {
-                    "prompt_id": prompt.prompt_id,
-                    "text": prompt.prompt
-                }
-                for prompt in prompts
-            ]
-        }
+        key = f"tone-prompts/{tone_id}"
+        cached = tone_responses.get(key)
+        if cached is None:
+            generation = tone_responses.generation()
+            async with AsyncSessionLocal() as db:
+                prompts = (await db.execute(
+                    select(TonePrompts).where(TonePrompts.tone_id == tone_id).order_by(TonePrompts.prompt_id)
+                )).scalars().all()
+            if not prompts:
+                raise HTTPException(status_code=404, detail="No prompts found for this tone")
+            
+            cached = tone_responses.put(key, {
+                "tone_id": tone_id,
+                "prompts": [
+                    {
+                        "prompt_id": prompt.prompt_id,
+                        "text": prompt.prompt
+                    }
+                    for prompt in prompts
+                ]
+            }, generation)
+        return cached_json_response(request, cached)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error retrieving tone prompts: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve tone prompts")
 
 @app.get("/random-tone-prompt/{tone_id}")
-async def get_random_tone_prompt(tone_id: int, db: Session = Depends(get_db)):
+async def get_random_tone_prompt(tone_id: int):
     """
     Endpoint to get a random prompt for a specific tone.
     This will be used by the notification scheduler.
     """
     try:
-        prompts = db.query(TonePrompts).filter(TonePrompts.tone_id == tone_id).all()
-        if not prompts:
-            # Fallback to neutral tone if no prompts found
-            neutral_tone = db.query(Tones).filter(Tones.tone_name == ToneEnum.neutral).first()
-            if neutral_tone:
-                prompts = db.query(TonePrompts).filter(TonePrompts.tone_id == neutral_tone.tone_id).all()
-        
-        if not prompts:
+        # The catalog resolves the neutral fallback ahead of time, so no DB round trip here
+        prompt = prompt_catalog.random_prompt(tone_id)
+        if not prompt:
             return {"prompt": "Reminder: Check your goals today!"}  # Fallback message
         
-        random_prompt = random.choice(prompts)
         return {
             "tone_id": tone_id,
-            "prompt": random_prompt.prompt
+            "prompt": prompt
         }
     except Exception as e:
         print(f"Error retrieving random tone prompt: {e}")
         return {"prompt": "Reminder: Check your goals today!"}  # Fallback message
 
+@app.post("/tone-prompts/refresh")
+async def refresh_tone_prompts():
+    """
+    Endpoint to drop the cached tones and tone prompts after they were changed in the database.
+    The catalog and the /tones and /tone-prompts responses are reloaded on the next lookup.
+    """
+    prompt_catalog.invalidate()
+    tone_responses.invalidate()
+    return {"message": "Tone prompt cache invalidated"}
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    """
+    Endpoint to inspect the in-memory caches.
+    Mainly for debugging and sizing.
+    """
+    return {
+        "prompt_catalog": prompt_catalog.stats(),
+        "token_tones": tone_cache.stats(),
+        "tone_responses": tone_responses.stats()
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """
+    Endpoint for Prometheus scraping (text exposition format).
+    Sync so the job store counts run in the threadpool, not on the event loop.
+    """
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
 # =========== Application Startup ===========
 
 if __name__ == "__main__":
-    # Start the scheduler when running the app
-    if not scheduler.running:
-        scheduler.start()
-        print("APScheduler started.")
-    
+    # The scheduler is started by the app's lifespan, so `uvicorn api:app --workers N` behaves the same
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,340 @@
+"""
+End-to-end load benchmark for the Nudger API and scheduler.
+
+Run from src/ against a Postgres database configured through the usual DB_* variables:
+
+    python -m benchmarks.load_test --spawn-api --tokens 2000 --same-minute 5000 --output bench.json
+
+Scenarios:
+  api          registers N tokens, sets their tone and schedules one notification each
+               through the real endpoints, then drives concurrent reads of
+               /get-notifications/{token} and /user-tone/{token}
+  same-minute  schedules M notifications for the same minute and measures how long the
+               scheduler takes to deliver all of them to the fake FCM server
+
+FCM is replaced by utils/fake_fcm.py running inside this process, so the API has to send
+to it: either pass --spawn-api, or start the API yourself with
+FCM_TRANSPORT=fake FCM_ENDPOINT=http://127.0.0.1:<--fcm-port>.
+Results are written as JSON so runs can be compared across commits.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+from sqlalchemy import delete
+
+from config import get_engine
+from db import DeviceToken, NotificationRetry, TokenTonePreferences
+from utils.fake_fcm import FakeFCMConfig, create_server
+
+TONE_IDS = (1, 2, 3, 4)
+FREQUENCIES = ("daily", "weekdays", "weekends")
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize_latencies(latencies: list[float], errors: int, elapsed: float) -> dict:
+    """Throughput and latency percentiles (milliseconds) for one route."""
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / elapsed, 1) if elapsed > 0 else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 2) if values else 0.0,
+        "p50_ms": round(percentile(values, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(values, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(values, 0.99) * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2) if values else 0.0,
+    }
+
+
+class LoadDriver:
+    """Runs requests concurrently and records latency per route template."""
+
+    def __init__(self, base_url: str, concurrency: int):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.latencies: dict[str, list[float]] = {}
+        self.errors: dict[str, int] = {}
+        self.elapsed: dict[str, float] = {}
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def request(self, route: str, method: str, path: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self._session().request(method, self.base_url + path, timeout=30, **kwargs)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            response, ok = None, False
+        duration = time.perf_counter() - started
+        with self._lock:
+            self.latencies.setdefault(route, []).append(duration)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return response
+
+    def run(self, route: str, calls: list[tuple]):
+        """Run (method, path, kwargs) calls for one route with `concurrency` workers."""
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(lambda call: self.request(route, call[0], call[1], **call[2]), calls))
+        self.elapsed[route] = self.elapsed.get(route, 0.0) + time.perf_counter() - started
+
+    def report(self) -> dict:
+        return {
+            route: summarize_latencies(latencies, self.errors.get(route, 0), self.elapsed.get(route, 0.0))
+            for route, latencies in self.latencies.items()
+        }
+
+
+def run_api_scenario(driver: LoadDriver, prefix: str, tokens: int, reads: int, rng: random.Random) -> list[str]:
+    token_list = [f"{prefix}{i:07d}" for i in range(tokens)]
+
+    driver.run("POST /register-token", [("POST", "/register-token", {"json": {"token": t}}) for t in token_list])
+    driver.run("POST /user-tone", [
+        ("POST", "/user-tone", {"json": {"token": t, "tone_id": rng.choice(TONE_IDS)}}) for t in token_list
+    ])
+
+    job_ids = []
+    schedule_calls = []
+    for token in token_list:
+        schedule_calls.append(("POST", "/schedule-notification", {"json": {
+            "token": token,
+            "title": "Benchmark reminder",
+            "time": f"{rng.randrange(24):02d}:{rng.randrange(60):02d}",
+            "frequency": rng.choice(FREQUENCIES),
+        }}))
+
+    def schedule(call):
+        response = driver.request("POST /schedule-notification", call[0], call[1], **call[2])
+        if response is not None and response.ok:
+            job_ids.append(response.json().get("job_id"))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=driver.concurrency) as executor:
+        list(executor.map(schedule, schedule_calls))
+    driver.elapsed["POST /schedule-notification"] = time.perf_counter() - started
+
+    driver.run("GET /get-notifications/{token}", [
+        ("GET", f"/get-notifications/{rng.choice(token_list)}", {"params": {"limit": 20}}) for _ in range(reads)
+    ])
+    driver.run("GET /user-tone/{token}", [
+        ("GET", f"/user-tone/{rng.choice(token_list)}", {}) for _ in range(reads)
+    ])
+    return [job_id for job_id in job_ids if job_id]
+
+
+class DeliveryTracker:
+    """Collects the arrival time of every fake FCM send for tokens with a given prefix."""
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self.arrivals: dict[str, float] = {}
+        self.statuses: dict[int, int] = {}
+
+    def on_send(self, token: str, status: int):
+        if not token.startswith(self.prefix):
+            return
+        now = time.time()
+        with self._lock:
+            self.arrivals.setdefault(token, now)  # First attempt, retries do not move it
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def delivered(self) -> int:
+        return len(self.arrivals)
+
+
+def run_same_minute_scenario(
+    driver: LoadDriver, tracker: DeliveryTracker, count: int, lead_seconds: float, timeout: float, batch_size: int
+) -> tuple[dict, list[str]]:
+    # First whole minute that leaves `lead_seconds` for scheduling everything
+    fire_at = (datetime.now() + timedelta(seconds=lead_seconds + 60)).replace(second=0, microsecond=0)
+    tokens = [f"{tracker.prefix}{i:07d}" for i in range(count)]
+    notification = {"title": "Same-minute benchmark", "time": fire_at.strftime("%H:%M"), "frequency": "daily"}
+
+    job_ids = []
+    for start in range(0, count, batch_size):
+        chunk = tokens[start:start + batch_size]
+        response = driver.request("POST /schedule-notifications/batch", "POST", "/schedule-notifications/batch", json={
+            "notifications": [{"token": token, **notification} for token in chunk]
+        })
+        if response is not None and response.ok:
+            job_ids.extend(item["job_id"] for item in response.json().get("results", []) if item.get("job_id"))
+
+    scheduled_by = datetime.now()
+    if scheduled_by >= fire_at:
+        print(f"Scheduling finished at {scheduled_by:%H:%M:%S}, after the fire minute; raise --lead-seconds")
+
+    print(f"Waiting for {count} notifications due at {fire_at:%H:%M}")
+    deadline = fire_at.timestamp() + timeout
+    while tracker.delivered() < count and time.time() < deadline:
+        time.sleep(0.5)
+
+    delays = sorted(arrival - fire_at.timestamp() for arrival in tracker.arrivals.values())
+    first, last = (delays[0], delays[-1]) if delays else (0.0, 0.0)
+    result = {
+        "scheduled": count,
+        "delivered": len(delays),
+        "fire_minute": fire_at.isoformat(),
+        "first_delivery_s": round(first, 3),
+        "completion_s": round(last, 3),
+        "delivery_throughput_per_s": round(len(delays) / (last - first), 1) if last > first else None,
+        "delay_p50_s": round(percentile(delays, 0.50), 3),
+        "delay_p95_s": round(percentile(delays, 0.95), 3),
+        "delay_p99_s": round(percentile(delays, 0.99), 3),
+        "fcm_statuses": {str(status): n for status, n in sorted(tracker.statuses.items())},
+        "timed_out": len(delays) < count,
+    }
+    return result, job_ids
+
+
+def cleanup(driver: LoadDriver, job_ids: list[str]):
+    """Cancel everything the run scheduled; cancelling also deletes the stored rows."""
+    with ThreadPoolExecutor(max_workers=driver.concurrency) as executor:
+        list(executor.map(lambda job_id: driver._session().delete(f"{driver.base_url}/scheduled-jobs/{job_id}"), job_ids))
+
+
+def delete_token_rows(prefixes: list[str]) -> int:
+    """
+    Delete the registrations, tone preferences and queued retries of the run's fake
+    tokens, which no endpoint removes. Run after the API has stopped, so buffered
+    registrations are not flushed back in afterwards.
+    """
+    deleted = 0
+    with get_engine().begin() as connection:
+        for model in (DeviceToken, TokenTonePreferences, NotificationRetry):
+            for prefix in prefixes:
+                deleted += connection.execute(
+                    delete(model).where(model.token.startswith(prefix, autoescape=True))
+                ).rowcount
+    print(f"Deleted {deleted} rows of benchmark tokens")
+    return deleted
+
+
+def spawn_api(fcm_endpoint: str, base_url: str, env_overrides: dict) -> subprocess.Popen:
+    env = {**os.environ, "FCM_TRANSPORT": "fake", "FCM_ENDPOINT": fcm_endpoint, **env_overrides}
+    process = subprocess.Popen([sys.executable, "api.py"], env=env)
+    for _ in range(120):
+        try:
+            if requests.get(base_url + "/readyz", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("API was not ready within 60s")
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark for the Nudger API")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--scenario", choices=["api", "same-minute", "all"], default="all")
+    parser.add_argument("--tokens", type=int, default=1000, help="Tokens seeded by the api scenario")
+    parser.add_argument("--reads", type=int, default=5000, help="Read requests per read route")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--same-minute", type=int, default=5000, help="Notifications firing in the same minute")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Items per /schedule-notifications/batch call")
+    parser.add_argument("--lead-seconds", type=float, default=30, help="Minimum time left to schedule before the fire minute")
+    parser.add_argument("--delivery-timeout", type=float, default=300, help="Seconds after the fire minute to wait")
+    parser.add_argument("--fcm-port", type=int, default=9099)
+    parser.add_argument("--fcm-latency-ms", type=float, default=30)
+    parser.add_argument("--fcm-error-rate", type=float, default=0.0)
+    parser.add_argument("--fcm-unregistered-ratio", type=float, default=0.0)
+    parser.add_argument("--spawn-api", action="store_true", help="Start api.py wired to the fake FCM server")
+    parser.add_argument(
+        "--keep-data", action="store_true",
+        help="Do not cancel the scheduled notifications or delete the run's tokens afterwards"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON result file (printed to stdout when omitted)")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    run_id = uuid.uuid4().hex[:8]
+    api_prefix = f"bench_{run_id}_"
+    tracker = DeliveryTracker(prefix=f"benchsm_{run_id}_")
+    fcm_config = FakeFCMConfig(
+        latency_ms=args.fcm_latency_ms,
+        latency_jitter_ms=args.fcm_latency_ms / 3,
+        error_rate=args.fcm_error_rate,
+        unregistered_ratio=args.fcm_unregistered_ratio,
+        seed=args.seed,
+        on_send=tracker.on_send,
+    )
+    fcm_server = create_server(fcm_config, port=args.fcm_port)
+    threading.Thread(target=fcm_server.serve_forever, name="fake-fcm", daemon=True).start()
+    fcm_endpoint = f"http://127.0.0.1:{fcm_server.server_address[1]}"
+
+    api_process = spawn_api(fcm_endpoint, args.base_url, {}) if args.spawn_api else None
+    driver = LoadDriver(args.base_url, args.concurrency)
+    job_ids = []
+    result = {
+        "run_id": run_id,
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "parameters": vars(args),
+    }
+    try:
+        if args.scenario in ("api", "all"):
+            job_ids += run_api_scenario(driver, api_prefix, args.tokens, args.reads, rng)
+        if args.scenario in ("same-minute", "all"):
+            same_minute, same_minute_job_ids = run_same_minute_scenario(
+                driver, tracker, args.same_minute, args.lead_seconds, args.delivery_timeout, args.batch_size
+            )
+            result["same_minute"] = same_minute
+            job_ids += same_minute_job_ids
+        result["routes"] = driver.report()
+    finally:
+        if not args.keep_data and job_ids:
+            cleanup(driver, job_ids)
+        if api_process is not None:
+            api_process.terminate()
+            api_process.wait(timeout=30)
+        fcm_server.shutdown()
+        if not args.keep_data:
+            delete_token_rows([api_prefix, tracker.prefix])
+
+    output = json.dumps(result, indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,326 @@
+"""
+Accelerated-clock simulation of the notification scheduler.
+
+    python -m benchmarks.simulate_schedules --schedules 1000000 --days 7 --output sim.json
+
+Generates schedules of every FrequencyType and stores them in a scratch SQLite
+database. It then replays `--days` days of scheduler activity with a simulated clock:
+  - the bucket and ONCE triggers are built with the same helpers the API uses
+    (bucket_trigger, once_run_time) and advanced with APScheduler's own
+    get_next_fire_time
+  - every bucket fire runs the real BucketDispatcher query against the scratch database
+Each delivery is checked against an independent oracle of when the schedule should fire.
+The report lists fires per minute and missed, duplicate, unexpected and wrong-minute
+deliveries, plus how long each bucket's dispatch took. A bucket slower than the
+misfire grace time would be at risk in production.
+"""
+import argparse
+import contextlib
+import heapq
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from array import array
+from datetime import date, datetime, timedelta
+
+from apscheduler.triggers.date import DateTrigger
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+from tzlocal import get_localzone
+
+from db import Base, ScheduledNotification
+from schema.models import FrequencyType
+from utils.dispatcher import BucketDispatcher, backfill_fire_times, bucket_trigger, once_run_time
+
+DEFAULT_MIX = "daily=0.4,weekly=0.15,monthly=0.1,weekdays=0.15,weekends=0.1,once=0.1"
+
+
+class SimulatedClock:
+    """Clock handed to the dispatcher; the simulation moves it to each fire time."""
+
+    def __init__(self, start: datetime):
+        self.current = start
+
+    def now(self) -> datetime:
+        return self.current
+
+    def set(self, value: datetime):
+        self.current = value
+
+
+class Schedules:
+    """Generated schedules, one per index; token f"sim{index}" identifies the row."""
+
+    def __init__(self, count: int):
+        self.count = count
+        self.frequency: list[FrequencyType] = []
+        self.minute_of_day = array("H")
+        self.day_of_week = array("B")  # isoweekday for WEEKLY, 0 otherwise
+        self.day_of_month = array("B")  # 1-31 for MONTHLY, 0 otherwise
+        self.end_date: list[date | None] = []
+
+    def is_due(self, index: int, day: date) -> bool:
+        """Oracle, written from the API contract rather than from the dispatcher query."""
+        end_date = self.end_date[index]
+        if end_date is not None and day >= end_date:
+            return False  # The end date itself does not fire
+        frequency = self.frequency[index]
+        weekday = day.isoweekday()
+        if frequency == FrequencyType.DAILY:
+            return True
+        if frequency == FrequencyType.WEEKLY:
+            return self.day_of_week[index] == weekday
+        if frequency == FrequencyType.MONTHLY:
+            return self.day_of_month[index] == day.day
+        if frequency == FrequencyType.WEEKDAYS:
+            return weekday <= 5
+        if frequency == FrequencyType.WEEKENDS:
+            return weekday >= 6
+        return False  # ONCE is checked against its own run date
+
+
+def parse_mix(mix: str) -> tuple[list[FrequencyType], list[float]]:
+    frequencies, weights = [], []
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        frequencies.append(FrequencyType(name.strip()))
+        weights.append(float(weight))
+    return frequencies, weights
+
+
+def generate(schedules: Schedules, mix: str, hot_minutes: int, hot_ratio: float, end_date_ratio: float,
+             start: date, days: int, rng: random.Random, chunk_size: int = 50_000):
+    """Fill `schedules` and yield the matching scheduled_notifications rows in chunks."""
+    frequencies, weights = parse_mix(mix)
+    # A few popular minutes (09:00-style) carry `hot_ratio` of all schedules
+    hot = [rng.randrange(1440) for _ in range(hot_minutes)]
+    rows = []
+    for index in range(schedules.count):
+        frequency = rng.choices(frequencies, weights)[0]
+        minute_of_day = rng.choice(hot) if hot and rng.random() < hot_ratio else rng.randrange(1440)
+        day_of_week = rng.randint(1, 7) if frequency == FrequencyType.WEEKLY else 0
+        day_of_month = rng.randint(1, 31) if frequency == FrequencyType.MONTHLY else 0
+        end_date = None
+        if frequency != FrequencyType.ONCE and rng.random() < end_date_ratio:
+            end_date = start + timedelta(days=rng.randint(1, days))
+
+        schedules.frequency.append(frequency)
+        schedules.minute_of_day.append(minute_of_day)
+        schedules.day_of_week.append(day_of_week)
+        schedules.day_of_month.append(day_of_month)
+        schedules.end_date.append(end_date)
+        rows.append({
+            "token": f"sim{index}",
+            "title": "Simulated",
+            # Unpadded spellings are what rows saved before times were normalised look like
+            "time": f"{minute_of_day // 60}:{minute_of_day % 60:02d}" if index % 5 == 0
+                    else f"{minute_of_day // 60:02d}:{minute_of_day % 60:02d}",
+            "frequency": frequency,
+            "days_of_week": str(day_of_week) if day_of_week else None,
+            "day_of_month": day_of_month or None,
+            "end_date": end_date.strftime("%d-%m-%Y") if end_date else None,
+            "ends_on": end_date,
+            "job_id": f"sim_{index}",
+        })
+        if len(rows) == chunk_size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+
+class Recorder:
+    """send_batch replacement that counts deliveries per schedule for the current day."""
+
+    def __init__(self, schedules: Schedules, clock: SimulatedClock):
+        self.schedules = schedules
+        self.clock = clock
+        self.day_counts = bytearray(schedules.count)
+        self.per_minute: dict[str, int] = {}
+        self.wrong_minute = 0
+        self.total = 0
+
+    def send_batch(self, notifications: list):
+        now = self.clock.now()
+        minute_of_day = now.hour * 60 + now.minute
+        key = now.strftime("%Y-%m-%d %H:%M")
+        self.per_minute[key] = self.per_minute.get(key, 0) + len(notifications)
+        self.total += len(notifications)
+        for token, _title, _tone_id in notifications:
+            index = int(token[3:])
+            if self.day_counts[index] < 255:
+                self.day_counts[index] += 1
+            if self.schedules.minute_of_day[index] != minute_of_day:
+                self.wrong_minute += 1
+        return []
+
+
+def simulate(args) -> dict:
+    rng = random.Random(args.seed)
+    start = datetime.combine(date.fromisoformat(args.start), datetime.min.time())
+    end = start + timedelta(days=args.days)
+
+    print(f"Generating {args.schedules} schedules")
+    schedules = Schedules(args.schedules)
+    scratch_dir = tempfile.mkdtemp(prefix="nudger-sim-")
+    path = os.path.join(scratch_dir, "schedules.db")
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    started = time.perf_counter()
+    with Session() as db:
+        for rows in generate(
+            schedules, args.mix, args.hot_minutes, args.hot_ratio, args.end_date_ratio, start.date(), args.days, rng
+        ):
+            db.execute(insert(ScheduledNotification), rows)
+        db.commit()
+    # Normalise the unpadded times, as every start of the API does
+    with contextlib.redirect_stdout(io.StringIO()):
+        backfill_fire_times(Session, start - timedelta(microseconds=1), args.batch_size)
+    load_seconds = time.perf_counter() - started
+
+    clock = SimulatedClock(start)
+    recorder = Recorder(schedules, clock)
+    dispatcher = BucketDispatcher(None, Session, recorder.send_batch, batch_size=args.batch_size, clock=clock.now)
+
+    # Triggers exactly as the API creates them: one cron bucket per distinct minute, one date job per ONCE
+    timezone = get_localzone()
+    local_start = start.replace(tzinfo=timezone)
+    heap = []
+    once_by_minute: dict[int, list[int]] = {}
+    for index in range(schedules.count):
+        if schedules.frequency[index] == FrequencyType.ONCE:
+            once_by_minute.setdefault(schedules.minute_of_day[index], []).append(index)
+    bucket_minutes = sorted({
+        schedules.minute_of_day[index] for index in range(schedules.count)
+        if schedules.frequency[index] != FrequencyType.ONCE
+    })
+    for minute_of_day in bucket_minutes:
+        trigger = bucket_trigger(minute_of_day // 60, minute_of_day % 60, timezone)
+        heapq.heappush(heap, (trigger.get_next_fire_time(None, local_start), "bucket", minute_of_day, trigger))
+    for minute_of_day in once_by_minute:
+        run_date = once_run_time(minute_of_day // 60, minute_of_day % 60, start - timedelta(microseconds=1))
+        trigger = DateTrigger(run_date=run_date, timezone=timezone)
+        heapq.heappush(heap, (trigger.get_next_fire_time(None, local_start), "once", minute_of_day, trigger))
+
+    once_due = {}  # ONCE schedules must fire exactly once, on their run date
+    for minute_of_day, indexes in once_by_minute.items():
+        run_date = once_run_time(minute_of_day // 60, minute_of_day % 60, start - timedelta(microseconds=1))
+        for index in indexes:
+            once_due[index] = run_date.date()
+
+    checks = {"expected": 0, "delivered": 0, "missed": 0, "duplicates": 0, "unexpected": 0}
+    bucket_durations = []
+    slow_buckets = []
+
+    def close_day(day: date):
+        counts = recorder.day_counts
+        for index in range(schedules.count):
+            if schedules.frequency[index] == FrequencyType.ONCE:
+                expected = once_due.get(index) == day
+            else:
+                expected = schedules.is_due(index, day)
+            fired = counts[index]
+            if expected:
+                checks["expected"] += 1
+                if fired == 0:
+                    checks["missed"] += 1
+                elif fired > 1:
+                    checks["duplicates"] += fired - 1
+            elif fired:
+                checks["unexpected"] += fired
+            checks["delivered"] += fired
+        recorder.day_counts = bytearray(schedules.count)
+
+    print(f"Replaying {args.days} days with {len(bucket_minutes)} buckets and {len(once_by_minute)} ONCE minutes")
+    sim_started = time.perf_counter()
+    current_day = start.date()
+    while heap and heap[0][0] is not None and heap[0][0] < end.replace(tzinfo=timezone):
+        fire_time, kind, minute_of_day, trigger = heapq.heappop(heap)
+        local_fire = fire_time.replace(tzinfo=None)
+        while local_fire.date() > current_day:
+            close_day(current_day)
+            current_day += timedelta(days=1)
+        clock.set(local_fire)
+
+        dispatch_started = time.perf_counter()
+        if kind == "bucket":
+            with contextlib.redirect_stdout(io.StringIO()):
+                dispatcher.dispatch(minute_of_day // 60, minute_of_day % 60)
+        else:
+            recorder.send_batch([(f"sim{index}", "Simulated", None) for index in once_by_minute[minute_of_day]])
+        duration = time.perf_counter() - dispatch_started
+        bucket_durations.append(duration)
+        if duration > args.misfire_grace_time:
+            slow_buckets.append({"fire_time": local_fire.isoformat(), "seconds": round(duration, 3)})
+
+        next_fire = trigger.get_next_fire_time(fire_time, fire_time)
+        if next_fire is not None:
+            heapq.heappush(heap, (next_fire, kind, minute_of_day, trigger))
+    while current_day < end.date():
+        close_day(current_day)
+        current_day += timedelta(days=1)
+    sim_seconds = time.perf_counter() - sim_started
+    engine.dispose()
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    per_minute = sorted(recorder.per_minute.values())
+    busiest = sorted(recorder.per_minute.items(), key=lambda item: item[1], reverse=True)[:5]
+    durations = sorted(bucket_durations)
+    return {
+        "parameters": vars(args),
+        "schedules": schedules.count,
+        "simulated_days": args.days,
+        "buckets": len(bucket_minutes),
+        "load_seconds": round(load_seconds, 2),
+        "simulation_seconds": round(sim_seconds, 2),
+        "speedup": round(args.days * 86400 / sim_seconds, 1) if sim_seconds else None,
+        "deliveries_per_second": round(recorder.total / sim_seconds, 1) if sim_seconds else None,
+        "fires_per_minute": {
+            "active_minutes": len(per_minute),
+            "mean": round(sum(per_minute) / len(per_minute), 1) if per_minute else 0,
+            "p99": per_minute[min(int(len(per_minute) * 0.99), len(per_minute) - 1)] if per_minute else 0,
+            "max": per_minute[-1] if per_minute else 0,
+            "busiest": [{"minute": minute, "fires": fires} for minute, fires in busiest],
+        },
+        "dispatch_seconds": {
+            "p50": round(durations[len(durations) // 2], 4) if durations else 0,
+            "max": round(durations[-1], 4) if durations else 0,
+            "over_misfire_grace": slow_buckets[:20],
+        },
+        "checks": {**checks, "wrong_minute": recorder.wrong_minute},
+        "ok": checks["missed"] == 0 and checks["duplicates"] == 0 and checks["unexpected"] == 0
+              and recorder.wrong_minute == 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay days of scheduler activity with a simulated clock")
+    parser.add_argument("--schedules", type=int, default=100_000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--start", default=date.today().isoformat(), help="First simulated day (YYYY-MM-DD)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Frequency weights, e.g. daily=0.5,once=0.5")
+    parser.add_argument("--hot-minutes", type=int, default=3, help="Number of popular fire minutes")
+    parser.add_argument("--hot-ratio", type=float, default=0.3, help="Share of schedules in the popular minutes")
+    parser.add_argument("--end-date-ratio", type=float, default=0.2, help="Share of recurring schedules with an end date")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Dispatcher batch size")
+    parser.add_argument("--misfire-grace-time", type=float, default=300, help="Flag buckets slower than this")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="JSON result file (printed to stdout when omitted)")
+    args = parser.parse_args()
+
+    result = json.dumps(simulate(args), indent=2, default=str)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(result + "\n")
+        print(f"Results written to {args.output}")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
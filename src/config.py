@@ -0,0 +1,108 @@
+"""
+Database settings shared by the API, the scheduler's job store, dispatch workers
+and the seed scripts.
+
+Connection settings are read from DB_USER, DB_PASSWORD, DB_HOST, DB_PORT and
+DB_NAME. The POSTGRES_* names the seed scripts used (POSTGRES_USER, ..., POSTGRES_DB)
+are still accepted as fallbacks.
+
+Each process has one sync engine, from get_engine(), whose pool serves every
+session and the persistent job store, and one async engine for the async
+endpoints. Both pools are sized by the same settings:
+
+    DB_POOL_SIZE              connections kept open (default 10)
+    DB_MAX_OVERFLOW           extra connections opened under load (default 10)
+    DB_POOL_TIMEOUT           seconds a checkout waits for a free connection (default 30)
+    DB_POOL_RECYCLE           seconds before a connection is replaced (default 1800, -1 never)
+    DB_POOL_PRE_PING          test connections on checkout (default true)
+    DB_STATEMENT_TIMEOUT_MS   server-side statement_timeout (default 30000, 0 disables it)
+
+An API process can hold up to 2 * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections,
+which has to fit max_connections across every API and dispatch worker process.
+"""
+import os
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from utils.metrics import TimedAsyncQueuePool, TimedQueuePool, instrument_pool
+
+load_dotenv()
+
+
+def _env(name: str, fallback: str, default: str | None = None) -> str | None:
+    return os.getenv(name) or os.getenv(fallback) or default
+
+
+DB_USER = _env("DB_USER", "POSTGRES_USER")
+DB_PASSWORD = _env("DB_PASSWORD", "POSTGRES_PASSWORD")
+DB_HOST = _env("DB_HOST", "POSTGRES_HOST")
+DB_PORT = _env("DB_PORT", "POSTGRES_PORT", "5432")
+DB_NAME = _env("DB_NAME", "POSTGRES_DB")
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+
+DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+ASYNC_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+
+def missing_database_settings() -> list[str]:
+    """Names of the connection settings that are not set."""
+    settings = {"DB_USER": DB_USER, "DB_PASSWORD": DB_PASSWORD, "DB_HOST": DB_HOST, "DB_PORT": DB_PORT, "DB_NAME": DB_NAME}
+    return [name for name, value in settings.items() if not value]
+
+
+def database_configured() -> bool:
+    return not missing_database_settings()
+
+
+def require_database():
+    """Exit with the missing settings listed, for scripts that cannot do anything without the database."""
+    missing = missing_database_settings()
+    if missing:
+        raise SystemExit(f"Database is not configured, set {', '.join(missing)} (or their POSTGRES_* fallbacks)")
+
+
+def _pool_options(name: str) -> dict:
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "pool_logging_name": name,  # Labels the pool's metrics
+    }
+
+
+@lru_cache(maxsize=None)
+def get_engine():
+    """The process's sync engine. Connections are opened lazily, on first use."""
+    connect_args = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        connect_args["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    engine = create_engine(
+        DATABASE_URL, echo=False, poolclass=TimedQueuePool, connect_args=connect_args, **_pool_options("sync")
+    )
+    instrument_pool(engine, "sync")
+    return engine
+
+
+@lru_cache(maxsize=None)
+def get_async_engine():
+    """The process's async engine, for endpoints that only touch the database."""
+    connect_args = {}
+    if DB_STATEMENT_TIMEOUT_MS:
+        connect_args["server_settings"] = {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+    engine = create_async_engine(
+        ASYNC_DATABASE_URL, echo=False, poolclass=TimedAsyncQueuePool, connect_args=connect_args,
+        **_pool_options("async")
+    )
+    instrument_pool(engine.sync_engine, "async")
+    return engine
@@ -1,11 +1,10 @@
 # Standard imports
 import enum
-import os
 
 # Third-party imports
 import sqlalchemy as sa
 from sqlalchemy import (
-    create_engine, MetaData, Table, Column, Integer, String, Text, Numeric,
+    MetaData, Table, Column, Integer, String, Text, Numeric,
     Time, Boolean, Date, ForeignKey, Index, UniqueConstraint, Enum as SaEnum
 )
 from sqlalchemy.orm import relationship, declarative_base, sessionmaker
@@ -64,6 +63,17 @@ class TokenTonePreferences(Base):
     def __repr__(self):
         return f"TokenTonePreferences(token='{self.token[:8]}...', tone_id={self.tone_id})"
 
+class DeviceToken(Base):
+    """Registered device token model for the database."""
+    __tablename__ = 'device_tokens'
+    
+    token = Column(String(255), primary_key=True)  # FCM token, also the pagination key
+    created_at = Column(sa.DateTime(timezone=True), nullable=False, server_default=func.now())
+    last_seen_at = Column(sa.DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
+
+    def __repr__(self):
+        return f"DeviceToken(token='{self.token[:8]}...', last_seen_at={self.last_seen_at})"
+
 class ScheduledNotification(Base):
     """Scheduled notification model for the database."""
     __tablename__ = 'scheduled_notifications'
@@ -71,18 +81,41 @@ class ScheduledNotification(Base):
     id = Column(Integer, primary_key=True)
     token = Column(String(255), nullable=False, index=True)  # FCM token
     title = Column(String(255), nullable=False)
-    time = Column(String(10), nullable=False)  # HH:MM format
+    time = Column(String(10), nullable=False, index=True)  # HH:MM format, indexed for bucket dispatch
     frequency = Column(SaEnum(FrequencyType, name='frequency_type_enum', create_type=True), nullable=False)
     days_of_week = Column(String(20), nullable=True)  # Comma-separated string like "1,3,5" for Mon,Wed,Fri
     day_of_month = Column(Integer, nullable=True)  # For monthly frequency
     end_date = Column(String(20), nullable=True)  # DD-MM-YYYY format
+    ends_on = Column(Date, nullable=True)  # end_date as a date; nothing fires on or after it
     job_id = Column(String(255), nullable=True, unique=True)  # APScheduler job ID
+    next_fire_at = Column(sa.DateTime(timezone=True), nullable=True, index=True)  # Next due time, NULL once finished
     created_at = Column(sa.DateTime(timezone=True), nullable=False, server_default=func.now())
     updated_at = Column(sa.DateTime(timezone=True), nullable=False, server_default=func.now(), onupdate=func.now())
     
+    __table_args__ = (
+        # Keyset pagination of a token's notifications, newest first
+        Index('ix_scheduled_notifications_token_created_at_id', 'token', sa.text('created_at DESC'), 'id'),
+    )
+    
     def __repr__(self):
         return f"ScheduledNotification(id={self.id}, title='{self.title}', frequency='{self.frequency.value}', token='{self.token[:8]}...')"
 
+class NotificationRetry(Base):
+    """Notification waiting to be re-sent after a retryable FCM failure."""
+    __tablename__ = 'notification_retries'
+
+    id = Column(Integer, primary_key=True)
+    token = Column(String(255), nullable=False)  # FCM token
+    title = Column(String(255), nullable=False)
+    body = Column(Text, nullable=False)
+    attempts = Column(Integer, nullable=False, default=1)  # Sends tried so far, including the original
+    next_attempt_at = Column(sa.DateTime(timezone=True), nullable=False, index=True)  # Also the claim lease
+    last_error = Column(Text, nullable=True)
+    created_at = Column(sa.DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    def __repr__(self):
+        return f"NotificationRetry(id={self.id}, token='{self.token[:8]}...', attempts={self.attempts})"
+
 class TonePrompts(Base):
     """Tone prompts model for the database."""
     __tablename__ = 'tone_prompts'
@@ -99,15 +132,9 @@ class TonePrompts(Base):
 # --- Example Usage (PostgreSQL) ---
 if __name__ == '__main__':
 
-    DB_USER = os.getenv("DB_USER")
-    DB_PASSWORD = os.getenv("DB_PASSWORD")
-    DB_HOST = os.getenv("DB_HOST")
-    DB_PORT = os.getenv("DB_PORT")
-    DB_NAME = os.getenv("DB_NAME")
-
-    DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+    from config import get_engine
 
-    engine = create_engine(DATABASE_URL, echo=False) # Set echo=True to see SQL
+    engine = get_engine()
 
     print("Connecting to PostgreSQL and creating tables/ENUM types (if they don't exist)...")
     # Issue CREATE TYPE ... AS ENUM and CREATE TABLE statements
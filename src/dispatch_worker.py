@@ -0,0 +1,79 @@
+"""
+Standalone dispatch worker: fires due scheduled notifications by claiming rows of
+scheduled_notifications on next_fire_at with FOR UPDATE SKIP LOCKED.
+
+Run as many as needed, on as many nodes as needed, next to API workers started
+with DISPATCH_MODE=worker:
+
+    cd src
+    DISPATCH_MODE=worker uv run dispatch_worker.py --batch-size 500
+"""
+import argparse
+import os
+import signal
+
+from sqlalchemy.orm import sessionmaker
+
+from config import get_engine
+from utils.dispatch_worker import DispatchWorker
+from utils.prompt_catalog import PromptCatalog
+from utils.send_pipeline import SendPipeline
+from utils.token_pruner import TokenPruner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Claim and send due scheduled notifications.")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("DISPATCH_BATCH_SIZE", "500")))
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv("DISPATCH_POLL_INTERVAL_SECONDS", "1")))
+    parser.add_argument(
+        "--misfire-grace-time", type=int, default=int(os.getenv("DISPATCH_MISFIRE_GRACE_SECONDS", "300")),
+        help="Seconds late a notification may still be sent; later ones are skipped to their next fire time"
+    )
+    parser.add_argument("--no-backfill", action="store_true", help="Skip filling in next_fire_at for older rows")
+    args = parser.parse_args()
+
+    dispatch_mode = os.getenv("DISPATCH_MODE", "scheduler")
+    if dispatch_mode != "worker":
+        print(f"Warning: DISPATCH_MODE={dispatch_mode}, bucket jobs may fire the same notifications")
+
+    # The same send path as the API: FCM senders, rate limiter, retry queue and token pruning.
+    # Workers fire rows, not scheduler jobs, so dead tokens only have rows to remove
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=get_engine())
+    prompt_catalog = PromptCatalog(session_factory, ttl_seconds=float(os.getenv("PROMPT_CACHE_TTL_SECONDS", "300")))
+    token_pruner = TokenPruner(
+        None,
+        session_factory,
+        batch_size=int(os.getenv("TOKEN_PRUNE_BATCH_SIZE", "500")),
+        flush_interval=float(os.getenv("TOKEN_PRUNE_INTERVAL_SECONDS", "5"))
+    )
+    send_pipeline = SendPipeline.from_env(session_factory, prompt_catalog, token_pruner)
+    try:
+        send_pipeline.init_fcm()
+    except Exception:
+        raise SystemExit("FCM is not initialized, check the FCM settings")
+
+    worker = DispatchWorker(
+        session_factory,
+        send_pipeline.send_batch,
+        batch_size=args.batch_size,
+        misfire_grace_time=args.misfire_grace_time,
+        poll_interval=args.poll_interval
+    )
+    signal.signal(signal.SIGINT, lambda *_: worker.stop())
+    signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+
+    if not args.no_backfill:
+        worker.backfill()
+    print(f"Dispatch worker started (batch size {args.batch_size}, poll every {args.poll_interval}s)")
+    try:
+        worker.run()
+    finally:
+        # Let queued retries and pruned tokens reach the database before exiting
+        send_pipeline.close_retry_queue()
+        token_pruner.close()
+        send_pipeline.close()
+        print("Dispatch worker stopped.")
+
+
+if __name__ == "__main__":
+    main()
@@ -53,7 +53,8 @@ class SchedulingRequest(BaseModel):
             hour, minute = int(time_parts[0]), int(time_parts[1])
             if not (0 <= hour <= 23) or not (0 <= minute <= 59):
                 raise ValueError('Invalid time values')
-            return v
+            # Stored and matched as zero-padded HH:MM, whatever spelling was sent ("9:5", " 09:05")
+            return f"{hour:02d}:{minute:02d}"
         except (ValueError, AttributeError):
             raise ValueError('Time must be in HH:MM format (e.g., "14:30")')
     
@@ -67,3 +68,7 @@ class SchedulingRequest(BaseModel):
             return v
         except ValueError:
             raise ValueError('End date must be in DD-MM-YYYY format (e.g., "31-12-2025")')
+
+class BatchSchedulingRequest(BaseModel):
+    """Model for scheduling many notifications in one request."""
+    notifications: list[SchedulingRequest] = Field(..., min_length=1)
@@ -0,0 +1,181 @@
+import json
+import pickle
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.util import datetime_to_utc_timestamp, utc_timestamp_to_datetime
+from sqlalchemy import and_, select
+from sqlalchemy.exc import IntegrityError
+
+from utils.dispatcher import bucket_trigger, run_bucket, run_once
+
+RUN_BUCKET_REF = "utils.dispatcher:run_bucket"
+RUN_ONCE_REF = "utils.dispatcher:run_once"
+
+
+def make_job(scheduler, job_id: str, func, args: tuple, trigger, misfire_grace_time, next_run_time) -> Job:
+    """
+    Build a bucket or ONCE job with the defaults both use. Attributes are set directly:
+    Job() would validate the call signature and Job.__setstate__ would resolve the
+    function by name, which is most of the cost when thousands are loaded.
+    """
+    job = Job.__new__(Job)
+    job.id = job_id
+    job.func = func
+    job.func_ref = RUN_BUCKET_REF if func is run_bucket else RUN_ONCE_REF
+    job.trigger = trigger
+    job.executor = 'default'
+    job.args = args
+    job.kwargs = {}
+    job.name = func.__name__
+    job.misfire_grace_time = misfire_grace_time
+    job.coalesce = True
+    job.max_instances = 1
+    job.next_run_time = next_run_time
+    job._scheduler = scheduler
+    return job
+
+
+class CompactJobStore(SQLAlchemyJobStore):
+    """
+    SQLAlchemyJobStore that stores the scheduler's own jobs as a few bytes of JSON
+    instead of a pickled Job.
+
+    A bucket job is stored as {"b": [hour, minute]} and a ONCE date job as
+    {"n": <scheduled_notifications.id>}, plus the misfire grace time. Everything else
+    is rebuilt on load: the function from the kind, the trigger from bucket_trigger()
+    or from the row's next_run_time, the ID from the row's key. What a ONCE job sends
+    is read from its notification row when it fires, so nothing in
+    scheduled_notifications is copied into the job store.
+
+    Any other job is pickled as before, and rows written by the plain
+    SQLAlchemyJobStore still load; a bucket row is rewritten compactly the first
+    time it fires.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._bucket_triggers = {}
+        # A store given an engine shares it with the rest of the process and must not dispose it
+        self._owns_engine = kwargs.get('engine') is None
+
+    def shutdown(self):
+        if self._owns_engine:
+            self.engine.dispose()
+
+    def _bucket_trigger(self, hour: int, minute: int):
+        # Triggers are immutable, so every job of a bucket can share one
+        key = (hour, minute)
+        if key not in self._bucket_triggers:
+            self._bucket_triggers[key] = bucket_trigger(hour, minute, self._scheduler.timezone)
+        return self._bucket_triggers[key]
+
+    def _compact_state(self, job: Job) -> dict | None:
+        """The compact form of a job, or None if it has to be pickled."""
+        if job.kwargs or job.executor != 'default' or job.max_instances != 1 or not job.coalesce:
+            return None
+        if job.func_ref == RUN_BUCKET_REF and job.name == run_bucket.__name__:
+            hour, minute = job.args
+            if repr(job.trigger) != repr(self._bucket_trigger(hour, minute)):
+                return None
+            return {"b": [hour, minute], "g": job.misfire_grace_time}
+        if job.func_ref == RUN_ONCE_REF and job.name == run_once.__name__:
+            if not isinstance(job.trigger, DateTrigger) or job.trigger.run_date != job.next_run_time:
+                return None  # Paused, or not a plain date job
+            (notification_id,) = job.args
+            return {"n": notification_id, "g": job.misfire_grace_time}
+        return None
+
+    def _encode(self, job: Job) -> bytes:
+        state = self._compact_state(job)
+        if state is None:
+            return pickle.dumps(job.__getstate__(), self.pickle_protocol)
+        return json.dumps(state, separators=(',', ':')).encode()
+
+    def restore_job(self, job_id: str, next_run_time: float | None, job_state: bytes) -> Job:
+        """Rebuild a job from its row, whichever way it was encoded."""
+        if job_state[:1] != b'{':
+            return self._reconstitute_job(job_state)  # Pickled
+
+        state = json.loads(job_state)
+        run_time = utc_timestamp_to_datetime(next_run_time)
+        if run_time is not None:
+            run_time = run_time.astimezone(self._scheduler.timezone)
+        if "b" in state:
+            func, args, trigger = run_bucket, tuple(state["b"]), self._bucket_trigger(*state["b"])
+        else:
+            func, args, trigger = run_once, (state["n"],), DateTrigger(run_time)
+        job = make_job(self._scheduler, job_id, func, args, trigger, state["g"], run_time)
+        job._jobstore_alias = self._alias
+        return job
+
+    def lookup_job(self, job_id):
+        selectable = select(self.jobs_t.c.next_run_time, self.jobs_t.c.job_state).where(self.jobs_t.c.id == job_id)
+        with self.engine.begin() as connection:
+            row = connection.execute(selectable).first()
+            return self.restore_job(job_id, row.next_run_time, row.job_state) if row else None
+
+    def add_job(self, job):
+        # Same as SQLAlchemyJobStore.add_job/update_job, with the compact encoding
+        self._write(job, insert=True)
+
+    def update_job(self, job):
+        self._write(job, insert=False)
+
+    def add_jobs(self, jobs: list[Job]) -> int:
+        """Insert many jobs in one transaction. Raises ConflictingIdError, adding none, if any ID exists."""
+        rows = [
+            {
+                "id": job.id,
+                "next_run_time": datetime_to_utc_timestamp(job.next_run_time),
+                "job_state": self._encode(job),
+            }
+            for job in jobs
+        ]
+        if not rows:
+            return 0
+        with self.engine.begin() as connection:
+            try:
+                connection.execute(self.jobs_t.insert(), rows)
+            except IntegrityError:
+                raise ConflictingIdError(", ".join(row["id"] for row in rows[:3]))
+        return len(rows)
+
+    def _write(self, job, insert: bool):
+        values = {
+            "next_run_time": datetime_to_utc_timestamp(job.next_run_time),
+            "job_state": self._encode(job),
+        }
+        with self.engine.begin() as connection:
+            if insert:
+                try:
+                    connection.execute(self.jobs_t.insert().values(id=job.id, **values))
+                except IntegrityError:
+                    raise ConflictingIdError(job.id)
+            else:
+                result = connection.execute(self.jobs_t.update().values(**values).where(self.jobs_t.c.id == job.id))
+                if result.rowcount == 0:
+                    raise JobLookupError(job.id)
+
+    def _get_jobs(self, *conditions):
+        jobs = []
+        selectable = select(
+            self.jobs_t.c.id, self.jobs_t.c.next_run_time, self.jobs_t.c.job_state
+        ).order_by(self.jobs_t.c.next_run_time)
+        selectable = selectable.where(and_(*conditions)) if conditions else selectable
+        failed_job_ids = set()
+        with self.engine.begin() as connection:
+            for row in connection.execute(selectable):
+                try:
+                    jobs.append(self.restore_job(row.id, row.next_run_time, row.job_state))
+                except BaseException:
+                    self._logger.exception('Unable to restore job "%s" -- removing it', row.id)
+                    failed_job_ids.add(row.id)
+
+            # Remove all the jobs we failed to restore
+            if failed_job_ids:
+                connection.execute(self.jobs_t.delete().where(self.jobs_t.c.id.in_(failed_job_ids)))
+
+        return jobs
@@ -0,0 +1,121 @@
+import threading
+from datetime import datetime
+from typing import Callable
+
+from sqlalchemy import select, update
+
+from db import ScheduledNotification, TokenTonePreferences
+from schema.models import FrequencyType
+from utils.dispatcher import DueNotification, backfill_fire_times
+from utils.fire_times import next_fire_at
+from utils.metrics import Counter, scheduler_fire_lag
+
+dispatch_worker_rows = Counter(
+    "nudger_dispatch_worker_rows_total", "Due notifications claimed by dispatch workers (sent, stale).",
+    ("outcome",)
+)
+
+
+class DispatchWorker:
+    """
+    Fires scheduled notifications straight from scheduled_notifications.next_fire_at,
+    without a scheduler job per bucket.
+
+    Each batch is claimed with SELECT ... FOR UPDATE SKIP LOCKED, ordered by the
+    next_fire_at index, so any number of workers on any number of nodes can poll
+    the same table and each due row goes to exactly one of them. The rows stay
+    locked while they are sent and next_fire_at is advanced in the same
+    transaction, so a worker that dies mid-batch leaves them due for the next
+    one: delivery is at least once. Rows more than `misfire_grace_time` seconds
+    late are advanced without being sent, like a misfired scheduler job.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        send_batch: Callable[[list[DueNotification]], object],
+        batch_size: int = 500,
+        misfire_grace_time: int = 300,
+        poll_interval: float = 1.0,
+        clock: Callable[[], datetime] = lambda: datetime.now().astimezone(),
+    ):
+        self.session_factory = session_factory
+        self.send_batch = send_batch
+        self.batch_size = batch_size
+        self.misfire_grace_time = misfire_grace_time
+        self.poll_interval = poll_interval
+        self.clock = clock
+        self._stopped = threading.Event()
+
+    def claim_query(self, now: datetime):
+        """Due notifications with their tone preference, locked for this worker."""
+        return (
+            select(
+                ScheduledNotification.id,
+                ScheduledNotification.token,
+                ScheduledNotification.title,
+                ScheduledNotification.time,
+                ScheduledNotification.frequency,
+                ScheduledNotification.days_of_week,
+                ScheduledNotification.day_of_month,
+                ScheduledNotification.ends_on,
+                ScheduledNotification.next_fire_at,
+                TokenTonePreferences.tone_id
+            )
+            .outerjoin(TokenTonePreferences, TokenTonePreferences.token == ScheduledNotification.token)
+            .where(ScheduledNotification.next_fire_at <= now)
+            .order_by(ScheduledNotification.next_fire_at)
+            .limit(self.batch_size)
+            # Lock only the notification rows; other workers skip them instead of waiting
+            .with_for_update(skip_locked=True, of=ScheduledNotification)
+        )
+
+    def process_due(self) -> int:
+        """Claim, send and advance one batch of due notifications. Returns the number claimed."""
+        now = self.clock()
+        with self.session_factory() as db:
+            rows = db.execute(self.claim_query(now)).all()
+            if not rows:
+                db.commit()
+                return 0
+
+            batch = []
+            advanced = []
+            for row in rows:
+                lag = (now - row.next_fire_at.astimezone(now.tzinfo)).total_seconds()
+                if lag <= self.misfire_grace_time:
+                    batch.append((row.token, row.title, row.tone_id))
+                    scheduler_fire_lag.observe(lag, "dispatch_worker")
+                else:
+                    dispatch_worker_rows.inc("stale")
+                    print(f"Skipping notification {row.id}, {lag:.0f}s past its fire time")
+                advanced.append({
+                    "id": row.id,
+                    "next_fire_at": None if row.frequency == FrequencyType.ONCE else next_fire_at(
+                        row.frequency, row.time, row.days_of_week, row.day_of_month, row.ends_on, now
+                    ),
+                })
+
+            if batch:
+                self.send_batch(batch)
+                dispatch_worker_rows.inc("sent", amount=len(batch))
+            db.execute(update(ScheduledNotification), advanced)
+            db.commit()
+            return len(rows)
+
+    def backfill(self) -> int:
+        """Give notifications saved before next_fire_at existed their next fire time."""
+        return backfill_fire_times(self.session_factory, self.clock(), self.batch_size)
+
+    def run(self):
+        """Poll until stop() is called, draining full batches back to back."""
+        while not self._stopped.is_set():
+            try:
+                if self.process_due() >= self.batch_size:
+                    continue
+            except Exception as e:
+                print(f"Error dispatching due notifications: {e}")
+            self._stopped.wait(self.poll_interval)
+
+    def stop(self):
+        self._stopped.set()
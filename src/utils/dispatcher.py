@@ -0,0 +1,327 @@
+from datetime import datetime, time, timedelta
+from typing import Callable
+
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import and_, or_, select, update
+
+from db import ScheduledNotification, TokenTonePreferences
+from schema.models import FrequencyType
+from utils.fire_times import next_fire_at, parse_end_date
+
+# Recurring frequencies are served by minute buckets; ONCE stays a one-off date job
+BUCKETED_FREQUENCIES = (
+    FrequencyType.DAILY,
+    FrequencyType.WEEKLY,
+    FrequencyType.MONTHLY,
+    FrequencyType.WEEKDAYS,
+    FrequencyType.WEEKENDS,
+)
+
+# A due notification handed to the sender: (token, title, tone_id or None)
+DueNotification = tuple[str, str, int | None]
+
+_active_dispatcher = None
+
+
+def bucket_job_id(hour: int, minute: int) -> str:
+    """APScheduler job ID of the bucket that fires every day at hour:minute."""
+    return f"bucket_{hour:02d}{minute:02d}"
+
+
+def bucket_time(hour: int, minute: int) -> str:
+    """hour:minute as stored in scheduled_notifications.time, which SchedulingRequest normalises to HH:MM."""
+    return f"{hour:02d}:{minute:02d}"
+
+
+def bucket_trigger(hour: int, minute: int, timezone=None) -> CronTrigger:
+    """Trigger of the bucket job for hour:minute, fires once a day."""
+    return CronTrigger(hour=hour, minute=minute, timezone=timezone)
+
+
+def once_run_time(hour: int, minute: int, now: datetime) -> datetime:
+    """Run time of a ONCE notification: today at hour:minute, or tomorrow if that has passed."""
+    target_time = datetime.combine(now.date(), time(hour, minute))
+    if target_time <= now:
+        target_time += timedelta(days=1)
+    return target_time
+
+
+def normalize_times(session_factory) -> int:
+    """
+    Rewrite times saved before SchedulingRequest normalised them ("9:05", " 9:5") to
+    HH:MM, which is all bucket queries match. One UPDATE per distinct spelling, read
+    off the time index; safe to run on every start.
+    """
+    normalized = 0
+    with session_factory() as db:
+        times = db.execute(select(ScheduledNotification.time).distinct()).scalars().all()
+        for time_str in times:
+            try:
+                hour, minute = map(int, time_str.split(':'))
+            except ValueError:
+                print(f"Ignoring scheduled notifications with unparseable time {time_str!r}")
+                continue
+            if time_str != bucket_time(hour, minute):
+                normalized += db.execute(
+                    update(ScheduledNotification)
+                    .where(ScheduledNotification.time == time_str)
+                    .values(time=bucket_time(hour, minute))
+                ).rowcount
+        db.commit()
+    if normalized:
+        print(f"Normalised the time of {normalized} scheduled notifications to HH:MM")
+    return normalized
+
+
+def backfill_fire_times(session_factory, now: datetime, batch_size: int = 1000) -> int:
+    """
+    Normalise stored times, then fill in ends_on and next_fire_at for notifications
+    saved before those columns existed. Pages through the affected rows by id, one
+    short transaction per page; safe to run on every start, by any number of processes.
+    """
+    normalize_times(session_factory)
+    last_id = 0
+    filled = 0
+    while True:
+        with session_factory() as db:
+            rows = db.execute(
+                select(
+                    ScheduledNotification.id,
+                    ScheduledNotification.time,
+                    ScheduledNotification.frequency,
+                    ScheduledNotification.days_of_week,
+                    ScheduledNotification.day_of_month,
+                    ScheduledNotification.end_date,
+                    ScheduledNotification.ends_on,
+                    ScheduledNotification.next_fire_at
+                )
+                .where(
+                    or_(
+                        and_(
+                            ScheduledNotification.next_fire_at.is_(None),
+                            ScheduledNotification.frequency.in_(BUCKETED_FREQUENCIES)
+                        ),
+                        and_(ScheduledNotification.end_date.is_not(None), ScheduledNotification.ends_on.is_(None))
+                    ),
+                    ScheduledNotification.id > last_id  # Ended schedules stay NULL, so page by id
+                )
+                .order_by(ScheduledNotification.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            values = []
+            for row in rows:
+                ends_on = row.ends_on or parse_end_date(row.end_date)
+                fire_at = row.next_fire_at
+                if fire_at is None and row.frequency in BUCKETED_FREQUENCIES:
+                    fire_at = next_fire_at(
+                        row.frequency, row.time, row.days_of_week, row.day_of_month, ends_on, now
+                    )
+                values.append({"id": row.id, "ends_on": ends_on, "next_fire_at": fire_at})
+            db.execute(update(ScheduledNotification), values)
+            db.commit()
+        filled += len(rows)
+        last_id = rows[-1].id
+    if filled:
+        print(f"Backfilled fire times for {filled} scheduled notifications")
+    return filled
+
+
+def run_bucket(hour: int, minute: int):
+    """
+    Job function for a bucket. It is referenced by name from the job store,
+    so it has to stay a module-level function.
+    """
+    if _active_dispatcher is None:
+        print(f"No dispatcher configured, skipping bucket {hour:02d}:{minute:02d}")
+        return
+    _active_dispatcher.dispatch(hour, minute)
+
+
+def run_once(notification_id: int):
+    """Job function of a ONCE notification's date job; like run_bucket, referenced by name."""
+    if _active_dispatcher is None:
+        print(f"No dispatcher configured, skipping notification {notification_id}")
+        return
+    _active_dispatcher.send_once(notification_id)
+
+
+class BucketDispatcher:
+    """
+    Fires recurring notifications with one scheduler job per distinct fire minute.
+
+    Each bucket job loads every notification due in its minute with a single query
+    on scheduled_notifications.time (joined with the token's tone preference) and
+    hands them to `send_batch` in chunks of `batch_size`. The number of scheduler
+    jobs is bounded by the 1440 minutes in a day, not by the number of schedules.
+
+    Only rows whose next_fire_at has come are sent, and sending moves it on, so a
+    bucket or ONCE job run twice (e.g. by two leaders during a failover) does not
+    send the same notification twice.
+
+    A bucket claims its rows a chunk at a time: one short transaction locks the
+    chunk with SKIP LOCKED, moves each row's next_fire_at on and commits, and only
+    then is the chunk sent. No row stays locked while FCM is called, so cancelling
+    or pruning a notification never waits for a bucket, and two runs of the same
+    bucket split its rows instead of sending them twice. A process that dies
+    between a claim and its send loses that chunk: delivery is at most once.
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        session_factory,
+        send_batch: Callable[[list[DueNotification]], object],
+        jobstore: str = 'default',
+        batch_size: int = 1000,
+        misfire_grace_time: int = 300,
+        clock: Callable[[], datetime] = datetime.now,
+    ):
+        self.scheduler = scheduler
+        self.session_factory = session_factory
+        self.send_batch = send_batch
+        self.jobstore = jobstore
+        self.batch_size = batch_size
+        self.misfire_grace_time = misfire_grace_time
+        self.clock = clock  # Replaced by a simulated clock in benchmarks/simulate_schedules.py
+
+    def activate(self):
+        """Make this dispatcher the one that `run_bucket` jobs are routed to."""
+        global _active_dispatcher
+        _active_dispatcher = self
+
+    def ensure_bucket(self, hour: int, minute: int) -> str:
+        """
+        Create the bucket job for hour:minute if it does not exist yet. The job store
+        is checked every time (one primary key lookup): it is shared with the other
+        workers and the reconciler, which may have removed the bucket meanwhile.
+        """
+        job_id = bucket_job_id(hour, minute)
+        if self.scheduler.get_job(job_id, jobstore=self.jobstore) is None:
+            self.scheduler.add_job(
+                func=run_bucket,
+                trigger=bucket_trigger(hour, minute, self.scheduler.timezone),
+                args=[hour, minute],
+                id=job_id,
+                jobstore=self.jobstore,
+                replace_existing=True,
+                coalesce=True,
+                misfire_grace_time=self.misfire_grace_time
+            )
+            print(f"Created dispatch bucket '{job_id}'")
+        return job_id
+
+    def due_query(self, hour: int, minute: int, now: datetime):
+        """Select every recurring notification due at hour:minute on `now`'s date and not sent yet."""
+        weekday = now.isoweekday()  # 1 = Monday, same numbering as SchedulingRequest.day_of_week
+        return (
+            select(
+                ScheduledNotification.id,
+                ScheduledNotification.token,
+                ScheduledNotification.title,
+                ScheduledNotification.time,
+                ScheduledNotification.frequency,
+                ScheduledNotification.days_of_week,
+                ScheduledNotification.day_of_month,
+                ScheduledNotification.ends_on,
+                TokenTonePreferences.tone_id
+            )
+            .outerjoin(TokenTonePreferences, TokenTonePreferences.token == ScheduledNotification.token)
+            .where(
+                ScheduledNotification.time == bucket_time(hour, minute),
+                # Already moved on to its next fire if this bucket has run for `now` before
+                ScheduledNotification.next_fire_at <= (now if now.tzinfo else now.astimezone()),
+                # Cron triggers stopped at midnight of end_date, so the end date itself does not fire
+                or_(ScheduledNotification.ends_on.is_(None), ScheduledNotification.ends_on > now.date()),
+                or_(
+                    ScheduledNotification.frequency == FrequencyType.DAILY,
+                    and_(
+                        ScheduledNotification.frequency == FrequencyType.WEEKLY,
+                        ScheduledNotification.days_of_week == str(weekday)
+                    ),
+                    and_(
+                        ScheduledNotification.frequency == FrequencyType.MONTHLY,
+                        ScheduledNotification.day_of_month == now.day
+                    ),
+                    ScheduledNotification.frequency == (
+                        FrequencyType.WEEKDAYS if weekday <= 5 else FrequencyType.WEEKENDS
+                    )
+                )
+            )
+        )
+
+    def claim(self, hour: int, minute: int, now: datetime) -> list:
+        """Claim up to `batch_size` of the bucket's due rows and move their next_fire_at on."""
+        with self.session_factory() as db:
+            rows = db.execute(
+                self.due_query(hour, minute, now)
+                .order_by(ScheduledNotification.id)
+                .limit(self.batch_size)
+                # Lock only the notification rows; a concurrent run skips them instead of waiting
+                .with_for_update(skip_locked=True, of=ScheduledNotification)
+            ).all()
+            if rows:
+                db.execute(update(ScheduledNotification), [
+                    {
+                        "id": row.id,
+                        "next_fire_at": next_fire_at(
+                            row.frequency, row.time, row.days_of_week, row.day_of_month, row.ends_on, now
+                        ),
+                    }
+                    for row in rows
+                ])
+            db.commit()
+        return rows
+
+    def dispatch(self, hour: int, minute: int, now: datetime | None = None) -> int:
+        """
+        Send every notification in the bucket, claiming each chunk (and moving its
+        next_fire_at on) before sending it. Returns the number handed to the sender.
+        """
+        now = now or self.clock()
+        sent = 0
+        print(f"[{now.strftime('%Y-%m-%d %H:%M:%S')}] Dispatching bucket {hour:02d}:{minute:02d}")
+
+        while rows := self.claim(hour, minute, now):
+            self.send_batch([(row.token, row.title, row.tone_id) for row in rows])
+            sent += len(rows)
+
+        print(f"Bucket {hour:02d}:{minute:02d} dispatched {sent} notifications")
+        return sent
+
+    def send_once(self, notification_id: int) -> int:
+        """
+        Send a ONCE notification, reading what to send from its row. Clearing its
+        next_fire_at claims it first, so it is sent at most once. Returns the number sent.
+        """
+        with self.session_factory() as db:
+            row = db.execute(
+                select(ScheduledNotification.token, ScheduledNotification.title, TokenTonePreferences.tone_id)
+                .outerjoin(TokenTonePreferences, TokenTonePreferences.token == ScheduledNotification.token)
+                .where(ScheduledNotification.id == notification_id)
+            ).first()
+            claimed = row is not None and db.execute(
+                update(ScheduledNotification)
+                .where(ScheduledNotification.id == notification_id, ScheduledNotification.next_fire_at.is_not(None))
+                .values(next_fire_at=None)
+            ).rowcount
+            db.commit()
+        if row is None:
+            print(f"Scheduled notification {notification_id} no longer exists, nothing to send")
+            return 0
+        if not claimed:
+            print(f"Scheduled notification {notification_id} was already sent")
+            return 0
+        self.send_batch([(row.token, row.title, row.tone_id)])
+        return 1
+
+    def finish_once(self, job_id: str):
+        """A ONCE notification's date job has run or missed its grace: it has no next fire."""
+        with self.session_factory() as db:
+            db.execute(
+                update(ScheduledNotification)
+                .where(ScheduledNotification.job_id == job_id, ScheduledNotification.frequency == FrequencyType.ONCE)
+                .values(next_fire_at=None)
+            )
+            db.commit()
@@ -0,0 +1,153 @@
+"""
+Local stand-in for the FCM HTTP v1 send endpoint, for load tests without network.
+
+    python -m utils.fake_fcm --port 9099 --latency-ms 40 --error-rate 0.01 --unregistered-ratio 0.2
+
+then run the API with FCM_TRANSPORT=fake FCM_ENDPOINT=http://127.0.0.1:9099.
+Tokens starting with "dead" are always answered with UNREGISTERED, so pruning can be
+exercised deterministically. GET /stats returns the response counts so far.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SEND_PATH = re.compile(r"^/v1/projects/(?P<project>[^/]+)/messages:send$")
+
+
+class FakeFCMConfig:
+    """
+    Response mix of the fake server. Ratios are fractions of all sends.
+    `on_send(token, status)` is called for every answered send, e.g. to time deliveries.
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        latency_jitter_ms: float = 0,
+        error_rate: float = 0,
+        unregistered_ratio: float = 0,
+        invalid_ratio: float = 0,
+        seed: int | None = None,
+        on_send=None,
+    ):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.error_rate = error_rate
+        self.unregistered_ratio = unregistered_ratio
+        self.invalid_ratio = invalid_ratio
+        self.on_send = on_send
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.counts: dict[int, int] = {}
+
+    def latency(self) -> float:
+        with self._lock:
+            jitter = self._random.uniform(-self.latency_jitter_ms, self.latency_jitter_ms)
+        return max(self.latency_ms + jitter, 0) / 1000
+
+    def outcome(self, token: str) -> tuple[int, dict]:
+        """(HTTP status, JSON body) for one send, shaped like FCM's answers."""
+        with self._lock:
+            roll = self._random.random()
+        if token.startswith("dead") or roll < self.unregistered_ratio:
+            status, body = 404, _error(404, "NOT_FOUND", "Requested entity was not found.", "UNREGISTERED")
+        elif roll < self.unregistered_ratio + self.invalid_ratio:
+            status, body = 400, _error(400, "INVALID_ARGUMENT", "The registration token is not valid.", "INVALID_ARGUMENT")
+        elif roll < self.unregistered_ratio + self.invalid_ratio + self.error_rate:
+            status, body = 503, _error(503, "UNAVAILABLE", "The service is currently unavailable.", "UNAVAILABLE")
+        else:
+            status, body = 200, {"name": f"projects/fake/messages/{uuid.uuid4().hex}"}
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+        if self.on_send is not None:
+            self.on_send(token, status)
+        return status, body
+
+
+def _error(code: int, status: str, message: str, error_code: str) -> dict:
+    return {
+        "error": {
+            "code": code,
+            "message": message,
+            "status": status,
+            "details": [{"@type": "type.googleapis.com/google.firebase.fcm.v1.FcmError", "errorCode": error_code}],
+        }
+    }
+
+
+class FakeFCMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, so client connection pooling behaves as against FCM
+    config: FakeFCMConfig = None
+
+    def _reply(self, status: int, body: dict):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not SEND_PATH.match(self.path):
+            self._reply(404, _error(404, "NOT_FOUND", f"Unknown path {self.path}", "UNSPECIFIED_ERROR"))
+            return
+        token = request.get("message", {}).get("token", "")
+        time.sleep(self.config.latency())
+        self._reply(*self.config.outcome(token))
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._reply(200, {str(status): count for status, count in sorted(self.config.counts.items())})
+        else:
+            self._reply(404, _error(404, "NOT_FOUND", f"Unknown path {self.path}", "UNSPECIFIED_ERROR"))
+
+    def log_message(self, format, *args):
+        pass  # One line per send would dominate a load test
+
+
+def create_server(config: FakeFCMConfig, host: str = "127.0.0.1", port: int = 9099) -> ThreadingHTTPServer:
+    """Build the server; call serve_forever() on it, or run it in a thread for in-process tests."""
+    handler = type("ConfiguredFakeFCMHandler", (FakeFCMHandler,), {"config": config})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake FCM HTTP v1 endpoint for local load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9099)
+    parser.add_argument("--latency-ms", type=float, default=30, help="Mean response latency")
+    parser.add_argument("--latency-jitter-ms", type=float, default=10, help="Uniform jitter around the mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction answered 503 UNAVAILABLE")
+    parser.add_argument("--unregistered-ratio", type=float, default=0.0, help="Fraction answered 404 UNREGISTERED")
+    parser.add_argument("--invalid-ratio", type=float, default=0.0, help="Fraction answered 400 INVALID_ARGUMENT")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = FakeFCMConfig(
+        latency_ms=args.latency_ms,
+        latency_jitter_ms=args.latency_jitter_ms,
+        error_rate=args.error_rate,
+        unregistered_ratio=args.unregistered_ratio,
+        invalid_ratio=args.invalid_ratio,
+        seed=args.seed,
+    )
+    server = create_server(config, args.host, args.port)
+    print(f"Fake FCM listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
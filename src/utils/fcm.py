@@ -0,0 +1,278 @@
+import asyncio
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Iterable, NamedTuple
+
+import google.auth.transport.requests
+import requests
+from pyfcm import FCMNotification
+from pyfcm.errors import FCMNotRegisteredError, FCMServerError, InvalidDataError
+from requests.adapters import HTTPAdapter
+from urllib3 import Retry
+
+from utils.metrics import fcm_send_duration, fcm_sends
+
+
+class SendStatus(str, Enum):
+    """Outcome of a single FCM send."""
+    SUCCESS = "success"
+    UNREGISTERED = "unregistered"  # 404 UNREGISTERED, the token is dead
+    INVALID = "invalid"  # 400 INVALID_ARGUMENT, usually a malformed token
+    RETRYABLE = "retryable"  # 429, 5xx, timeouts and connection errors
+    FAILED = "failed"  # Anything else, e.g. authentication or sender mismatch
+
+
+class SendResult(NamedTuple):
+    """Per-token result of a send."""
+    token: str
+    status: SendStatus
+    message_id: str | None = None
+    error: str | None = None
+
+
+# (token, title, body) for batched sends
+Message = tuple[str, str, str]
+
+
+class CachedTokenFCMNotification(FCMNotification):
+    """
+    pyfcm client with one OAuth access token shared by all threads.
+
+    Stock pyfcm refreshes the token per thread, inline with a send. Here a daemon
+    thread refreshes it `refresh_margin` seconds before it expires and every
+    thread's session picks the new token up on its next request.
+    """
+
+    def __init__(self, *args, refresh_margin: float = 300, endpoint: str | None = None, **kwargs):
+        self._token_lock = threading.Lock()
+        self._access_token = None
+        self._refresh_margin = refresh_margin
+        self._stopped = threading.Event()
+        super().__init__(*args, **kwargs)
+        if endpoint:
+            # e.g. the local fake server: http://127.0.0.1:9099/v1/projects/<project>/messages:send
+            self.fcm_end_point = self.fcm_end_point.replace(self.FCM_END_POINT_BASE, endpoint.rstrip("/") + "/v1/projects", 1)
+        self._refresher = threading.Thread(target=self._refresh_loop, name="fcm-token-refresh", daemon=True)
+        self._refresher.start()
+
+    def _refresh_token(self):
+        # Callers hold _token_lock
+        self.credentials.refresh(google.auth.transport.requests.Request())
+        self._access_token = self.credentials.token
+
+    def _get_access_token(self):
+        if self._access_token is None:
+            with self._token_lock:
+                if self._access_token is None:
+                    self._refresh_token()
+        return self._access_token
+
+    @property
+    def requests_session(self):
+        session = super().requests_session
+        authorization = "Bearer " + self._get_access_token()
+        if session.headers.get("Authorization") != authorization:
+            session.headers["Authorization"] = authorization
+        return session
+
+    def _seconds_until_refresh(self) -> float:
+        expiry = self.credentials.expiry  # naive UTC, as google-auth stores it
+        if self._access_token is None or expiry is None:
+            return 0
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return (expiry - now).total_seconds() - self._refresh_margin
+
+    def _refresh_loop(self):
+        while not self._stopped.wait(max(self._seconds_until_refresh(), 0)):
+            try:
+                with self._token_lock:
+                    self._refresh_token()
+                print(f"Refreshed FCM access token, expires at {self.credentials.expiry} UTC")
+            except Exception as e:
+                print(f"Error refreshing FCM access token, retrying in 30s: {e}")
+                if self._stopped.wait(30):
+                    break
+
+    def send_request(self, payload=None, timeout=None):
+        # Stock pyfcm sleeps for Retry-After on a 429/503 and tries again, without limit, while
+        # holding a sender thread. Hand the response back instead: parse_response() raises
+        # FCMServerError for it, FCMSender reports RETRYABLE and the retry queue backs off.
+        return self.requests_session.post(self.fcm_end_point, data=payload, timeout=timeout)
+
+    def close(self):
+        """Stop the background token refresh."""
+        self._stopped.set()
+
+
+class StaticCredentials:
+    """Stand-in for Google credentials when talking to a fake FCM endpoint."""
+
+    def __init__(self, project_id: str):
+        self.project_id = project_id
+        self.token = "fake-access-token"
+        self.refresh(None)
+
+    def refresh(self, request):
+        # Naive UTC like google-auth
+        self.expiry = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(hours=1)
+
+
+class DryRunFCMClient:
+    """
+    Drop-in for the pyfcm client that never touches the network.
+    Every send succeeds after `latency_ms`, so the rest of the pipeline can be load tested.
+    """
+
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000
+        self.sent = 0
+
+    def notify(self, fcm_token: str, notification_title: str = None, notification_body: str = None, **kwargs) -> dict:
+        if self.latency:
+            time.sleep(self.latency)
+        self.sent += 1  # Approximate under concurrency, only used for eyeballing
+        return {"name": f"projects/dry-run/messages/{uuid.uuid4().hex}"}
+
+    def close(self):
+        pass
+
+
+def create_fcm_client(
+    service_account_file: str,
+    project_id: str,
+    pool_size: int = 32,
+    endpoint: str | None = None,
+    credentials=None,
+) -> FCMNotification:
+    """
+    Build the pyfcm client with one keep-alive connection pool shared by every
+    sending thread. pyfcm keeps a requests session per thread; mounting the same
+    adapter on all of them lets the threads reuse each other's connections.
+    The OAuth token is cached and refreshed in the background.
+    `endpoint` replaces https://fcm.googleapis.com, e.g. to point at utils/fake_fcm.py.
+    """
+    retries = Retry(
+        total=2,
+        backoff_factor=0.5,
+        status_forcelist=[502, 503],
+        allowed_methods=(Retry.DEFAULT_ALLOWED_METHODS | frozenset(["POST"])),
+        # A 503's Retry-After can be minutes; that wait belongs to the retry queue, not a sender thread
+        respect_retry_after_header=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retries)
+    return CachedTokenFCMNotification(
+        service_account_file=service_account_file,
+        project_id=project_id,
+        credentials=credentials,
+        adapter=adapter,
+        endpoint=endpoint
+    )
+
+
+def create_fcm_transport(
+    transport: str,
+    service_account_file: str | None,
+    project_id: str | None,
+    pool_size: int = 32,
+    endpoint: str | None = None,
+    dry_run_latency_ms: float = 0,
+):
+    """
+    Build the client FCMSender sends through:
+      "fcm"     - the real FCM API (optionally at `endpoint`)
+      "fake"    - an FCM-compatible server at `endpoint` without Google credentials
+      "dry-run" - no network at all, every send succeeds
+    """
+    if transport == "fcm":
+        return create_fcm_client(service_account_file, project_id, pool_size=pool_size, endpoint=endpoint)
+    if transport == "fake":
+        if not endpoint:
+            raise ValueError("FCM transport 'fake' needs an endpoint, e.g. http://127.0.0.1:9099")
+        project_id = project_id or "fake-project"
+        return create_fcm_client(
+            None, project_id, pool_size=pool_size, endpoint=endpoint, credentials=StaticCredentials(project_id)
+        )
+    if transport == "dry-run":
+        return DryRunFCMClient(latency_ms=dry_run_latency_ms)
+    raise ValueError(f"Unknown FCM transport '{transport}', expected one of: fcm, fake, dry-run")
+
+
+class FCMSender:
+    """
+    Sends notifications through pyfcm with at most `max_in_flight` concurrent requests.
+    Errors are never raised; every message gets a SendResult instead.
+
+    Senders that share a `rate_limiter` share its quota. A send that cannot get a
+    token within `acquire_timeout` seconds is reported as RETRYABLE without calling FCM.
+    """
+
+    def __init__(
+        self,
+        fcm,
+        max_in_flight: int = 32,
+        timeout: float = 10,
+        rate_limiter=None,
+        acquire_timeout: float | None = None,
+        name: str = "default",
+    ):
+        self.fcm = fcm
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.rate_limiter = rate_limiter
+        self.acquire_timeout = acquire_timeout
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="fcm-send")
+
+    def send(self, token: str, title: str, body: str, image_url: str | None = None) -> SendResult:
+        """Send one notification and classify the outcome."""
+        if self.rate_limiter is not None and not self.rate_limiter.acquire(self.acquire_timeout, sender=self.name):
+            return SendResult(token, SendStatus.RETRYABLE, error="Rate limited before sending")
+        started = time.perf_counter()
+        result = self._send(token, title, body, image_url)
+        fcm_send_duration.observe(time.perf_counter() - started, result.status.value)
+        fcm_sends.inc(result.status.value)
+        return result
+
+    def _send(self, token: str, title: str, body: str, image_url: str | None) -> SendResult:
+        try:
+            result = self.fcm.notify(
+                fcm_token=token,
+                notification_title=title,
+                notification_body=body,
+                notification_image=image_url,
+                timeout=self.timeout
+            )
+            return SendResult(token, SendStatus.SUCCESS, message_id=result.get("name"))
+        except FCMNotRegisteredError as e:
+            return SendResult(token, SendStatus.UNREGISTERED, error=str(e))
+        except InvalidDataError as e:
+            return SendResult(token, SendStatus.INVALID, error=str(e))
+        except (FCMServerError, requests.Timeout, requests.ConnectionError, requests.exceptions.RetryError) as e:
+            # RetryError: the adapter's own 502/503 retries ran out
+            return SendResult(token, SendStatus.RETRYABLE, error=str(e))
+        except Exception as e:
+            return SendResult(token, SendStatus.FAILED, error=str(e))
+
+    async def send_async(self, token: str, title: str, body: str, image_url: str | None = None) -> SendResult:
+        """Send one notification from async code without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.send, token, title, body, image_url)
+
+    def send_batch(self, messages: Iterable[Message]) -> list[SendResult]:
+        """Send (token, title, body) messages concurrently, results are in input order."""
+        return list(self._executor.map(lambda message: self.send(*message), messages))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def summarize(results: Iterable[SendResult]) -> dict[str, int]:
+    """Count results per status, e.g. for logging a batch."""
+    counts = {status.value: 0 for status in SendStatus}
+    for result in results:
+        counts[result.status.value] += 1
+    return counts
@@ -0,0 +1,59 @@
+from datetime import date, datetime, time, timedelta
+
+from tzlocal import get_localzone
+
+from schema.models import FrequencyType
+
+# A MONTHLY schedule on the 31st can skip two months; nothing recurs less often than that
+MAX_DAYS_AHEAD = 400
+
+
+def parse_end_date(end_date: str | None) -> date | None:
+    return datetime.strptime(end_date, '%d-%m-%Y').date() if end_date else None
+
+
+def is_due_on(frequency: FrequencyType, day: date, days_of_week: str | None, day_of_month: int | None) -> bool:
+    """Whether a recurring notification fires on `day`, with the same rules as the bucket dispatcher."""
+    weekday = day.isoweekday()  # 1 = Monday, same numbering as SchedulingRequest.day_of_week
+    if frequency == FrequencyType.DAILY:
+        return True
+    if frequency == FrequencyType.WEEKLY:
+        return bool(days_of_week) and str(weekday) in days_of_week.split(',')
+    if frequency == FrequencyType.MONTHLY:
+        return day_of_month == day.day
+    if frequency == FrequencyType.WEEKDAYS:
+        return weekday <= 5
+    if frequency == FrequencyType.WEEKENDS:
+        return weekday >= 6
+    return False
+
+
+def next_fire_at(
+    frequency: FrequencyType,
+    time_str: str,
+    days_of_week: str | None,
+    day_of_month: int | None,
+    ends_on: date | None,
+    after: datetime,
+    timezone=None,
+) -> datetime | None:
+    """
+    First time strictly after `after` at which a notification fires, as an aware datetime
+    in the scheduler's (local) timezone; None once it has ended. For ONCE this is the
+    run time of its date job: today at its time, or tomorrow if that has passed.
+    End dates are exclusive, like the cron triggers they replace.
+    """
+    timezone = timezone or get_localzone()
+    after = after.astimezone(timezone) if after.tzinfo else after.replace(tzinfo=timezone)
+    hour, minute = map(int, time_str.split(':'))
+
+    day = after.date()
+    for _ in range(MAX_DAYS_AHEAD):
+        if ends_on is not None and day >= ends_on:
+            return None
+        if frequency == FrequencyType.ONCE or is_due_on(frequency, day, days_of_week, day_of_month):
+            candidate = datetime.combine(day, time(hour, minute), tzinfo=timezone)
+            if candidate > after:
+                return candidate
+        day += timedelta(days=1)
+    return None
@@ -1,18 +1,11 @@
 
-import os
-from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
+from src.config import get_engine, require_database
 from src.db import Tones, ToneEnum, TonePrompts, Base
 
 
-DB_USER = os.getenv("POSTGRES_USER", "postgres")
-DB_PASSWORD = os.getenv("POSTGRES_PASSWORD", "0351036") 
-DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
-DB_PORT = os.getenv("POSTGRES_PORT", "5432")
-DB_NAME = os.getenv("POSTGRES_DB", "Nudger")
-
-DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-engine = create_engine(DATABASE_URL, echo=False)
+require_database()
+engine = get_engine()
 
 # Create tables if they don't exist
 Base.metadata.create_all(engine)
@@ -0,0 +1,134 @@
+from datetime import datetime
+from typing import Iterator
+
+from apscheduler.job import Job
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from apscheduler.util import datetime_to_utc_timestamp
+from sqlalchemy import func, select
+
+from utils.compact_jobstore import CompactJobStore
+
+TRIGGER_TYPES = {
+    "date": DateTrigger,
+    "cron": CronTrigger,
+    "interval": IntervalTrigger,
+}
+
+
+def job_to_dict(job: Job) -> dict:
+    """JSON-friendly summary of a job, as listed by /scheduled-jobs."""
+    return {
+        "id": job.id,
+        "name": job.name,
+        "trigger": str(job.trigger),
+        "next_run_time": job.next_run_time.isoformat() if job.next_run_time else None,
+        "jobstore": job._jobstore_alias if hasattr(job, '_jobstore_alias') else 'unknown'
+    }
+
+
+def count_jobs(store) -> int:
+    """Number of jobs in a job store, counted in SQL for persistent stores."""
+    if isinstance(store, SQLAlchemyJobStore):
+        with store.engine.begin() as connection:
+            return connection.execute(select(func.count()).select_from(store.jobs_t)).scalar_one()
+    return len(store.get_all_jobs())
+
+
+def _aware(value: datetime | None) -> datetime | None:
+    # Naive filter values are taken as local time, like the scheduler's own default timezone
+    if value is not None and value.tzinfo is None:
+        return value.astimezone()
+    return value
+
+
+def _has_token_prefix(job: Job, token_prefix: str) -> bool:
+    if job.args and isinstance(job.args[0], str):
+        return job.args[0].startswith(token_prefix)
+    # Jobs that reference their notification by ID only carry the token's first 8 characters, in the job ID
+    return job.id.startswith(f"scheduled_{token_prefix[:8]}")
+
+
+def _matches(job: Job, token_prefix, trigger_type, next_run_after, next_run_before) -> bool:
+    if token_prefix and not _has_token_prefix(job, token_prefix):
+        return False
+    if trigger_type and not isinstance(job.trigger, trigger_type):
+        return False
+    if next_run_after and (job.next_run_time is None or job.next_run_time < next_run_after):
+        return False
+    if next_run_before and (job.next_run_time is None or job.next_run_time > next_run_before):
+        return False
+    return True
+
+
+def _sqlalchemy_pages(store: SQLAlchemyJobStore, page_size, token_prefix, next_run_after, next_run_before):
+    # Keyset pages on the primary key so each page is a short, indexed query
+    jobs_t = store.jobs_t
+    last_id = None
+    while True:
+        query = select(jobs_t.c.id, jobs_t.c.next_run_time, jobs_t.c.job_state).order_by(jobs_t.c.id).limit(page_size)
+        if last_id is not None:
+            query = query.where(jobs_t.c.id > last_id)
+        if token_prefix:
+            # Job IDs embed the first 8 characters of the token (scheduled_<token[:8]>_...)
+            query = query.where(jobs_t.c.id.startswith(f"scheduled_{token_prefix[:8]}"))
+        if next_run_after:
+            query = query.where(jobs_t.c.next_run_time >= datetime_to_utc_timestamp(next_run_after))
+        if next_run_before:
+            query = query.where(jobs_t.c.next_run_time <= datetime_to_utc_timestamp(next_run_before))
+
+        with store.engine.begin() as connection:
+            rows = connection.execute(query).all()
+        if not rows:
+            return
+
+        page = []
+        for row in rows:
+            try:
+                if isinstance(store, CompactJobStore):
+                    page.append(store.restore_job(row.id, row.next_run_time, row.job_state))
+                else:
+                    page.append(store._reconstitute_job(row.job_state))
+            except Exception as e:
+                print(f"Unable to restore job {row.id}: {e}")
+        yield page
+
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1].id
+
+
+def iter_job_pages(
+    jobstores: dict,
+    page_size: int = 500,
+    token_prefix: str | None = None,
+    trigger: str | None = None,
+    next_run_after: datetime | None = None,
+    next_run_before: datetime | None = None,
+) -> Iterator[list[Job]]:
+    """
+    Yield filtered jobs from every job store, at most `page_size` jobs at a time.
+
+    Persistent stores are read page by page so only one page of pickled jobs is
+    held in memory; the next_run_time window and token prefix are pushed into SQL.
+    """
+    trigger_type = TRIGGER_TYPES[trigger] if trigger else None
+    next_run_after = _aware(next_run_after)
+    next_run_before = _aware(next_run_before)
+
+    for store in jobstores.values():
+        if isinstance(store, SQLAlchemyJobStore):
+            pages = _sqlalchemy_pages(store, page_size, token_prefix, next_run_after, next_run_before)
+        else:
+            jobs = store.get_all_jobs()
+            pages = (jobs[start:start + page_size] for start in range(0, len(jobs), page_size))
+
+        for page in pages:
+            matching = [
+                job for job in page
+                if _matches(job, token_prefix, trigger_type, next_run_after, next_run_before)
+            ]
+            if matching:
+                yield matching
@@ -0,0 +1,127 @@
+import threading
+from typing import Callable
+
+from sqlalchemy import text
+
+from utils.metrics import GaugeFunc
+
+
+class LeaderElection:
+    """
+    Elects one process, among all workers sharing a database, to run the scheduler.
+
+    Leadership is a session-level Postgres advisory lock held on a dedicated
+    connection. Every `poll_interval` seconds followers try to take the lock and
+    the leader checks that its connection (and so its lock) is still alive. When
+    the leader process dies, Postgres ends its session and releases the lock, so a
+    follower takes over within one poll interval. A leader whose connection dies
+    only notices on its next poll, while Postgres has already released the lock:
+    for up to one poll interval two processes run the scheduler. Dispatch is safe
+    to run twice, see BucketDispatcher.
+    `on_tick` runs on the leader every poll, e.g. to pick up jobs other workers added.
+    """
+
+    def __init__(
+        self,
+        engine,
+        lock_id: int,
+        on_elected: Callable[[], object],
+        on_demoted: Callable[[], object],
+        on_tick: Callable[[], object] | None = None,
+        poll_interval: float = 5.0,
+        name: str = "scheduler",
+    ):
+        self._engine = engine
+        self.lock_id = lock_id
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        self._on_tick = on_tick
+        self.poll_interval = poll_interval
+        self.name = name
+        self.is_leader = False
+        self._connection = None
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"{name}-leader-election", daemon=True)
+        GaugeFunc(
+            "nudger_leader", "1 while this process holds the leadership lock.",
+            lambda: {(self.name,): int(self.is_leader)}, labelnames=("role",)
+        )
+
+    def start(self):
+        self._thread.start()
+
+    def _try_acquire(self) -> bool:
+        if self._connection is None:
+            self._connection = self._engine.connect()
+        acquired = self._connection.execute(
+            text("SELECT pg_try_advisory_lock(:lock_id)"), {"lock_id": self.lock_id}
+        ).scalar()
+        self._connection.commit()  # Keep the connection idle, not idle in transaction
+        return bool(acquired)
+
+    def _still_leader(self) -> bool:
+        try:
+            self._connection.execute(text("SELECT 1"))
+            self._connection.commit()
+            return True
+        except Exception as e:
+            print(f"Lost the {self.name} leadership connection: {e}")
+            return False
+
+    def _drop_connection(self):
+        if self._connection is not None:
+            try:
+                self._connection.invalidate()  # Do not hand a possibly locked session back to the pool
+                self._connection.close()
+            except Exception:
+                pass
+            self._connection = None
+
+    def _step_down(self):
+        self.is_leader = False
+        try:
+            self._on_demoted()
+        except Exception as e:
+            print(f"Error stepping down as {self.name} leader: {e}")
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                if self.is_leader:
+                    if self._still_leader():
+                        if self._on_tick is not None:
+                            self._on_tick()
+                    else:
+                        self._step_down()
+                        self._drop_connection()
+                elif self._try_acquire():
+                    self.is_leader = True
+                    print(f"Elected {self.name} leader (advisory lock {self.lock_id})")
+                    try:
+                        self._on_elected()
+                    except Exception as e:
+                        print(f"Error taking over as {self.name} leader: {e}")
+            except Exception as e:
+                print(f"Error in {self.name} leader election: {e}")
+                if self.is_leader:
+                    self._step_down()
+                self._drop_connection()
+            self._stopped.wait(self.poll_interval)
+        self._release()
+
+    def _release(self):
+        # Runs on the election thread, which owns the connection
+        if self.is_leader:
+            self._step_down()
+            try:
+                self._connection.execute(text("SELECT pg_advisory_unlock(:lock_id)"), {"lock_id": self.lock_id})
+                self._connection.commit()
+            except Exception as e:
+                print(f"Error releasing {self.name} leadership lock: {e}")
+        self._drop_connection()
+
+    def stop(self):
+        """Step down and release the lock so another worker can take over right away."""
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout=self.poll_interval + 5)
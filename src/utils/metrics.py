@@ -0,0 +1,268 @@
+import threading
+import time
+from bisect import bisect_left
+from datetime import datetime
+
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Latency buckets in seconds, from sub-millisecond queries to slow FCM round trips
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Scheduler lag buckets in seconds, a bucket job is expected to fire within a few seconds
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60, 300)
+
+_registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Sharded:
+    """
+    Base for metrics that are written without locks.
+
+    Each thread updates only its own shard (a dict it created), so increments never
+    race; the scrape copies every shard and sums them. The event loop is a single
+    thread and gets one shard, every scheduler/executor thread gets its own.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        _registry.append(self)
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = {}
+            self._shards.append(shard)  # list.append is atomic
+        return shard
+
+    def _snapshots(self):
+        return [shard.copy() for shard in list(self._shards)]
+
+
+class Counter(_Sharded):
+    """Monotonic counter."""
+    type_name = "counter"
+
+    def inc(self, *labelvalues, amount: float = 1):
+        shard = self._shard()
+        shard[labelvalues] = shard.get(labelvalues, 0) + amount
+
+    def collect(self) -> dict:
+        totals = {}
+        for snapshot in self._snapshots():
+            for labelvalues, value in snapshot.items():
+                totals[labelvalues] = totals.get(labelvalues, 0) + value
+        return totals
+
+    def render(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}"
+            for labelvalues, value in sorted(self.collect().items())
+        ]
+
+
+class Histogram(_Sharded):
+    """Cumulative histogram with fixed buckets."""
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labelvalues):
+        shard = self._shard()
+        state = shard.get(labelvalues)
+        if state is None:
+            # Per-bucket counts (last slot is +Inf), then sum
+            state = shard[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    def collect(self) -> dict:
+        totals = {}
+        for snapshot in self._snapshots():
+            for labelvalues, state in snapshot.items():
+                state = list(state)
+                total = totals.setdefault(labelvalues, [0] * len(state))
+                for i, value in enumerate(state):
+                    total[i] += value
+        return totals
+
+    def render(self) -> list[str]:
+        lines = []
+        for labelvalues, state in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state[:-1]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, [("le", bound)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, labelvalues)
+            lines.append(f"{self.name}_sum{labels} {state[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class GaugeFunc:
+    """Gauge computed at scrape time by a callback returning {labelvalues: value}."""
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, callback, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        _registry.append(self)
+
+    def render(self) -> list[str]:
+        try:
+            values = self.callback()
+        except Exception as e:
+            print(f"Error collecting metric {self.name}: {e}")
+            return []
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labelvalues)} {value}"
+            for labelvalues, value in sorted(values.items())
+        ]
+
+
+def render_metrics() -> str:
+    """Every registered metric in the Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type_name}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# =========== Metrics ===========
+
+http_request_duration = Histogram(
+    "nudger_http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status")
+)
+fcm_send_duration = Histogram(
+    "nudger_fcm_send_duration_seconds", "FCM send latency by outcome.", ("status",)
+)
+fcm_sends = Counter("nudger_fcm_sends_total", "FCM sends by outcome.", ("status",))
+db_query_duration = Histogram(
+    "nudger_db_query_duration_seconds", "Database query latency by engine and statement type.", ("engine", "statement")
+)
+scheduler_fire_lag = Histogram(
+    "nudger_scheduler_fire_lag_seconds", "Delay between a job's scheduled run time and its submission.",
+    ("job",), buckets=LAG_BUCKETS
+)
+scheduler_job_events = Counter("nudger_scheduler_job_events_total", "Missed and failed scheduler jobs.", ("event",))
+db_pool_checkout_wait = Histogram(
+    "nudger_db_pool_checkout_wait_seconds", "Time to get a connection from the pool, including opening a new one.",
+    ("pool",)
+)
+db_pool_checkout_timeouts = Counter(
+    "nudger_db_pool_checkout_timeouts_total", "Checkouts that gave up after the pool timeout.", ("pool",)
+)
+
+_pools = {}
+
+
+def _pool_connections() -> dict:
+    values = {}
+    for name, engine in _pools.items():
+        pool = engine.pool  # Looked up on every scrape, dispose() replaces it
+        values[(name, "checked_out")] = pool.checkedout()
+        values[(name, "idle")] = pool.checkedin()
+        values[(name, "overflow")] = max(pool.overflow(), 0)
+    return values
+
+
+def _pool_saturation() -> dict:
+    values = {}
+    for name, engine in _pools.items():
+        pool = engine.pool
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        values[(name,)] = round(pool.checkedout() / capacity, 4) if capacity else 0
+    return values
+
+
+GaugeFunc(
+    "nudger_db_pool_connections", "Connections of each pool by state (checked_out, idle, overflow).",
+    _pool_connections, labelnames=("pool", "state")
+)
+GaugeFunc(
+    "nudger_db_pool_saturation", "Checked-out connections over pool_size + max_overflow; at 1 checkouts wait.",
+    _pool_saturation, labelnames=("pool",)
+)
+
+
+class _TimedCheckout:
+    """Pool mixin that records how long each checkout waited, labelled by the pool's logging name."""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        except PoolTimeoutError:
+            db_pool_checkout_timeouts.inc(self.logging_name or "default")
+            raise
+        finally:
+            db_pool_checkout_wait.observe(time.perf_counter() - started, self.logging_name or "default")
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def instrument_pool(engine, name: str):
+    """Report the connections and saturation of an engine's pool under `name`."""
+    _pools[name] = engine
+
+
+def instrument_engine(engine, name: str):
+    """Record the duration of every query run through a (sync) SQLAlchemy engine."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_start_times"].pop()
+        statement_type = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        db_query_duration.observe(time.perf_counter() - started, name, statement_type)
+
+
+def _job_kind(job_id: str) -> str:
+    # bucket_0900 -> bucket, scheduled_ab12cd34_... -> scheduled; keeps label cardinality low
+    return job_id.split("_", 1)[0]
+
+
+def instrument_scheduler(scheduler):
+    """Record fire lag for every submitted job and count missed/failed runs."""
+
+    def on_submitted(event):
+        now = datetime.now().astimezone()
+        for run_time in event.scheduled_run_times:
+            scheduler_fire_lag.observe((now - run_time).total_seconds(), _job_kind(event.job_id))
+
+    def on_problem(event):
+        scheduler_job_events.inc("missed" if event.code == EVENT_JOB_MISSED else "error")
+
+    scheduler.add_listener(on_submitted, EVENT_JOB_SUBMITTED)
+    scheduler.add_listener(on_problem, EVENT_JOB_MISSED | EVENT_JOB_ERROR)
@@ -0,0 +1,144 @@
+"""
+Density-specific WebP variants of the mood images in moods/.
+
+Every PNG is resized for each screen density (1x, 2x, 3x of a base size in dp)
+and encoded as WebP under a content-hashed name, e.g. caring-2x-3f9a1c0e7b.webp.
+The hash covers the source bytes and the encoding settings, so a URL never
+changes meaning and the files can be cached forever; a changed image gets a
+new URL. Existing files are reused, so only new or edited images are encoded.
+
+Pillow is optional. Without it (or before the variants are built) the original
+PNGs are handed out. Variants can be built ahead of deployment with:
+
+    cd src
+    uv run python -m utils.mood_images
+"""
+import argparse
+import hashlib
+import os
+from pathlib import Path
+
+from fastapi.staticfiles import StaticFiles
+
+try:
+    from PIL import Image
+except ImportError:  # Optional dependency, install the "images" extra
+    Image = None
+
+DEFAULT_DENSITIES = (1, 2, 3)
+# One year, the longest max-age caches are expected to honor
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+class ImmutableStaticFiles(StaticFiles):
+    """StaticFiles for content-hashed files, which never change under the same URL."""
+
+    async def check_config(self):
+        # The directory appears once the variants are built; until then every path is a 404
+        if self.directory is not None and not os.path.isdir(self.directory):
+            return
+        await super().check_config()
+
+    def file_response(self, *args, **kwargs):
+        response = super().file_response(*args, **kwargs)
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+        return response
+
+
+class MoodImages:
+    """
+    Builds the WebP variants and maps (mood, density) to their URLs.
+
+    `build()` is safe to run on a live process: the URL map is swapped in whole
+    once every variant exists, and `url()` serves the PNG until then.
+    """
+
+    def __init__(
+        self,
+        source_dir: str = "moods",
+        output_dir: str = "moods/variants",
+        url_prefix: str = "/moods/v",
+        size_dp: int = 80,
+        densities: tuple[int, ...] = DEFAULT_DENSITIES,
+        quality: int = 80,
+    ):
+        self.source_dir = Path(source_dir)
+        self.output_dir = Path(output_dir)
+        self.url_prefix = url_prefix
+        self.size_dp = size_dp
+        self.densities = tuple(sorted(densities))
+        self.quality = quality
+        self._urls: dict[tuple[str, int], str] = {}
+
+    @property
+    def available(self) -> bool:
+        return Image is not None
+
+    def _variant_name(self, mood: str, density: int, source: bytes) -> str:
+        settings = f"{density}:{self.size_dp}:{self.quality}".encode()
+        digest = hashlib.sha256(source + settings).hexdigest()[:10]
+        return f"{mood}-{density}x-{digest}.webp"
+
+    def _encode(self, source_path: Path, target_path: Path, density: int):
+        with Image.open(source_path) as image:
+            image.load()
+            size = min(self.size_dp * density, max(image.size))  # Never upscale
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            # Write under a temporary name so a half-written file is never served
+            partial_path = target_path.parent / f"{target_path.name}.{os.getpid()}.partial"
+            image.save(partial_path, "WEBP", quality=self.quality, method=6)
+        os.replace(partial_path, target_path)
+
+    def build(self) -> dict:
+        """Encode missing variants and publish their URLs. Returns counts of what was done."""
+        if not self.available:
+            raise RuntimeError("Pillow is not installed, serving the original PNGs")
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        urls = {}
+        encoded = reused = 0
+        for source_path in sorted(self.source_dir.glob("*.png")):
+            source = source_path.read_bytes()
+            for density in self.densities:
+                name = self._variant_name(source_path.stem, density, source)
+                target_path = self.output_dir / name
+                if target_path.exists():
+                    reused += 1
+                else:
+                    self._encode(source_path, target_path, density)
+                    encoded += 1
+                urls[(source_path.stem, density)] = f"{self.url_prefix}/{name}"
+
+        # Variants of older versions of an image are left in place for clients that still hold their URLs
+        self._urls = urls
+        summary = {"images": len(urls) // len(self.densities), "encoded": encoded, "reused": reused}
+        print(f"Mood image variants ready: {summary}")
+        return summary
+
+    def pick_density(self, density: float | None) -> int | None:
+        """The smallest variant at least as dense as the screen, or the densest one."""
+        if density is None:
+            return None
+        for candidate in self.densities:
+            if candidate >= density:
+                return candidate
+        return self.densities[-1]
+
+    def url(self, mood: str, density: float | None = None) -> str:
+        """URL of the mood's image for a screen density; the original PNG without one."""
+        variant = self._urls.get((mood, self.pick_density(density)))
+        return variant or f"/moods/{mood}.png"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the WebP variants of the mood images.")
+    parser.add_argument("--source-dir", default="moods")
+    parser.add_argument("--output-dir", default=os.getenv("MOOD_VARIANTS_DIR", "moods/variants"))
+    parser.add_argument("--size-dp", type=int, default=int(os.getenv("MOOD_IMAGE_SIZE_DP", "80")))
+    parser.add_argument("--quality", type=int, default=int(os.getenv("MOOD_IMAGE_QUALITY", "80")))
+    args = parser.parse_args()
+    MoodImages(args.source_dir, args.output_dir, size_dp=args.size_dp, quality=args.quality).build()
+
+
+if __name__ == "__main__":
+    main()
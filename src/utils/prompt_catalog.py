@@ -0,0 +1,96 @@
+import random
+import threading
+import time
+
+from db import Tones, TonePrompts, ToneEnum
+
+
+class PromptCatalog:
+    """
+    Process-wide, read-mostly cache of tone prompts.
+
+    All prompts are loaded with a single query and kept per tone_id as tuples.
+    Tones without prompts (and unknown tone ids) resolve to the neutral prompts,
+    which are looked up once per refresh instead of on every request.
+    The catalog reloads itself after `ttl_seconds` or after `invalidate()`.
+    """
+
+    def __init__(self, session_factory, ttl_seconds: float = 300):
+        self._session_factory = session_factory
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._prompts: dict[int, tuple[str, ...]] = {}
+        self._fallback: tuple[str, ...] = ()
+        self._neutral_tone_id: int | None = None
+        self._expires_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def invalidate(self):
+        """Force a reload on the next lookup (e.g. after prompts were edited)."""
+        self._expires_at = 0.0
+
+    def refresh(self):
+        """Reload every prompt from the database in one round trip."""
+        with self._session_factory() as db:
+            rows = (
+                db.query(TonePrompts.tone_id, TonePrompts.prompt, Tones.tone_name)
+                .join(Tones, Tones.tone_id == TonePrompts.tone_id)
+                .order_by(TonePrompts.tone_id, TonePrompts.prompt_id)
+                .all()
+            )
+
+        grouped: dict[int, list[str]] = {}
+        neutral_tone_id = None
+        for tone_id, prompt, tone_name in rows:
+            grouped.setdefault(tone_id, []).append(prompt)
+            if tone_name == ToneEnum.neutral:
+                neutral_tone_id = tone_id
+
+        prompts = {tone_id: tuple(texts) for tone_id, texts in grouped.items()}
+        # Swap the whole snapshot at once so readers never see a half-built catalog
+        self._prompts = prompts
+        self._neutral_tone_id = neutral_tone_id
+        self._fallback = prompts.get(neutral_tone_id, ())
+        self._expires_at = time.monotonic() + self._ttl_seconds
+        self.refreshes += 1
+
+    def _ensure_fresh(self):
+        if time.monotonic() < self._expires_at:
+            self.hits += 1
+            return
+        with self._lock:
+            # Another thread may have refreshed while we were waiting for the lock
+            if time.monotonic() < self._expires_at:
+                self.hits += 1
+                return
+            self.misses += 1
+            try:
+                self.refresh()
+            except Exception as e:
+                if not self._prompts:
+                    raise
+                # Keep serving the previous snapshot rather than failing every send
+                print(f"Error refreshing prompt catalog, serving stale prompts: {e}")
+
+    def get_prompts(self, tone_id: int) -> tuple[str, ...]:
+        """Return the prompts for a tone, falling back to the neutral prompts."""
+        self._ensure_fresh()
+        return self._prompts.get(tone_id) or self._fallback
+
+    def random_prompt(self, tone_id: int) -> str | None:
+        """Pick a random prompt for a tone, or None if no prompts exist at all."""
+        prompts = self.get_prompts(tone_id)
+        return random.choice(prompts) if prompts else None
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "tones": len(self._prompts),
+            "prompts": sum(len(texts) for texts in self._prompts.values()),
+            "neutral_tone_id": self._neutral_tone_id,
+            "ttl_seconds": self._ttl_seconds,
+        }
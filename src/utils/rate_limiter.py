@@ -0,0 +1,57 @@
+import threading
+import time
+
+from utils.metrics import Counter, Histogram
+
+rate_limit_wait = Histogram(
+    "nudger_fcm_rate_limit_wait_seconds", "Time a send waited for a rate limiter token.", ("sender",)
+)
+rate_limit_rejections = Counter(
+    "nudger_fcm_rate_limit_rejections_total", "Sends that gave up waiting for a rate limiter token.", ("sender",)
+)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second, holding at most `burst`.
+
+    `acquire()` reserves a token and sleeps until it is due, so concurrent callers
+    are spaced out to the rate instead of all hitting FCM at once. A `rate` of 0
+    disables limiting.
+    """
+
+    def __init__(self, rate: float, burst: int | None = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(int(rate), 1)
+        self._lock = threading.Lock()
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def _reserve(self, timeout: float | None) -> float | None:
+        # Returns how long the caller has to wait for its token, or None if that exceeds timeout
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            if timeout is not None and wait > timeout:
+                return None
+            # Tokens may go negative: later callers queue up behind this reservation
+            self._tokens -= 1
+            return wait
+
+    def acquire(self, timeout: float | None = None, sender: str = "default") -> bool:
+        """Wait for a token. Returns False if none is available within `timeout` seconds."""
+        if self.rate <= 0:
+            return True
+        wait = self._reserve(timeout)
+        if wait is None:
+            rate_limit_rejections.inc(sender)
+            return False
+        if wait > 0:
+            time.sleep(wait)
+        rate_limit_wait.observe(wait, sender)
+        return True
+
+    def stats(self) -> dict:
+        return {"rate": self.rate, "burst": self.burst, "tokens": round(self._tokens, 2)}
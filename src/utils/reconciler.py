@@ -0,0 +1,195 @@
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+
+from apscheduler.job import Job
+from apscheduler.jobstores.base import ConflictingIdError, JobLookupError
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.date import DateTrigger
+from sqlalchemy import select
+
+from db import ScheduledNotification
+from schema.models import FrequencyType
+from utils.compact_jobstore import CompactJobStore, make_job
+from utils.dispatcher import BUCKETED_FREQUENCIES, bucket_job_id, run_once
+from utils.metrics import Counter
+
+# Jobs the reconciler owns; anything else in the job store is left alone
+NOTIFICATION_JOB_PREFIX = "scheduled_"
+BUCKET_JOB_PREFIX = "bucket_"
+
+reconcile_repairs = Counter(
+    "nudger_reconcile_repairs_total", "Job store entries fixed by reconciliation (removed, created, bucket_created).",
+    ("repair",)
+)
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class JobReconciler:
+    """
+    Brings the job store back in line with scheduled_notifications.
+
+    The jobs that should exist are one bucket per distinct recurring time and one
+    date job per ONCE notification that has not fired yet (next_fire_at set). Both
+    sides are read as streamed, key-only scans: job IDs from the job store,
+    job_id/time from scheduled_notifications. The differences are set operations.
+    Orphans, which include per-notification cron jobs from before bucketed
+    dispatch, are deleted `batch_size` IDs per statement. Missing ONCE jobs are
+    inserted `batch_size` per transaction and missing buckets are recreated.
+    Buckets without notifications are left in place: there is at most one per
+    minute of the day, they send nothing, and deleting one could race with a
+    schedule saved for its minute after the table was scanned.
+
+    The job store is scanned before the table. The API saves a row before adding
+    its job, so a job seen in the first scan always has its row in the second.
+    Rows younger than `grace_seconds` may still be waiting for their job, so they
+    are not repaired. With `expect_jobs` False (dispatch workers serve every row)
+    no jobs are expected, and every notification and bucket job is removed.
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        session_factory,
+        dispatcher,
+        jobstore: str = 'default',
+        expect_jobs: bool = True,
+        batch_size: int = 1000,
+        grace_seconds: float = 60,
+    ):
+        self.scheduler = scheduler
+        self.session_factory = session_factory
+        self.dispatcher = dispatcher
+        self.jobstore = jobstore
+        self.expect_jobs = expect_jobs
+        self.batch_size = batch_size
+        self.grace_seconds = grace_seconds
+
+    def _store(self):
+        return self.scheduler._lookup_jobstore(self.jobstore)
+
+    def _stored_job_ids(self) -> set[str]:
+        """IDs of the reconciler's jobs in the job store."""
+        store = self._store()
+        if isinstance(store, SQLAlchemyJobStore):
+            with store.engine.connect() as connection:
+                result = connection.execute(
+                    select(store.jobs_t.c.id).execution_options(yield_per=self.batch_size * 10)
+                )
+                job_ids = set(result.scalars())
+        else:
+            job_ids = {job.id for job in self.scheduler.get_jobs(jobstore=self.jobstore)}
+        return {job_id for job_id in job_ids if job_id.startswith((NOTIFICATION_JOB_PREFIX, BUCKET_JOB_PREFIX))}
+
+    def _expected_job_ids(self) -> tuple[set[str], set[str]]:
+        """(ONCE job IDs, bucket job IDs) that scheduled_notifications calls for."""
+        if not self.expect_jobs:
+            return set(), set()
+        with self.session_factory() as db:
+            once_job_ids = set(db.execute(
+                select(ScheduledNotification.job_id)
+                .where(
+                    ScheduledNotification.frequency == FrequencyType.ONCE,
+                    ScheduledNotification.next_fire_at.is_not(None),
+                    ScheduledNotification.job_id.is_not(None)
+                )
+                .execution_options(yield_per=self.batch_size * 10)
+            ).scalars())
+            # A handful of distinct times, read off the time index
+            times = db.execute(
+                select(ScheduledNotification.time)
+                .where(ScheduledNotification.frequency.in_(BUCKETED_FREQUENCIES))
+                .distinct()
+            ).scalars().all()
+        bucket_job_ids = {bucket_job_id(*map(int, time_str.split(':'))) for time_str in times}
+        return once_job_ids, bucket_job_ids
+
+    def _remove(self, job_ids: list[str]) -> int:
+        store = self._store()
+        removed = 0
+        if isinstance(store, SQLAlchemyJobStore):
+            for chunk in _chunks(job_ids, self.batch_size):
+                with store.engine.begin() as connection:
+                    removed += connection.execute(store.jobs_t.delete().where(store.jobs_t.c.id.in_(chunk))).rowcount
+        else:
+            for job_id in job_ids:
+                try:
+                    self.scheduler.remove_job(job_id, jobstore=self.jobstore)
+                    removed += 1
+                except JobLookupError:
+                    pass
+        return removed
+
+    def _once_jobs(self, job_ids: list[str], cutoff: datetime) -> list[Job]:
+        """Rebuild the date jobs of ONCE notifications, one query per chunk of IDs."""
+        jobs = []
+        for chunk in _chunks(job_ids, self.batch_size):
+            with self.session_factory() as db:
+                rows = db.execute(
+                    select(ScheduledNotification.id, ScheduledNotification.job_id, ScheduledNotification.next_fire_at)
+                    .where(ScheduledNotification.job_id.in_(chunk), ScheduledNotification.created_at < cutoff)
+                ).all()
+            for row in rows:
+                trigger = DateTrigger(row.next_fire_at, timezone=self.scheduler.timezone)
+                jobs.append(make_job(
+                    self.scheduler, row.job_id, run_once, (row.id,), trigger,
+                    self.dispatcher.misfire_grace_time, trigger.run_date
+                ))
+        return jobs
+
+    def _create(self, jobs: list[Job]) -> int:
+        store = self._store()
+        created = 0
+        for chunk in _chunks(jobs, self.batch_size):
+            if isinstance(store, CompactJobStore):
+                try:
+                    created += store.add_jobs(chunk)
+                    continue
+                except ConflictingIdError:
+                    pass  # Someone added one of them meanwhile; fall back to one at a time
+            for job in chunk:
+                try:
+                    store.add_job(job)
+                    created += 1
+                except ConflictingIdError:
+                    pass
+        return created
+
+    def run(self) -> dict:
+        """Reconcile once. Returns what was found and repaired."""
+        started = perf_counter()
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.grace_seconds)
+
+        stored = self._stored_job_ids()
+        once_job_ids, bucket_job_ids = self._expected_job_ids()
+
+        orphans = sorted(
+            job_id for job_id in stored - once_job_ids - bucket_job_ids
+            if not (self.expect_jobs and job_id.startswith(BUCKET_JOB_PREFIX))
+        )
+        removed = self._remove(orphans)
+
+        created = self._create(self._once_jobs(sorted(once_job_ids - stored), cutoff))
+        missing_buckets = sorted(bucket_job_ids - stored)
+        for job_id in missing_buckets:
+            hour, minute = divmod(int(job_id[len(BUCKET_JOB_PREFIX):]), 100)
+            self.dispatcher.ensure_bucket(hour, minute)
+        if created or missing_buckets:
+            self.scheduler.wakeup()  # Jobs written straight to the store are not seen until then
+
+        reconcile_repairs.inc("removed", amount=removed)
+        reconcile_repairs.inc("created", amount=created)
+        reconcile_repairs.inc("bucket_created", amount=len(missing_buckets))
+        summary = {
+            "stored_jobs": len(stored),
+            "expected_jobs": len(once_job_ids) + len(bucket_job_ids),
+            "removed": removed,
+            "created": created,
+            "buckets_created": len(missing_buckets),
+            "seconds": round(perf_counter() - started, 3),
+        }
+        print(f"Reconciled scheduled jobs: {summary}")
+        return summary
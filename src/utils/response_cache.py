@@ -0,0 +1,83 @@
+import hashlib
+import json
+import threading
+import time
+from typing import NamedTuple
+
+
+class CachedResponse(NamedTuple):
+    """A JSON body serialized once, with its strong ETag."""
+    body: bytes
+    etag: str
+
+
+def _serialize(payload) -> bytes:
+    # Same encoding FastAPI's JSONResponse uses
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+class ResponseCache:
+    """
+    Serialized responses of read-mostly endpoints, keyed by the caller (e.g. "tones").
+
+    Each entry holds the encoded body and an ETag derived from its bytes, so a
+    hit costs no query and no serialization, and a client that sends the ETag
+    back in If-None-Match can be answered with a 304. Entries live for
+    `ttl_seconds` or until `invalidate()`. A reload that produces the same bytes
+    produces the same ETag, so clients keep getting 304s across reloads.
+
+    `generation()` is read before loading and passed to `put()`: a load that
+    raced with `invalidate()` is returned to its caller but not cached.
+    """
+
+    def __init__(self, ttl_seconds: float = 300):
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: dict[str, tuple[CachedResponse, float]] = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> CachedResponse | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def generation(self) -> int:
+        return self._generation
+
+    def put(self, key: str, payload, generation: int) -> CachedResponse:
+        """Serialize a payload and cache it, unless the cache was invalidated since `generation`."""
+        body = _serialize(payload)
+        response = CachedResponse(body, f'"{hashlib.sha256(body).hexdigest()[:32]}"')
+        with self._lock:
+            if generation == self._generation:
+                self._entries[key] = (response, time.monotonic() + self._ttl_seconds)
+        return response
+
+    def invalidate(self):
+        """Drop every entry, e.g. after tones or prompts were edited."""
+        with self._lock:
+            self._generation += 1
+            self._entries = {}
+
+    @staticmethod
+    def not_modified(response: CachedResponse, if_none_match: str | None) -> bool:
+        """Whether an If-None-Match header already names this response."""
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # If-None-Match uses weak comparison, so W/"x" matches "x"
+        return any(tag.strip().removeprefix("W/") == response.etag for tag in if_none_match.split(","))
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self._entries),
+            "ttl_seconds": self._ttl_seconds,
+        }
@@ -0,0 +1,173 @@
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Iterable
+
+from sqlalchemy import delete, func, insert, select, update
+
+from db import NotificationRetry
+from utils.fcm import Message, SendResult, SendStatus
+from utils.metrics import Counter
+
+retries_enqueued = Counter("nudger_retry_enqueued_total", "Notifications queued for another send attempt.")
+retry_outcomes = Counter(
+    "nudger_retry_outcomes_total", "Outcomes of retried sends (rescheduled, delivered, dropped, abandoned).",
+    ("outcome",)
+)
+
+
+def backoff_delay(attempts: int, base_delay: float, max_delay: float) -> float:
+    """
+    Seconds to wait before the next attempt after `attempts` failed sends.
+    The exponential cap is jittered between half and all of it, so a burst of
+    failures at the top of the hour does not come back as a burst.
+    """
+    cap = min(max_delay, base_delay * 2 ** (attempts - 1))
+    return cap / 2 + random.uniform(0, cap / 2)
+
+
+class RetryQueue:
+    """
+    Durable queue of notifications that failed with a retryable FCM error.
+
+    Failed messages are written to notification_retries with a jittered
+    exponential backoff. A background thread claims due rows with
+    FOR UPDATE SKIP LOCKED, so several workers can drain the same table, and
+    pushes the claim forward by `lease_seconds` before sending; rows of a worker
+    that dies mid-send become due again once the lease runs out.
+    Rows are dropped once delivered, once FCM rejects them for good, or after
+    `max_attempts` sends.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        send_batch: Callable[[list[Message]], list[SendResult]],
+        on_results: Callable[[list[SendResult]], object] | None = None,
+        max_attempts: int = 5,
+        base_delay: float = 30,
+        max_delay: float = 3600,
+        batch_size: int = 500,
+        poll_interval: float = 5.0,
+        lease_seconds: float = 300,
+    ):
+        self._session_factory = session_factory
+        self._send_batch = send_batch
+        self._on_results = on_results
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self._stopped = threading.Event()
+        self._worker = threading.Thread(target=self._run, name="fcm-retry-queue", daemon=True)
+        self._worker.start()
+
+    def enqueue(self, messages: Iterable[Message], results: Iterable[SendResult]) -> int:
+        """Queue the messages whose result is RETRYABLE. Both iterables are in the same order."""
+        now = datetime.now(timezone.utc)
+        rows = [
+            {
+                "token": token,
+                "title": title,
+                "body": body,
+                "attempts": 1,
+                "next_attempt_at": now + timedelta(seconds=backoff_delay(1, self.base_delay, self.max_delay)),
+                "last_error": result.error,
+            }
+            for (token, title, body), result in zip(messages, results)
+            if result.status == SendStatus.RETRYABLE
+        ]
+        if not rows:
+            return 0
+        with self._session_factory() as db:
+            db.execute(insert(NotificationRetry), rows)
+            db.commit()
+        retries_enqueued.inc(amount=len(rows))
+        return len(rows)
+
+    def depth(self) -> int:
+        with self._session_factory() as db:
+            return db.execute(select(func.count()).select_from(NotificationRetry)).scalar_one()
+
+    def _claim(self) -> list:
+        now = datetime.now(timezone.utc)
+        with self._session_factory() as db:
+            rows = db.execute(
+                select(
+                    NotificationRetry.id,
+                    NotificationRetry.token,
+                    NotificationRetry.title,
+                    NotificationRetry.body,
+                    NotificationRetry.attempts
+                )
+                .where(NotificationRetry.next_attempt_at <= now)
+                .order_by(NotificationRetry.next_attempt_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            ).all()
+            if rows:
+                db.execute(
+                    update(NotificationRetry)
+                    .where(NotificationRetry.id.in_([row.id for row in rows]))
+                    .values(next_attempt_at=now + timedelta(seconds=self.lease_seconds))
+                )
+            db.commit()
+            return rows
+
+    def process_due(self) -> int:
+        """Retry one batch of due notifications. Returns the number of rows processed."""
+        rows = self._claim()
+        if not rows:
+            return 0
+
+        results = self._send_batch([(row.token, row.title, row.body) for row in rows])
+        now = datetime.now(timezone.utc)
+        finished_ids = []
+        rescheduled = []
+        for row, result in zip(rows, results):
+            if result.status == SendStatus.RETRYABLE and row.attempts < self.max_attempts:
+                attempts = row.attempts + 1
+                rescheduled.append({
+                    "id": row.id,
+                    "attempts": attempts,
+                    "next_attempt_at": now + timedelta(seconds=backoff_delay(attempts, self.base_delay, self.max_delay)),
+                    "last_error": result.error,
+                })
+                retry_outcomes.inc("rescheduled")
+            else:
+                finished_ids.append(row.id)
+                if result.status == SendStatus.SUCCESS:
+                    retry_outcomes.inc("delivered")
+                elif result.status == SendStatus.RETRYABLE:
+                    retry_outcomes.inc("abandoned")
+                    print(f"Giving up on notification to {row.token[:8]}... after {row.attempts} attempts: {result.error}")
+                else:
+                    retry_outcomes.inc("dropped")
+
+        with self._session_factory() as db:
+            if rescheduled:
+                db.execute(update(NotificationRetry), rescheduled)
+            if finished_ids:
+                db.execute(delete(NotificationRetry).where(NotificationRetry.id.in_(finished_ids)))
+            db.commit()
+
+        if self._on_results is not None:
+            self._on_results(results)
+        return len(rows)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                # Keep draining while full batches come back, then wait for the next poll
+                if self.process_due() >= self.batch_size:
+                    continue
+            except Exception as e:
+                print(f"Error processing retry queue: {e}")
+            self._stopped.wait(self.poll_interval)
+
+    def close(self):
+        """Stop the background worker. Queued rows stay in the table for the next start."""
+        self._stopped.set()
+        self._worker.join(timeout=5)
@@ -1,15 +1,8 @@
-import os
-from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.jobstores.memory import MemoryJobStore
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 
-load_dotenv()
-DB_USER = os.getenv("DB_USER")
-DB_PASSWORD = os.getenv("DB_PASSWORD") 
-DB_HOST = os.getenv("DB_HOST")
-DB_PORT = os.getenv("DB_PORT")
-DB_NAME = os.getenv("DB_NAME")
+import config
+from utils.compact_jobstore import CompactJobStore
 
 # Define job stores
 jobstores = {
@@ -17,16 +10,21 @@ jobstores = {
 }
 
 # Only add persistent store if all DB variables are available
-if all([DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME]):
+if config.database_configured():
     try:
-        jobstores['persistent'] = SQLAlchemyJobStore(url=f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}')
+        # Bucket and ONCE jobs are stored by reference instead of pickled. The store
+        # shares the process's engine, so its queries draw on the same connection pool
+        jobstores['persistent'] = CompactJobStore(engine=config.get_engine())
         print("PostgreSQL persistent job store configured successfully.")
     except Exception as e:
         print(f"Failed to configure PostgreSQL job store: {e}")
         print("Using only in-memory job store.")
 else:
     print("Database configuration incomplete. Using only in-memory job store.")
-    print(f"Missing: DB_USER={DB_USER}, DB_PASSWORD={'***' if DB_PASSWORD else None}, DB_HOST={DB_HOST}, DB_PORT={DB_PORT}, DB_NAME={DB_NAME}")
+    print(f"Missing: DB_USER={config.DB_USER}, DB_PASSWORD={'***' if config.DB_PASSWORD else None}, DB_HOST={config.DB_HOST}, DB_PORT={config.DB_PORT}, DB_NAME={config.DB_NAME}")
+
+# Job store for notification jobs: persistent when the database is configured
+DEFAULT_JOBSTORE = 'persistent' if 'persistent' in jobstores else 'default'
 
 # Create scheduler with job stores configuration
 scheduler = BackgroundScheduler(jobstores=jobstores)
@@ -0,0 +1,178 @@
+import os
+import threading
+
+from utils.fcm import FCMSender, SendStatus, create_fcm_transport, summarize
+from utils.rate_limiter import TokenBucket
+from utils.retry_queue import RetryQueue
+
+# Tokens without a tone preference get prompts of the neutral tone
+DEFAULT_TONE_ID = 2
+
+
+class SendPipeline:
+    """
+    Everything between a due notification and FCM, shared by api.py and
+    dispatch_worker.py: the FCM transport, a sender for scheduled batches and one
+    for /send-notification (kept apart so a scheduled burst cannot starve the API),
+    the rate limiter both draw on, the retry queue and dead-token reporting.
+
+    Nothing talks to FCM until `init_fcm()`, which reads the service account;
+    `fcm` stays None and `ready` unset until it has succeeded.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        prompt_catalog,
+        token_pruner,
+        transport: str = "fcm",
+        service_account_file: str | None = None,
+        project_id: str | None = None,
+        endpoint: str | None = None,
+        max_in_flight: int = 32,
+        api_workers: int = 8,
+        rate_limiter: TokenBucket | None = None,
+        api_rate_limit_timeout: float = 2,
+        dry_run_latency_ms: float = 0,
+        retry_options: dict | None = None,
+    ):
+        self.session_factory = session_factory
+        self.prompt_catalog = prompt_catalog
+        self.token_pruner = token_pruner
+        self.transport = transport
+        self.service_account_file = service_account_file
+        self.project_id = project_id
+        self.endpoint = endpoint
+        self.max_in_flight = max_in_flight
+        self.api_workers = api_workers
+        self.rate_limiter = rate_limiter
+        self.api_rate_limit_timeout = api_rate_limit_timeout
+        self.dry_run_latency_ms = dry_run_latency_ms
+        self.retry_options = retry_options or {}
+
+        self.fcm = None
+        self.sender = None
+        self.api_sender = None
+        self.retry_queue = None
+        self.ready = threading.Event()
+
+    @classmethod
+    def from_env(cls, session_factory, prompt_catalog, token_pruner) -> "SendPipeline":
+        """Build the pipeline from the FCM_* and RETRY_* environment variables."""
+        # The limit is per process: FCM_RATE_LIMIT_PER_SECOND is the project's FCM quota
+        # (600k messages per minute by default) and FCM_SENDING_PROCESSES must be set to the
+        # number of processes that send (API workers plus dispatch workers), each of which
+        # gets an equal share; 0 disables limiting
+        processes = max(int(os.getenv("FCM_SENDING_PROCESSES", "1")), 1)
+        rate_limiter = TokenBucket(
+            rate=float(os.getenv("FCM_RATE_LIMIT_PER_SECOND", "10000")) / processes,
+            burst=max(int(os.getenv("FCM_RATE_LIMIT_BURST", "10000")) // processes, 1)
+        )
+        return cls(
+            session_factory,
+            prompt_catalog,
+            token_pruner,
+            # "fcm" (default), "fake" for utils/fake_fcm.py at FCM_ENDPOINT, or "dry-run" to send nothing
+            transport=os.getenv("FCM_TRANSPORT", "fcm"),
+            service_account_file=os.getenv("FCM_SERVICE_ACCOUNT_FILE"),
+            project_id=os.getenv("FCM_PROJECT_ID"),
+            endpoint=os.getenv("FCM_ENDPOINT"),
+            # Upper bound on concurrent FCM requests for scheduled batches
+            max_in_flight=int(os.getenv("FCM_MAX_IN_FLIGHT", "32")),
+            # Threads serving /send-notification
+            api_workers=int(os.getenv("FCM_API_WORKERS", "8")),
+            rate_limiter=rate_limiter,
+            # How long /send-notification waits for the limiter before answering with an error
+            api_rate_limit_timeout=float(os.getenv("FCM_API_RATE_LIMIT_TIMEOUT_SECONDS", "2")),
+            dry_run_latency_ms=float(os.getenv("FCM_DRY_RUN_LATENCY_MS", "0")),
+            retry_options={
+                "max_attempts": int(os.getenv("RETRY_MAX_ATTEMPTS", "5")),
+                "base_delay": float(os.getenv("RETRY_BASE_DELAY_SECONDS", "30")),
+                "max_delay": float(os.getenv("RETRY_MAX_DELAY_SECONDS", "3600")),
+                "batch_size": int(os.getenv("RETRY_BATCH_SIZE", "500")),
+                "poll_interval": float(os.getenv("RETRY_POLL_INTERVAL_SECONDS", "5")),
+            },
+        )
+
+    def init_fcm(self):
+        """
+        Create the FCM transport (reads the service account), both senders and the retry
+        queue that sends through them. Called at startup rather than on import.
+        """
+        try:
+            transport = create_fcm_transport(
+                self.transport,
+                self.service_account_file,
+                self.project_id,
+                pool_size=self.max_in_flight + self.api_workers,
+                endpoint=self.endpoint,
+                dry_run_latency_ms=self.dry_run_latency_ms
+            )
+        except Exception as e:
+            print(
+                f"Error initializing FCM. Ensure '{self.service_account_file}' is correct "
+                f"and project_id is set if needed: {e}"
+            )
+            raise
+        print(f"FCM transport: {self.transport}" + (f" at {self.endpoint}" if self.endpoint else ""))
+        self.sender = FCMSender(
+            transport, max_in_flight=self.max_in_flight, rate_limiter=self.rate_limiter, name="scheduled"
+        )
+        self.api_sender = FCMSender(
+            transport,
+            max_in_flight=self.api_workers,
+            rate_limiter=self.rate_limiter,
+            acquire_timeout=self.api_rate_limit_timeout,
+            name="api"
+        )
+        # Scheduled sends that failed with 429/5xx/timeouts are retried from the notification_retries table
+        self.retry_queue = RetryQueue(
+            self.session_factory,
+            lambda messages: self.sender.send_batch(messages),
+            on_results=self.token_pruner.report,
+            **self.retry_options
+        )
+        # Published last: callers check fcm before using the senders
+        self.fcm = transport
+        self.ready.set()
+
+    def send_batch(self, notifications: list) -> list:
+        """
+        Batched sender used by the bucket dispatcher and the dispatch workers.
+        Takes (token, title, tone_id) tuples that were loaded in a single query
+        and delivers them concurrently, returning one SendResult per token.
+        """
+        if not self.sender:
+            print(f"FCM not initialized, cannot send {len(notifications)} scheduled notifications")
+            return []
+
+        messages = [
+            # tone_id is None when the token has no preference
+            (token, title, self.prompt_catalog.random_prompt(tone_id or DEFAULT_TONE_ID) or f"Scheduled reminder: {title}")
+            for token, title, tone_id in notifications
+        ]
+        results = self.sender.send_batch(messages)
+
+        print(f"Batch of {len(results)} scheduled notifications sent: {summarize(results)}")
+        for result in results:
+            if result.status != SendStatus.SUCCESS:
+                print(f"Failed to send to {result.token[:8]}...: {result.status.value} {result.error}")
+        self.token_pruner.report(results)
+        if self.retry_queue:
+            try:
+                self.retry_queue.enqueue(messages, results)
+            except Exception as e:
+                print(f"Error queueing failed notifications for retry: {e}")
+        return results
+
+    def close_retry_queue(self):
+        """Stop retrying; queued rows stay in the table for the next start."""
+        if self.retry_queue:
+            self.retry_queue.close()
+
+    def close(self):
+        """Wait for in-flight sends and close the transport."""
+        if self.fcm:
+            self.sender.shutdown()
+            self.api_sender.shutdown()
+            self.fcm.close()
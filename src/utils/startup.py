@@ -0,0 +1,78 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from typing import Callable
+
+from utils.metrics import GaugeFunc
+
+
+class Startup:
+    """
+    Initializes the process's slow dependencies in parallel, off the import path.
+
+    Each component is a named callable. `start()` runs them all on a thread pool in
+    the background, so the server accepts connections (and answers /healthz) right
+    away while the database, FCM and the scheduler come up. Every component's
+    duration and outcome is printed and kept for /readyz; the process is ready once
+    all required components have succeeded.
+    """
+
+    def __init__(self):
+        self._components: dict[str, tuple[Callable[[], object], bool]] = {}
+        self._status: dict[str, dict] = {}
+        self._thread: threading.Thread | None = None
+        self._started_at: float | None = None
+        self.seconds: float | None = None
+        GaugeFunc(
+            "nudger_startup_component_seconds", "Time each startup component took to initialize.",
+            lambda: {(name,): status["seconds"] for name, status in self._status.items() if "seconds" in status},
+            labelnames=("component",)
+        )
+
+    def add(self, name: str, init: Callable[[], object], required: bool = True):
+        """Register a component. Optional ones are reported but do not hold back readiness."""
+        self._components[name] = (init, required)
+        self._status[name] = {"status": "pending", "required": required}
+
+    def _init(self, name: str):
+        init, _ = self._components[name]
+        started = perf_counter()
+        try:
+            init()
+            self._status[name].update(status="ready", seconds=round(perf_counter() - started, 3))
+            print(f"Startup: {name} ready in {self._status[name]['seconds']:.3f}s")
+        except Exception as e:
+            self._status[name].update(status="failed", seconds=round(perf_counter() - started, 3), error=str(e))
+            print(f"Startup: {name} failed after {self._status[name]['seconds']:.3f}s: {e}")
+
+    def run(self):
+        """Initialize every component in parallel and wait for all of them."""
+        self._started_at = perf_counter()
+        with ThreadPoolExecutor(max_workers=max(len(self._components), 1), thread_name_prefix="startup") as executor:
+            list(executor.map(self._init, self._components))
+        self.seconds = round(perf_counter() - self._started_at, 3)
+        print(f"Startup finished in {self.seconds:.3f}s: " + ", ".join(
+            f"{name}={status['status']}" for name, status in self._status.items()
+        ))
+
+    def start(self):
+        """Run the components on a background thread."""
+        self._thread = threading.Thread(target=self.run, name="startup", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: float | None = None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    @property
+    def ready(self) -> bool:
+        return all(
+            status["status"] == "ready" for status in self._status.values() if status["required"]
+        )
+
+    def status(self) -> dict:
+        return {
+            "ready": self.ready,
+            "seconds": self.seconds,
+            "components": {name: dict(status) for name, status in self._status.items()},
+        }
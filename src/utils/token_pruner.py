@@ -0,0 +1,155 @@
+import threading
+from typing import Iterable
+
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from sqlalchemy import delete, select
+
+from db import DeviceToken, ScheduledNotification, TokenTonePreferences
+from utils.fcm import SendResult, SendStatus
+from utils.metrics import Counter
+
+# FCM answers that mean the token will never be deliverable again
+DEAD_TOKEN_STATUSES = (SendStatus.UNREGISTERED, SendStatus.INVALID)
+
+pruned_tokens = Counter("nudger_pruned_tokens_total", "Dead device tokens removed after an FCM send.")
+pruned_rows = Counter("nudger_pruned_rows_total", "Rows and jobs removed while pruning dead tokens.", ("kind",))
+
+
+class TokenPruner:
+    """
+    Removes everything stored for device tokens that FCM reported as dead.
+
+    Senders `report()` results; dead tokens are buffered and a background thread
+    deletes their scheduled notifications, tone preferences and registrations in
+    one transaction per `batch_size` tokens, then removes their scheduler jobs in
+    bulk. A token that shows up in many bucket rows is only pruned once. Without a
+    `scheduler` (dispatch workers, which fire rows instead of jobs) only rows are removed.
+    """
+
+    def __init__(
+        self,
+        scheduler,
+        session_factory,
+        jobstore: str = 'default',
+        tone_cache=None,
+        batch_size: int = 500,
+        flush_interval: float = 5.0,
+    ):
+        self._scheduler = scheduler
+        self._session_factory = session_factory
+        self._jobstore = jobstore
+        self._tone_cache = tone_cache
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: set[str] = set()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="token-pruner-flush", daemon=True)
+        self._flusher.start()
+
+    def report(self, results: Iterable[SendResult], statuses=DEAD_TOKEN_STATUSES) -> int:
+        """Queue the tokens of dead-token results for pruning. Returns how many were queued."""
+        dead = {result.token for result in results if result.status in statuses}
+        if not dead:
+            return 0
+        with self._lock:
+            self._pending |= dead
+            pending = len(self._pending)
+        if pending >= self._batch_size:
+            self._wakeup.set()
+        return len(dead)
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> int:
+        """Prune every queued token. Returns the number of tokens pruned."""
+        with self._lock:
+            batch, self._pending = self._pending, set()
+        if not batch:
+            return 0
+
+        tokens = sorted(batch)
+        pruned = 0
+        try:
+            for start in range(0, len(tokens), self._batch_size):
+                chunk = tokens[start:start + self._batch_size]
+                self._prune(chunk)
+                pruned += len(chunk)
+        except Exception:
+            # Requeue the chunks that were not pruned yet
+            with self._lock:
+                self._pending.update(tokens[pruned:])
+            raise
+        return pruned
+
+    def _prune(self, tokens: list[str]):
+        with self._session_factory() as db:
+            job_ids = db.execute(
+                select(ScheduledNotification.job_id)
+                .where(ScheduledNotification.token.in_(tokens), ScheduledNotification.job_id.is_not(None))
+            ).scalars().all()
+            notifications = db.execute(
+                delete(ScheduledNotification).where(ScheduledNotification.token.in_(tokens))
+            ).rowcount
+            preferences = db.execute(
+                delete(TokenTonePreferences).where(TokenTonePreferences.token.in_(tokens))
+            ).rowcount
+            registrations = db.execute(
+                delete(DeviceToken).where(DeviceToken.token.in_(tokens))
+            ).rowcount
+            db.commit()
+
+        # Rows go first: a job left behind by a failure below no longer finds its row,
+        # and recurring schedules are served by shared bucket jobs that stay in place
+        jobs = self._remove_jobs(job_ids)
+
+        if self._tone_cache is not None:
+            for token in tokens:
+                self._tone_cache.invalidate(token)
+
+        pruned_tokens.inc(amount=len(tokens))
+        pruned_rows.inc("scheduled_notifications", amount=notifications)
+        pruned_rows.inc("tone_preferences", amount=preferences)
+        pruned_rows.inc("device_tokens", amount=registrations)
+        pruned_rows.inc("jobs", amount=jobs)
+        print(
+            f"Pruned {len(tokens)} dead tokens: {notifications} scheduled notifications, "
+            f"{preferences} tone preferences, {registrations} registrations, {jobs} jobs"
+        )
+
+    def _remove_jobs(self, job_ids: list[str]) -> int:
+        if not job_ids or self._scheduler is None:
+            return 0
+        store = self._scheduler._lookup_jobstore(self._jobstore) if self._scheduler.running else None
+        if isinstance(store, SQLAlchemyJobStore):
+            # One DELETE instead of a round trip per job
+            with store.engine.begin() as connection:
+                return connection.execute(store.jobs_t.delete().where(store.jobs_t.c.id.in_(job_ids))).rowcount
+
+        removed = 0
+        for job_id in job_ids:
+            try:
+                self._scheduler.remove_job(job_id, jobstore=self._jobstore)
+                removed += 1
+            except JobLookupError:
+                pass  # ONCE jobs that already fired
+        return removed
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error pruning dead tokens: {e}")
+
+    def close(self):
+        """Stop the background pruner and prune whatever is still queued."""
+        self._stopped.set()
+        self._wakeup.set()
+        self._flusher.join(timeout=5)
+        self.flush()
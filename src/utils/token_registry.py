@@ -0,0 +1,95 @@
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select
+from sqlalchemy.dialects.postgresql import insert
+
+from db import DeviceToken
+
+
+class TokenRegistry:
+    """
+    Database-backed registry of device tokens with a write-behind buffer.
+
+    `register()` only records the token in memory; a background thread upserts
+    the buffer into device_tokens every `flush_interval` seconds, or sooner once
+    `flush_size` tokens are pending. Re-registering a token just bumps its
+    last_seen_at, so app opens that re-send the same token cost one row update
+    per flush instead of one write per request.
+    """
+
+    def __init__(self, session_factory, flush_size: int = 500, flush_interval: float = 2.0):
+        self._session_factory = session_factory
+        self._flush_size = flush_size
+        self._flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._pending: dict[str, datetime] = {}
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, name="token-registry-flush", daemon=True)
+        self._flusher.start()
+
+    def register(self, token: str):
+        """Buffer a registration; it is persisted on the next flush."""
+        with self._lock:
+            self._pending[token] = datetime.now(timezone.utc)
+            pending = len(self._pending)
+        if pending >= self._flush_size:
+            self._wakeup.set()
+
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def flush(self) -> int:
+        """Upsert every buffered registration in one transaction. Returns the number written."""
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        if not batch:
+            return 0
+
+        # Sorted so concurrent flushes from several workers lock rows in the same order
+        rows = [{"token": token, "last_seen_at": seen_at} for token, seen_at in sorted(batch.items())]
+        try:
+            with self._session_factory() as db:
+                for start in range(0, len(rows), self._flush_size):
+                    statement = insert(DeviceToken).values(rows[start:start + self._flush_size])
+                    statement = statement.on_conflict_do_update(
+                        index_elements=[DeviceToken.token],
+                        set_={"last_seen_at": func.greatest(DeviceToken.last_seen_at, statement.excluded.last_seen_at)}
+                    )
+                    db.execute(statement)
+                db.commit()
+        except Exception:
+            # Put the batch back so the next flush retries it, keeping newer registrations
+            with self._lock:
+                for token, seen_at in batch.items():
+                    if token not in self._pending:
+                        self._pending[token] = seen_at
+            raise
+        return len(batch)
+
+    def _flush_loop(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self._flush_interval)
+            self._wakeup.clear()
+            try:
+                flushed = self.flush()
+                if flushed:
+                    print(f"Flushed {flushed} token registrations")
+            except Exception as e:
+                print(f"Error flushing token registrations: {e}")
+
+    def list_tokens(self, after: str | None = None, limit: int = 100) -> list[DeviceToken]:
+        """Return up to `limit` tokens ordered by token, starting after the `after` cursor."""
+        query = select(DeviceToken).order_by(DeviceToken.token).limit(limit)
+        if after:
+            query = query.where(DeviceToken.token > after)
+        with self._session_factory() as db:
+            return list(db.execute(query).scalars())
+
+    def close(self):
+        """Stop the background flusher and persist whatever is still buffered."""
+        self._stopped.set()
+        self._wakeup.set()
+        self._flusher.join(timeout=5)
+        self.flush()
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from sqlalchemy import and_, or_, select
+
+from db import Tones, ToneEnum, TokenTonePreferences
+
+
+class TokenTone(NamedTuple):
+    """Resolved tone for a device token."""
+    tone_id: int
+    tone_name: str
+    is_default: bool
+
+
+class TokenToneCache:
+    """
+    Bounded LRU cache of token -> tone with a TTL per entry.
+
+    Misses are served by one joined query that returns the token's preferred tone
+    and the neutral default together. Tokens without a preference are cached too,
+    since they are the majority on the scheduled send path.
+    Writes go through `put()` so the process that handled POST /user-tone sees
+    the new tone immediately; other workers pick it up when their entry expires.
+    """
+
+    def __init__(self, session_factory, max_size: int = 100_000, ttl_seconds: float = 600):
+        self._session_factory = session_factory
+        self._max_size = max_size
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, tuple[TokenTone, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, token: str) -> TokenTone | None:
+        """Return the tone for a token, loading it from the database on a miss."""
+        tone = self._lookup(token)
+        if tone is None:
+            with self._session_factory() as db:
+                tone = self._resolve(token, db.execute(self._load_statement(token)).all())
+        return tone
+
+    async def get_async(self, token: str, db) -> TokenTone | None:
+        """Same as `get()`, loading misses through the given AsyncSession."""
+        tone = self._lookup(token)
+        if tone is None:
+            result = await db.execute(self._load_statement(token))
+            tone = self._resolve(token, result.all())
+        return tone
+
+    def put(self, token: str, tone_id: int, tone_name: str, is_default: bool = False):
+        """Write-through hook for callers that just persisted a preference."""
+        self._store(token, TokenTone(tone_id, tone_name, is_default))
+
+    def invalidate(self, token: str | None = None):
+        """Drop one token, or the whole cache when no token is given."""
+        with self._lock:
+            if token is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(token, None)
+
+    def _store(self, token: str, tone: TokenTone):
+        with self._lock:
+            self._entries[token] = (tone, time.monotonic() + self._ttl_seconds)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _lookup(self, token: str) -> TokenTone | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(token)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[token]
+                self.expirations += 1
+            self.misses += 1
+        return None
+
+    @staticmethod
+    def _load_statement(token: str):
+        # Single round trip: the preferred tone (if any) and the neutral default
+        return (
+            select(Tones.tone_id, Tones.tone_name, TokenTonePreferences.token)
+            .outerjoin(
+                TokenTonePreferences,
+                and_(
+                    TokenTonePreferences.tone_id == Tones.tone_id,
+                    TokenTonePreferences.token == token,
+                ),
+            )
+            .where(or_(TokenTonePreferences.token == token, Tones.tone_name == ToneEnum.neutral))
+        )
+
+    def _resolve(self, token: str, rows) -> TokenTone | None:
+        tone = None
+        for tone_id, tone_name, pref_token in rows:
+            if pref_token is not None:
+                tone = TokenTone(tone_id, tone_name.value, False)
+                break
+            tone = TokenTone(tone_id, tone_name.value, True)
+        if tone is not None:
+            self._store(token, tone)
+        return tone
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self._max_size,
+            "ttl_seconds": self._ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
@@ -4,16 +4,33 @@ import android.util.Log
 import kotlinx.coroutines.Dispatchers
 import kotlinx.coroutines.withContext
 import okhttp3.*
+import okhttp3.HttpUrl.Companion.toHttpUrl
 import okhttp3.MediaType.Companion.toMediaType
 import okhttp3.RequestBody.Companion.toRequestBody
 import org.json.JSONObject
+import java.io.File
 import java.io.IOException
 
 import android.content.Context
 import com.example.nudger.R
 
 class ApiService(private val context: Context) {
-    private val client = OkHttpClient()
+    companion object {
+        @Volatile
+        private var sharedClient: OkHttpClient? = null
+
+        // One client per process: the HTTP cache revalidates /tones and /tone-prompts with
+        // their ETags, and a cache directory must not be shared by two Cache instances
+        private fun sharedClient(context: Context): OkHttpClient =
+            sharedClient ?: synchronized(this) {
+                sharedClient ?: OkHttpClient.Builder()
+                    .cache(Cache(File(context.applicationContext.cacheDir, "http_cache"), 5L * 1024 * 1024))
+                    .build()
+                    .also { sharedClient = it }
+            }
+    }
+
+    private val client = sharedClient(context)
     private val baseUrl = context.getString(R.string.base_url)
       data class ScheduleRequest(
         val token: String,
@@ -108,25 +125,33 @@ class ApiService(private val context: Context) {
     suspend fun getNotifications(token: String): Result<GetNotificationsResponse> {
         return withContext(Dispatchers.IO) {
             try {
-                val httpRequest = Request.Builder()
-                    .url("$baseUrl/get-notifications/$token")
-                    .get()
-                    .build()
-                
                 Log.d("ApiService", "Fetching notifications for token: ${token.take(8)}...")
                 
-                val response = client.newCall(httpRequest).execute()
-                val responseBody = response.body?.string() ?: ""
-                
-                Log.d("ApiService", "Get notifications response code: ${response.code}")
-                Log.d("ApiService", "Get notifications response body: $responseBody")
-                
-                if (response.isSuccessful) {
+                // The endpoint returns pages of at most 500; follow next_cursor until the last page
+                val notifications = mutableListOf<NotificationResponse>()
+                var cursor: String? = null
+                do {
+                    val url = "$baseUrl/get-notifications/$token".toHttpUrl().newBuilder()
+                        .addQueryParameter("limit", "500")
+                        .apply { cursor?.let { addQueryParameter("cursor", it) } }
+                        .build()
+                    val httpRequest = Request.Builder()
+                        .url(url)
+                        .get()
+                        .build()
+                    
+                    val response = client.newCall(httpRequest).execute()
+                    val responseBody = response.body?.string() ?: ""
+                    
+                    Log.d("ApiService", "Get notifications response code: ${response.code}")
+                    Log.d("ApiService", "Get notifications response body: $responseBody")
+                    
+                    if (!response.isSuccessful) {
+                        return@withContext Result.failure(Exception("Failed to get notifications: ${response.code} - $responseBody"))
+                    }
+                    
                     val jsonResponse = JSONObject(responseBody)
                     val notificationsArray = jsonResponse.getJSONArray("notifications")
-                    val count = jsonResponse.getInt("count")
-                    
-                    val notifications = mutableListOf<NotificationResponse>()
                     for (i in 0 until notificationsArray.length()) {
                         val notifJson = notificationsArray.getJSONObject(i)
                         notifications.add(
@@ -143,11 +168,10 @@ class ApiService(private val context: Context) {
                             )
                         )
                     }
-                    
-                    Result.success(GetNotificationsResponse(notifications, count))
-                } else {
-                    Result.failure(Exception("Failed to get notifications: ${response.code} - $responseBody"))
-                }
+                    cursor = if (jsonResponse.isNull("next_cursor")) null else jsonResponse.getString("next_cursor")
+                } while (cursor != null)
+                
+                Result.success(GetNotificationsResponse(notifications, notifications.size))
             } catch (e: IOException) {
                 Log.e("ApiService", "Network error getting notifications", e)
                 Result.failure(Exception("Network error: ${e.message}"))
@@ -221,8 +245,10 @@ class ApiService(private val context: Context) {
     suspend fun getTones(): Result<List<com.example.nudger.models.ToneOption>> {
         return withContext(Dispatchers.IO) {
             try {
+                // The screen density picks the 1x/2x/3x WebP variant of each tone's image
+                val density = context.resources.displayMetrics.density
                 val httpRequest = Request.Builder()
-                    .url("$baseUrl/tones")
+                    .url("$baseUrl/tones?density=$density")
                     .get()
                     .build()
                 